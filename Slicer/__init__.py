@@ -1,10 +1,14 @@
 import sys
+import atexit
 import os.path
 import argparse
 
 # import pyximport; pyximport.install()
 
 from .stl_data import StlData
+from .mesh_cache import MeshCache
+from .plate import load_plate, PlateFullError
+from .instrument import instruments, JsonLinesSink, PrometheusFileSink
 from mandoline.slicer import Slicer
 
 
@@ -18,6 +22,18 @@ def main():
                         help='Show sliced paths output in GUI.')
     parser.add_argument('-v', '--verbose', action="store_true",
                         help='Show verbose output.')
+    parser.add_argument('-j', '--jobs', type=int, default=1, metavar="N",
+                        help='Slice layers in N parallel worker processes.')
+    parser.add_argument('--no-cache', action="store_true",
+                        help='Do not use the cache of loaded and validated meshes.')
+    parser.add_argument('--cache-dir', metavar="DIR",
+                        help='Directory for the mesh cache.  Default: $SLICER_CACHE_DIR or ~/.cache/slicer/meshes')
+    parser.add_argument('--cache-size', type=int, default=1024, metavar="MB",
+                        help='Maximum size of the mesh cache, in megabytes.')
+    parser.add_argument('--stats-jsonl', metavar="FILE",
+                        help='Append stage timing and progress events to FILE as JSON lines.')
+    parser.add_argument('--stats-prom', metavar="FILE",
+                        help='Write stage timings to FILE in Prometheus text format on exit.')
 
     parser.add_argument('--no-raft', dest="set_option", action="append_const",
                         const="adhesion_type=None", help='Force adhesion to not be generated.')
@@ -46,15 +62,45 @@ def main():
                         help='Display help for all slicing options.')
     parser.add_argument('--show-configs', action="store_true",
                         help='Display values of all slicing options.')
-    parser.add_argument('infile', nargs="?", help='Input STL filename.')
+    parser.add_argument('--bed-size', default="200x200", metavar="WxD",
+                        help='Bed size in mm to pack multiple input models onto.  Default: %(default)s')
+    parser.add_argument('--plate-spacing', type=float, default=5.0, metavar="MM",
+                        help='Gap between models packed onto the bed.')
+    parser.add_argument('infile', nargs="*",
+                        help='Input STL filename.  Several files are packed onto one plate and sliced together.')
     args = parser.parse_args()
 
-    stl = StlData()
+    if args.stats_jsonl:
+        instruments.add_sink(JsonLinesSink(args.stats_jsonl))
+    if args.stats_prom:
+        instruments.add_sink(PrometheusFileSink(instruments, args.stats_prom))
+    # Sinks write out their data on exit, even after a failed validation.
+    atexit.register(instruments.close)
+
+    cache = None
+    if not args.no_cache:
+        cache = MeshCache(args.cache_dir, max_bytes=args.cache_size * 1024 * 1024)
+    stl = StlData(cache=cache)
+    infile = " ".join(args.infile)
+    if len(args.infile) > 1:
+        try:
+            bed_size = [float(v) for v in args.bed_size.lower().split("x")]
+        except ValueError:
+            bed_size = []
+        if len(bed_size) != 2:
+            print("Bad bed size: {}".format(args.bed_size))
+            sys.exit(-1)
+        try:
+            stl, models = load_plate(args.infile, bed_size, args.plate_spacing, cache=cache)
+        except PlateFullError as e:
+            print(e)
+            sys.exit(-1)
+    elif args.infile:
+        stl.read_file(infile)
     if args.infile:
-        stl.read_file(args.infile)
         if args.verbose:
             print("Read {0} ({4} facets, {1:.1f} x {2:.1f} x {3:.1f})".format(
-                args.infile,
+                infile,
                 stl.points.maxx - stl.points.minx,
                 stl.points.maxy - stl.points.miny,
                 stl.points.maxz - stl.points.minz,
@@ -65,7 +111,7 @@ def main():
             manifold = True
             manifold = stl.check_manifold(verbose=args.verbose)
             if manifold and (args.verbose or args.gui_display):
-                print("{} is manifold.".format(args.infile))
+                print("{} is manifold.".format(infile))
             if not manifold:
                 sys.exit(-1)
 
@@ -102,9 +148,35 @@ def main():
         if args.outfile:
             outfile = args.outfile
         else:
-            outfile = os.path.splitext(args.infile)[0] + ".gcode"
+            outfile = os.path.splitext(args.infile[0])[0] + ".gcode"
+        zs = []
+        if args.jobs > 1:
+            # Pre-slice every layer in parallel.  The slicer's own layer loop
+            # then picks the results up from StlData.slice_at_z().  The model
+            # is placed and the layers are picked just as slice_to_file()
+            # does, so that it doesn't move the model and drop the slices.
+            layer_h = float(slicer.conf['layer_height'])
+            height = stl.points.maxz - stl.points.minz
+            stl.center((
+                float(slicer.conf['bed_center_x']),
+                float(slicer.conf['bed_center_y']),
+                height / 2.0,
+            ))
+            zs = [layer_h * (layer + 1) - layer_h / 2.0 for layer in range(int(height / layer_h))]
+            stl.slice_layers(zs, layer_h, jobs=args.jobs)
+            instruments.counters.pop("slice_cache_hits", None)
         slicer.slice_to_file(outfile, showgui=args.gui_display)
-
+        if zs:
+            reused = instruments.counters.get("slice_cache_hits", 0)
+            if reused < len(zs):
+                print("Warning: only {0} of {1} pre-sliced layers were reused.".format(reused, len(zs)))
+            elif args.verbose:
+                print("Reused all {0} pre-sliced layers.".format(len(zs)))
+
+    if args.verbose:
+        for name, stats in sorted(instruments.as_dict()["stages"].items()):
+            print("{0:>12s}: {1:8.3f}s in {2} runs, {3} items".format(
+                name, stats["seconds"], stats["calls"], stats["items"]))
     sys.exit(0)
 
 
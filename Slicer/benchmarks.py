@@ -0,0 +1,298 @@
+"""
+Benchmarks of the slicing pipeline on synthetic meshes.
+
+Run as:
+    python -m Slicer.benchmarks --save base.json
+    python -m Slicer.benchmarks --baseline base.json
+
+Each case builds a synthetic mesh (see synthetic.py), writes it to a
+temporary binary STL file, and times the read_file, check_manifold,
+assign_layers and slice_at_z stages of StlData, then the 2D boolean and
+infill operations on the sliced layers.  Peak memory of each stage is
+measured in a second run under tracemalloc, so that tracing doesn't slow
+the timed run.  Results can be saved as a JSON baseline, and compared to
+one, with stages that got slower or bigger than the threshold reported as
+regressions, and a non-zero exit status.
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+import json
+import math
+import time
+import platform
+import argparse
+import tempfile
+import tracemalloc
+
+import numpy as np
+
+from . import infill
+from . import synthetic
+from . import geometry2d
+from .stl_data import StlData
+
+
+FORMAT_VERSION = 1
+
+STAGES = (
+    "read_file", "check_manifold", "assign_layers", "slice_at_z",
+    "booleans", "infill",
+)
+
+# Changes smaller than these are noise, whatever the threshold.
+MIN_SECONDS = 0.02
+MIN_BYTES = 1 << 20
+
+
+def parse_size(text):
+    """Parses a facet count like "10k" or "5m"."""
+    text = text.strip().lower()
+    scale = {"k": 1000, "m": 1000000}.get(text[-1:], 1)
+    if scale > 1:
+        text = text[:-1]
+    return int(float(text) * scale)
+
+
+def format_size(facets):
+    if facets >= 1000000 and facets % 1000000 == 0:
+        return "{0}m".format(facets // 1000000)
+    if facets >= 1000 and facets % 1000 == 0:
+        return "{0}k".format(facets // 1000)
+    return str(facets)
+
+
+class StageMeter(object):
+    """Times stages, and optionally traces their peak memory use."""
+
+    def __init__(self, trace=False):
+        self.trace = trace
+        self.seconds = {}
+        self.peak_bytes = {}
+
+    def run(self, name, func, *args):
+        if self.trace:
+            tracemalloc.reset_peak()
+            base = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        result = func(*args)
+        self.seconds[name] = time.perf_counter() - start
+        if self.trace:
+            self.peak_bytes[name] = tracemalloc.get_traced_memory()[1] - base
+        return result
+
+
+def _slice_heights(stl, layer_h, max_layers):
+    verts = stl.mesh.build().vertices
+    if not len(verts):
+        return []
+    zmin = float(verts[:, 2].min())
+    zmax = float(verts[:, 2].max())
+    first = int(math.floor(zmin / layer_h))
+    last = int(math.ceil(zmax / layer_h))
+    zs = [(k + 0.5) * layer_h for k in range(first, last)]
+    zs = [z for z in zs if zmin < z < zmax]
+    if len(zs) > max_layers:
+        pick = np.linspace(0, len(zs) - 1, max_layers).round().astype(int)
+        zs = [zs[i] for i in pick.tolist()]
+    return zs
+
+
+def _slice_all(stl, zs, layer_h):
+    return [stl.slice_at_z(z, layer_h)[0] for z in zs]
+
+
+def _booleans(layers, ewidth):
+    """Perimeter and overhang style boolean work on each sliced layer."""
+    regions = []
+    below = geometry2d.ClipperPaths()
+    for paths in layers:
+        outline = geometry2d.orient_paths(geometry2d.ClipperPaths.from_float(paths))
+        shells = geometry2d.offsets(outline, [-0.5 * ewidth, -1.5 * ewidth, -2.5 * ewidth])
+        region = geometry2d.offset(outline, -3.0 * ewidth)
+        geometry2d.diff(outline, region)
+        geometry2d.diff(outline, geometry2d.offset(below, ewidth))
+        geometry2d.union_all(shells)
+        below = outline
+        regions.append(region)
+    return regions
+
+
+def _infill(regions, ewidth, density=0.2):
+    spacing = 2.0 * ewidth / density
+    count = 0
+    for region in regions:
+        if not region:
+            continue
+        lines = infill.pattern_lines("grid", region.bounds(), 45.0, spacing)
+        count += len(geometry2d.clip_lines(lines, region))
+    return count
+
+
+def run_stages(filename, layer_h=0.2, ewidth=0.4, max_layers=100, trace=False):
+    """
+    Runs the benchmarked stages on an STL file.  Returns a StageMeter with
+    the seconds, and if traced the peak bytes allocated, of each stage.
+    """
+    meter = StageMeter(trace)
+    stl = StlData()
+    meter.run("read_file", stl.read_file, filename)
+    meter.run("check_manifold", stl.check_manifold)
+    meter.run("assign_layers", stl.assign_layers, layer_h)
+    zs = _slice_heights(stl, layer_h, max_layers)
+    layers = meter.run("slice_at_z", _slice_all, stl, zs, layer_h)
+    regions = meter.run("booleans", _booleans, layers, ewidth)
+    meter.run("infill", _infill, regions, ewidth)
+    meter.layers = len(zs)
+    return meter
+
+
+def run_case(kind, facets, repeat=1, memory=True, **kwargs):
+    """
+    Benchmarks one synthetic mesh.  Stage times are the best of repeat
+    runs.  Returns a JSON serializable dict of the results.
+    """
+    normals, verts = synthetic.make_mesh(kind, facets)
+    fd, filename = tempfile.mkstemp(suffix=".stl", prefix="slicer-bench-")
+    os.close(fd)
+    try:
+        synthetic.write_binary_stl(filename, normals, verts)
+        del normals, verts
+        stages = dict((name, {"seconds": None}) for name in STAGES)
+        for i in range(repeat):
+            meter = run_stages(filename, **kwargs)
+            for name, secs in meter.seconds.items():
+                best = stages[name]["seconds"]
+                if best is None or secs < best:
+                    stages[name]["seconds"] = secs
+        if memory:
+            tracemalloc.start()
+            try:
+                traced = run_stages(filename, trace=True, **kwargs)
+            finally:
+                tracemalloc.stop()
+            for name, peak in traced.peak_bytes.items():
+                stages[name]["peak_bytes"] = peak
+        return {
+            "kind": kind,
+            "target_facets": facets,
+            "facets": int(os.path.getsize(filename) - 84) // 50,
+            "layers": meter.layers,
+            "stages": stages,
+        }
+    finally:
+        os.unlink(filename)
+
+
+def run_benchmarks(kinds, sizes, repeat=1, memory=True, log=None, **kwargs):
+    """Runs every kind of mesh at every size, and returns the results dict."""
+    cases = {}
+    for facets in sizes:
+        for kind in kinds:
+            name = "{0}-{1}".format(kind, format_size(facets))
+            cases[name] = run_case(kind, facets, repeat=repeat, memory=memory, **kwargs)
+            if log is not None:
+                log(name, cases[name])
+    return {
+        "version": FORMAT_VERSION,
+        "created": time.time(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "settings": dict(kwargs, repeat=repeat),
+        "cases": cases,
+    }
+
+
+def compare(results, baseline, threshold=0.25):
+    """
+    Compares results to a baseline results dict.  A stage regressed if it
+    took, or peaked at, more than (1 + threshold) times the baseline, and
+    the change is above the noise floor.  Returns a list of
+    (case, stage, measure, old, new) tuples for the regressions.
+    """
+    regressions = []
+    for name, case in sorted(results["cases"].items()):
+        base = baseline.get("cases", {}).get(name)
+        if base is None:
+            continue
+        for stage, stats in sorted(case["stages"].items()):
+            old_stats = base["stages"].get(stage, {})
+            for measure, floor in (("seconds", MIN_SECONDS), ("peak_bytes", MIN_BYTES)):
+                old = old_stats.get(measure)
+                new = stats.get(measure)
+                if old is None or new is None:
+                    continue
+                if new > old * (1.0 + threshold) and new - old > floor:
+                    regressions.append((name, stage, measure, old, new))
+    return regressions
+
+
+def _print_case(name, case):
+    print("{0}: {1} facets, {2} layers".format(name, case["facets"], case["layers"]))
+    for stage in STAGES:
+        stats = case["stages"][stage]
+        line = "    {0:<16s}{1:10.4f} s".format(stage, stats["seconds"])
+        if "peak_bytes" in stats:
+            line += "{0:10.1f} MB".format(stats["peak_bytes"] / 1048576.0)
+        print(line)
+    sys.stdout.flush()
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='python -m Slicer.benchmarks')
+    parser.add_argument('-k', '--kinds', default=",".join(synthetic.KINDS),
+                        help='Comma separated mesh kinds to run.  Default: %(default)s')
+    parser.add_argument('-s', '--sizes', default="10k,100k,1m",
+                        help='Comma separated facet counts, like 10k,5m.  Default: %(default)s')
+    parser.add_argument('-r', '--repeat', type=int, default=1,
+                        help='Keep the best time of N runs of each case.')
+    parser.add_argument('-l', '--max-layers', type=int, default=100,
+                        help='Slice at most N evenly spread layers per case.')
+    parser.add_argument('--layer-height', type=float, default=0.2)
+    parser.add_argument('--no-memory', action="store_true",
+                        help='Skip the traced run that measures peak memory.')
+    parser.add_argument('--save', metavar="FILE",
+                        help='Save the results as a JSON baseline.')
+    parser.add_argument('--baseline', metavar="FILE",
+                        help='Compare the results to a saved JSON baseline.')
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help='Fraction a stage may grow by before it is a regression.')
+    args = parser.parse_args()
+
+    kinds = [k.strip() for k in args.kinds.split(",") if k.strip()]
+    for kind in kinds:
+        if kind not in synthetic.KINDS:
+            parser.error("Unknown mesh kind: {0}".format(kind))
+    sizes = [parse_size(s) for s in args.sizes.split(",") if s.strip()]
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    results = run_benchmarks(
+        kinds, sizes, repeat=args.repeat, memory=not args.no_memory,
+        log=_print_case, layer_h=args.layer_height, max_layers=args.max_layers,
+    )
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    if baseline is not None:
+        if baseline.get("settings") != results["settings"]:
+            print("Warning: baseline was run with different settings: {0}".format(baseline.get("settings")))
+        regressions = compare(results, baseline, args.threshold)
+        for name, stage, measure, old, new in regressions:
+            print("REGRESSION {0} {1} {2}: {3:.4g} -> {4:.4g} ({5:+.0f}%)".format(
+                name, stage, measure, old, new, 100.0 * (new - old) / old))
+        if regressions:
+            sys.exit(1)
+        print("No regressions against {0}".format(args.baseline))
+
+
+if __name__ == "__main__":
+    main()
+
+
+# vim: expandtab tabstop=4 shiftwidth=4 softtabstop=4 nowrap
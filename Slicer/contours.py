@@ -0,0 +1,139 @@
+import numpy as np
+
+
+def endpoint_keys(segments, precision=3):
+    """
+    Returns an Nx2 array of integer keys for the start and end points of an
+    Nx2x2 segment array.  Points that are equal once rounded to the given
+    number of decimal places get the same key.
+    """
+    q = np.round(np.asarray(segments, dtype=np.float64) * 10 ** precision)
+    q = q.astype(np.int64)
+    return (q[:, :, 0] << 32) + (q[:, :, 1] & 0xffffffff)
+
+
+def _take(table, key, used):
+    """Pops and returns an unused segment index listed under key, or None."""
+    lst = table.get(key)
+    while lst:
+        idx = lst.pop()
+        if not used[idx]:
+            used[idx] = True
+            return idx
+    return None
+
+
+def _join_chains(chains):
+    """
+    Joins open chains whose ends meet, reversing one of them where their
+    directions disagree.  Each chain is [start key, end key, points].
+    Returns (loops, chains) of point lists.
+    """
+    alive = [True] * len(chains)
+    by_key = {}
+    for i, (skey, ekey, _) in enumerate(chains):
+        by_key.setdefault(skey, []).append(i)
+        by_key.setdefault(ekey, []).append(i)
+
+    def partner(i, key):
+        # Keys of ends that have since been joined stay listed, so only a
+        # chain that still ends at key is a partner.
+        lst = by_key.get(key, [])
+        for j in lst:
+            if j != i and alive[j] and key in (chains[j][0], chains[j][1]):
+                return j
+        return None
+
+    loops = []
+    for i in range(len(chains)):
+        while alive[i]:
+            skey, ekey, pts = chains[i]
+            j = partner(i, ekey)
+            if j is None:
+                j = partner(i, skey)
+                if j is None:
+                    break
+            oskey, oekey, opts = chains[j]
+            alive[j] = False
+            if ekey == oskey:
+                pts, ekey = pts + opts[1:], oekey
+            elif ekey == oekey:
+                pts, ekey = pts + opts[-2::-1], oskey
+            elif skey == oekey:
+                pts, skey = opts + pts[1:], oskey
+            else:
+                pts, skey = opts[::-1] + pts[1:], oekey
+            chains[i] = [skey, ekey, pts]
+            by_key.setdefault(skey, []).append(i)
+            by_key.setdefault(ekey, []).append(i)
+            if skey == ekey:
+                alive[i] = False
+                loops.append(pts)
+    return loops, [c[2] for i, c in enumerate(chains) if alive[i]]
+
+
+def assemble_contours(segments, precision=3):
+    """
+    Joins an Nx2x2 array of directed XY segments into paths, matching
+    endpoints by quantized integer keys.  Each segment is linked to the
+    next one that starts where it ends, so this runs in linear time.
+    Chains that still don't close are joined end to end, reversing one of
+    them if needed.  Returns (outpaths, deadpaths): the closed loops, and
+    the chains that could not be closed, as lists of (x, y) tuples.
+    """
+    segments = np.asarray(segments, dtype=np.float64).reshape(-1, 2, 2)
+    n = len(segments)
+    if not n:
+        return [], []
+    keys = endpoint_keys(segments, precision)
+    skeys = keys[:, 0].tolist()
+    ekeys = keys[:, 1].tolist()
+    pts = [
+        (tuple(p1), tuple(p2))
+        for p1, p2 in segments.tolist()
+    ]
+    starts = {}
+    ends = {}
+    for idx in range(n - 1, -1, -1):
+        starts.setdefault(skeys[idx], []).append(idx)
+        ends.setdefault(ekeys[idx], []).append(idx)
+
+    used = [False] * n
+    outpaths = []
+    chains = []
+    for seed in range(n):
+        if used[seed]:
+            continue
+        used[seed] = True
+        chain = [seed]
+        first_key = skeys[seed]
+        key = ekeys[seed]
+        while key != first_key:
+            idx = _take(starts, key, used)
+            if idx is None:
+                break
+            chain.append(idx)
+            key = ekeys[idx]
+        if key != first_key:
+            back = []
+            while first_key != key:
+                idx = _take(ends, first_key, used)
+                if idx is None:
+                    break
+                back.append(idx)
+                first_key = skeys[idx]
+            back.reverse()
+            chain = back + chain
+        path = [pts[chain[0]][0]]
+        path.extend(pts[idx][1] for idx in chain)
+        if key == first_key:
+            outpaths.append(path)
+        else:
+            chains.append([first_key, key, path])
+
+    loops, deadpaths = _join_chains(chains)
+    outpaths.extend(loops)
+    return outpaths, deadpaths
+
+
+# vim: expandtab tabstop=4 shiftwidth=4 softtabstop=4 nowrap
@@ -14,6 +14,8 @@ from .line_segment3d import LineSegment3D
 class Facet3D(object):
     """Class to represent a 3D triangular face."""
 
+    __slots__ = ("vertices", "norm", "count")
+
     def __init__(self, v1, v2, v3, norm):
         for x in [v1, v2, v3, norm]:
             try:
@@ -26,22 +28,40 @@ class Facet3D(object):
                 if not isinstance(y, numbers.Real):
                     raise TypeError('Expected 3D vector.')
         verts = [
-            Point3D(v1),
-            Point3D(v2),
-            Point3D(v3)
+            Point3D.from_tuple(tuple(v1)),
+            Point3D.from_tuple(tuple(v2)),
+            Point3D.from_tuple(tuple(v3))
         ]
         # Re-order vertices in a normalized order.
         while verts[0] > verts[1] or verts[0] > verts[2]:
             verts = verts[1:] + verts[:1]
         self.vertices = verts
-        self.norm = Vector(norm)
+        self.norm = Vector.from_tuple(tuple(norm))
         self.count = 1
         self.fixup_normal()
 
+    @classmethod
+    def from_normalized(cls, verts, norm, count=1):
+        """
+        Create a facet from vertices that are already in normalized order
+        and winding, skipping validation.  Used by array-backed meshes.
+        """
+        facet = cls.__new__(cls)
+        facet.vertices = [Point3D.from_tuple(tuple(v)) for v in verts]
+        facet.norm = Vector.from_tuple(tuple(norm))
+        facet.count = count
+        return facet
+
     def __len__(self):
         """Length of sequence.  Three vertices and a normal."""
         return 4
 
+    def __getstate__(self):
+        return (self.vertices, self.norm, self.count)
+
+    def __setstate__(self, state):
+        self.vertices, self.norm, self.count = state
+
     def __getitem__(self, idx):
         """Get vertices and normal by index."""
         lst = self.vertices + [self.norm]
@@ -49,7 +69,7 @@ class Facet3D(object):
 
     def __hash__(self):
         """Returns hash value for facet"""
-        return hash((self.verts, self.norm))
+        return hash((tuple(self.vertices), self.norm))
 
     def __lt__(self, other):
         return self.__cmp__(other) < 0
@@ -140,7 +160,7 @@ class Facet3D(object):
         return path
 
     def overhang_angle(self):
-        vert = Vector([0.0, 0.0, -1.0])
+        vert = Vector.from_tuple((0.0, 0.0, -1.0))
         ang = vert.angle(self.norm) * 180.0 / math.pi
         return (90.0 - ang)
 
@@ -208,8 +228,8 @@ class Facet3D(object):
         Returns true if the three vertices of the face are in clockwise
         order with respect to the normal vector.
         """
-        v1 = Vector(self.vertices[1]-self.vertices[0])
-        v2 = Vector(self.vertices[2]-self.vertices[0])
+        v1 = Vector.from_tuple((self.vertices[1]-self.vertices[0])._values)
+        v2 = Vector.from_tuple((self.vertices[2]-self.vertices[0])._values)
         return self.norm.dot(v1.cross(v2)) < 0
 
     def fixup_normal(self):
@@ -225,8 +245,8 @@ class Facet3D(object):
         else:
             # If no normal was specified, we should calculate it, relative
             # to the counter-clockwise vertices (as seen from outside).
-            v1 = Vector(self.vertices[2] - self.vertices[0])
-            v2 = Vector(self.vertices[1] - self.vertices[0])
+            v1 = Vector.from_tuple((self.vertices[2] - self.vertices[0])._values)
+            v2 = Vector.from_tuple((self.vertices[1] - self.vertices[0])._values)
             self.norm = v1.cross(v2)
             if self.norm.length() > 1e-6:
                 self.norm = self.norm.normalize()
@@ -1,82 +1,181 @@
-import math
-
+import numpy as np
 import pyclipper
 
+from . import infill
+from .instrument import timed
+from .nesting import nest_paths
+
 
 SCALING_FACTOR = 1000
 
 
-def offset(paths, amount):
+class ClipperPaths(list):
+    """
+    List of paths kept in Clipper's integer coordinates, which are the float
+    coordinates times SCALING_FACTOR.  The offset(), union(), diff() and
+    clip() functions return ClipperPaths when given them, so a chain of
+    operations only converts to and from floats at its ends.
+    """
+
+    @classmethod
+    def from_float(cls, paths):
+        """Converts a list of float paths to Clipper coordinates."""
+        if isinstance(paths, ClipperPaths):
+            return paths
+        if not paths:
+            return cls()
+        return cls(pyclipper.scale_to_clipper(paths, SCALING_FACTOR))
+
+    def to_float(self):
+        """Converts the paths back to a list of float paths."""
+        if not self:
+            return []
+        return pyclipper.scale_from_clipper(list(self), SCALING_FACTOR)
+
+    def contains(self, pt):
+        """Returns True if the float point pt is inside an odd number of the paths."""
+        pt = pyclipper.scale_to_clipper([pt], SCALING_FACTOR)[0]
+        cnt = 0
+        for path in self:
+            if pyclipper.PointInPolygon(pt, path):
+                cnt = 1 - cnt
+        return cnt % 2 != 0
+
+    def bounds(self):
+        """Returns the (minx, miny, maxx, maxy) bounds, in float coordinates."""
+        return tuple(v / float(SCALING_FACTOR) for v in paths_bounds(self))
+
+
+def _to_clipper(paths):
+    if isinstance(paths, ClipperPaths):
+        return paths
+    return pyclipper.scale_to_clipper(paths, SCALING_FACTOR)
+
+
+def _from_clipper(paths, as_int):
+    """Returns Clipper result paths as ClipperPaths, or scaled back to floats."""
+    if as_int:
+        return ClipperPaths(paths)
+    return pyclipper.scale_from_clipper(paths, SCALING_FACTOR)
+
+
+def _as_result(paths, as_int):
+    """Returns input paths unchanged, but as the same kind as the result."""
+    if as_int:
+        return ClipperPaths.from_float(paths)
+    if isinstance(paths, ClipperPaths):
+        return paths.to_float()
+    return paths
+
+
+@timed("offset")
+def offsets(paths, amounts):
+    """
+    Offsets the same paths by each of a list of amounts.  The paths are
+    converted and added to the offsetter once, and then it is run for each
+    amount.  Returns a list of path lists, in the same order as amounts.
+    """
+    as_int = isinstance(paths, ClipperPaths)
     pco = pyclipper.PyclipperOffset()
     pco.ArcTolerance = SCALING_FACTOR / 40
-    paths = pyclipper.scale_to_clipper(paths, SCALING_FACTOR)
-    pco.AddPaths(paths, pyclipper.JT_SQUARE, pyclipper.ET_CLOSEDPOLYGON)
-    outpaths = pco.Execute(amount * SCALING_FACTOR)
-    outpaths = pyclipper.scale_from_clipper(outpaths, SCALING_FACTOR)
-    return outpaths
+    pco.AddPaths(_to_clipper(paths), pyclipper.JT_SQUARE, pyclipper.ET_CLOSEDPOLYGON)
+    return [
+        _from_clipper(pco.Execute(amount * SCALING_FACTOR), as_int)
+        for amount in amounts
+    ]
+
+
+def offset(paths, amount):
+    return offsets(paths, [amount])[0]
 
 
+@timed("boolean")
 def union(paths1, paths2):
+    as_int = isinstance(paths1, ClipperPaths) or isinstance(paths2, ClipperPaths)
     if not paths1:
-        return paths2
+        return _as_result(paths2, as_int)
     if not paths2:
-        return paths1
+        return _as_result(paths1, as_int)
     pc = pyclipper.Pyclipper()
     if paths1:
         if paths1[0][0] in (int, float):
             raise pyclipper.ClipperException()
-        paths1 = pyclipper.scale_to_clipper(paths1, SCALING_FACTOR)
+        paths1 = _to_clipper(paths1)
         pc.AddPaths(paths1, pyclipper.PT_SUBJECT, True)
     if paths2:
         if paths2[0][0] in (int, float):
             raise pyclipper.ClipperException()
-        paths2 = pyclipper.scale_to_clipper(paths2, SCALING_FACTOR)
+        paths2 = _to_clipper(paths2)
         pc.AddPaths(paths2, pyclipper.PT_CLIP, True)
     try:
         outpaths = pc.Execute(pyclipper.CT_UNION, pyclipper.PFT_EVENODD, pyclipper.PFT_EVENODD)
     except:
         print("paths1={}".format(paths1))
         print("paths2={}".format(paths2))
-    outpaths = pyclipper.scale_from_clipper(outpaths, SCALING_FACTOR)
+    outpaths = _from_clipper(outpaths, as_int)
     return outpaths
 
 
+@timed("boolean")
+def union_all(pathsets):
+    """
+    Unions any number of path lists in one Clipper run, instead of a chain
+    of pairwise union() calls.  Returns ClipperPaths if any input is one.
+    """
+    pathsets = [paths for paths in pathsets if paths]
+    as_int = any(isinstance(paths, ClipperPaths) for paths in pathsets)
+    if len(pathsets) < 2:
+        return _as_result(pathsets[0] if pathsets else [], as_int)
+    pc = pyclipper.Pyclipper()
+    pc.AddPaths(_to_clipper(pathsets[0]), pyclipper.PT_SUBJECT, True)
+    for paths in pathsets[1:]:
+        pc.AddPaths(_to_clipper(paths), pyclipper.PT_CLIP, True)
+    outpaths = pc.Execute(pyclipper.CT_UNION, pyclipper.PFT_EVENODD, pyclipper.PFT_EVENODD)
+    return _from_clipper(outpaths, as_int)
+
+
+@timed("boolean")
 def diff(subj, clip_paths, subj_closed=True):
+    as_int = isinstance(subj, ClipperPaths) or isinstance(clip_paths, ClipperPaths)
     if not subj:
-        return []
+        return _as_result([], as_int)
     if not clip_paths:
-        return subj
+        return _as_result(subj, as_int)
     pc = pyclipper.Pyclipper()
     if subj:
-        subj = pyclipper.scale_to_clipper(subj, SCALING_FACTOR)
+        subj = _to_clipper(subj)
         pc.AddPaths(subj, pyclipper.PT_SUBJECT, subj_closed)
     if clip_paths:
-        clip_paths = pyclipper.scale_to_clipper(clip_paths, SCALING_FACTOR)
+        clip_paths = _to_clipper(clip_paths)
         pc.AddPaths(clip_paths, pyclipper.PT_CLIP, True)
     outpaths = pc.Execute(pyclipper.CT_DIFFERENCE, pyclipper.PFT_EVENODD, pyclipper.PFT_EVENODD)
-    outpaths = pyclipper.scale_from_clipper(outpaths, SCALING_FACTOR)
+    outpaths = _from_clipper(outpaths, as_int)
     return outpaths
 
 
+@timed("boolean")
 def clip(subj, clip_paths, subj_closed=True):
+    as_int = isinstance(subj, ClipperPaths) or isinstance(clip_paths, ClipperPaths)
     if not subj:
-        return []
+        return _as_result([], as_int)
     if not clip_paths:
-        return []
+        return _as_result([], as_int)
     pc = pyclipper.Pyclipper()
     if subj:
-        subj = pyclipper.scale_to_clipper(subj, SCALING_FACTOR)
+        subj = _to_clipper(subj)
         pc.AddPaths(subj, pyclipper.PT_SUBJECT, subj_closed)
     if clip_paths:
-        clip_paths = pyclipper.scale_to_clipper(clip_paths, SCALING_FACTOR)
+        clip_paths = _to_clipper(clip_paths)
         pc.AddPaths(clip_paths, pyclipper.PT_CLIP, True)
     out_tree = pc.Execute2(pyclipper.CT_INTERSECTION, pyclipper.PFT_EVENODD, pyclipper.PFT_EVENODD)
     outpaths = pyclipper.PolyTreeToPaths(out_tree)
-    outpaths = pyclipper.scale_from_clipper(outpaths, SCALING_FACTOR)
+    outpaths = _from_clipper(outpaths, as_int)
     return outpaths
 
 
 def paths_contain(pt, paths):
+    if isinstance(paths, ClipperPaths):
+        return paths.contains(pt)
     cnt = 0
     pt = pyclipper.scale_to_clipper([pt], SCALING_FACTOR)[0]
     for path in paths:
@@ -95,13 +194,30 @@ def orient_path(path, dir):
     return path
 
 
-def orient_paths(paths):
+@timed("orient")
+def orient_paths_tree(paths):
+    """
+    Orients closed paths by how deeply they nest: outlines counter-clockwise
+    and holes clockwise, alternating with each level.  Returns (paths,
+    parents), where parents gives the index of the path directly enclosing
+    each path, or -1 for outermost paths.  Takes and returns float paths or
+    ClipperPaths.
+    """
+    as_int = isinstance(paths, ClipperPaths)
+    ipaths = ClipperPaths.from_float(paths)
+    parents, depths, areas = nest_paths(ipaths)
     out = []
-    while paths:
-        path = paths.pop(0)
-        path = orient_path(path, not paths_contain(path[0], paths))
+    for path, depth, area in zip(paths, depths.tolist(), areas.tolist()):
+        if (area >= 0) != (depth % 2 == 0):
+            path = path[::-1]
         out.append(path)
-    return out
+    if as_int:
+        out = ClipperPaths(out)
+    return out, parents.tolist()
+
+
+def orient_paths(paths):
+    return orient_paths_tree(paths)[0]
 
 
 def paths_bounds(paths):
@@ -138,93 +254,105 @@ def close_paths(paths):
 ############################################################
 
 
+@timed("infill")
+def clip_lines(lines, clip_paths):
+    """
+    Clips an infill LineSet to a region in one Clipper run.  The lines are
+    converted to Clipper coordinates in one array operation.  Returns open
+    paths, as ClipperPaths if clip_paths is one, or else as float paths.
+    """
+    as_int = isinstance(clip_paths, ClipperPaths)
+    if not len(lines) or not clip_paths:
+        return _as_result([], as_int)
+    pts = (lines.points * SCALING_FACTOR).astype(np.int64).tolist()
+    offs = lines.offsets.tolist()
+    subj = [pts[offs[i]:offs[i + 1]] for i in range(len(lines))]
+    pc = pyclipper.Pyclipper()
+    pc.AddPaths(subj, pyclipper.PT_SUBJECT, False)
+    pc.AddPaths(_to_clipper(clip_paths), pyclipper.PT_CLIP, True)
+    out_tree = pc.Execute2(pyclipper.CT_INTERSECTION, pyclipper.PFT_EVENODD, pyclipper.PFT_EVENODD)
+    return _from_clipper(pyclipper.PolyTreeToPaths(out_tree), as_int)
+
+
 def make_infill_pat(rect, baseang, spacing, rots):
-    minx, miny, maxx, maxy = rect
-    w = maxx - minx
-    h = maxy - miny
-    cx = math.floor((maxx + minx)/2.0/spacing)*spacing
-    cy = math.floor((maxy + miny)/2.0/spacing)*spacing
-    r = math.hypot(w, h) / math.sqrt(2)
-    n = int(math.ceil(r / spacing))
-    out = []
-    for rot in rots:
-        c1 = math.cos((baseang+rot)*math.pi/180.0)
-        s1 = math.sin((baseang+rot)*math.pi/180.0)
-        c2 = math.cos((baseang+rot+90)*math.pi/180.0) * spacing
-        s2 = math.sin((baseang+rot+90)*math.pi/180.0) * spacing
-        for i in range(1-n, n):
-            cp = (cx + c2 * i, cy + s2 * i)
-            line = [
-                (cp[0] + r  * c1, cp[1] + r * s1),
-                (cp[0] - r  * c1, cp[1] - r * s1)
-            ]
-            out.append( line )
-    return out
+    sets = [infill.pattern_lines("lines", rect, baseang + rot, spacing) for rot in rots]
+    return infill.LineSet.concatenate(sets).to_paths()
 
 
-def make_infill_lines(rect, base_ang, density, ewidth):
+def _infill_spacing(density, ewidth, lines_per_cell):
     if density <= 0.0:
-        return []
+        return None
     if density > 1.0:
         density = 1.0
-    spacing = ewidth / density
-    return make_infill_pat(rect, base_ang, spacing, [0])
+    return lines_per_cell * ewidth / density
+
+
+def make_infill_lines(rect, base_ang, density, ewidth):
+    spacing = _infill_spacing(density, ewidth, 1.0)
+    if spacing is None:
+        return []
+    return infill.pattern_lines("lines", rect, base_ang, spacing).to_paths()
 
 
 def make_infill_triangles(rect, base_ang, density, ewidth):
-    if density <= 0.0:
+    spacing = _infill_spacing(density, ewidth, 3.0)
+    if spacing is None:
         return []
-    if density > 1.0:
-        density = 1.0
-    spacing = 3.0 * ewidth / density
-    return make_infill_pat(rect, base_ang, spacing, [0, 60, 120])
+    return infill.pattern_lines("triangles", rect, base_ang, spacing).to_paths()
 
 
 def make_infill_grid(rect, base_ang, density, ewidth):
-    if density <= 0.0:
+    spacing = _infill_spacing(density, ewidth, 2.0)
+    if spacing is None:
         return []
-    if density > 1.0:
-        density = 1.0
-    spacing = 2.0 * ewidth / density
-    return make_infill_pat(rect, base_ang, spacing, [0, 90])
+    return infill.pattern_lines("grid", rect, base_ang, spacing).to_paths()
 
 
 def make_infill_hexagons(rect, base_ang, density, ewidth):
-    if density <= 0.0:
+    spacing = _infill_spacing(density, ewidth, 4.0 / 3.0)
+    if spacing is None:
         return []
-    if density > 1.0:
-        density = 1.0
-    ext = 0.5 * ewidth / math.tan(60.0*math.pi/180.0)
-    aspect = 3.0 / math.sin(60.0*math.pi/180.0)
-    col_spacing = ewidth * 4./3. / density
-    row_spacing = col_spacing * aspect
-    minx, maxx, miny, maxy = rect
-    w = maxx - minx
-    h = maxy - miny
-    cx = (maxx + minx)/2.0
-    cy = (maxy + miny)/2.0
-    r = max(w, h) * math.sqrt(2.0)
-    n_col = math.ceil(r / col_spacing)
-    n_row = math.ceil(r / row_spacing)
-    out = []
-    s = math.sin(base_ang*math.pi/180.0)
-    c = math.cos(base_ang*math.pi/180.0)
-    for col in range(-n_col, n_col):
-        path = []
-        base_x = col * col_spacing
-        for row in range(-n_row, n_row):
-            base_y = row * row_spacing
-            x1 = base_x + ewidth/2.0
-            x2 = base_x + col_spacing - ewidth/2.0
-            if col % 2 != 0:
-                x1, x2 = x2, x1
-            path.append((x1, base_y+ext))
-            path.append((x2, base_y+row_spacing/6-ext))
-            path.append((x2, base_y+row_spacing/2+ext))
-            path.append((x1, base_y+row_spacing*2/3-ext))
-        path = [(x*c - y*s, x*s + y*c) for x, y in path]
-        out.append(path)
-    return out
+    return infill.pattern_lines("hexagons", rect, base_ang, spacing, ewidth=ewidth).to_paths()
+
+
+def make_infill_cubic(rect, base_ang, density, ewidth, z):
+    spacing = _infill_spacing(density, ewidth, 3.0)
+    if spacing is None:
+        return []
+    return infill.pattern_lines("cubic", rect, base_ang, spacing, z=z).to_paths()
+
+
+def make_infill_gyroid(rect, base_ang, density, ewidth, z):
+    spacing = _infill_spacing(density, ewidth, 1.0)
+    if spacing is None:
+        return []
+    return infill.pattern_lines("gyroid", rect, base_ang, spacing, z=z).to_paths()
+
+
+def make_adaptive_cubic_infill(region, base_ang, density, ewidth, z, levels=3):
+    """
+    Cubic infill that gets denser towards the walls of the region.  The
+    coarsest level covers the whole region, with lines 2**(levels-1) times
+    further apart than the given density would need.  Each finer level
+    halves the spacing, adding only the lines in between, and is clipped
+    to a band inside the walls half as wide as the level before.  Returns
+    the clipped infill lines, as ClipperPaths if region is one.
+    """
+    spacing = _infill_spacing(density, ewidth, 3.0)
+    as_int = isinstance(region, ClipperPaths)
+    if spacing is None or not region:
+        return _as_result([], as_int)
+    region = ClipperPaths.from_float(region)
+    rect = region.bounds()
+    coarse = spacing * 2 ** (levels - 1)
+    lines = infill.pattern_lines("cubic", rect, base_ang, coarse, z=z)
+    out = list(clip_lines(lines, region))
+    for level in range(1, levels):
+        band = diff(region, offset(region, -coarse / 2 ** (level - 1)))
+        lines = infill.pattern_lines(
+            "cubic", rect, base_ang, coarse / 2 ** level, z=z, skip_multiple=2)
+        out.extend(clip_lines(lines, band))
+    return _as_result(ClipperPaths(out), as_int)
 
 
 # vim: expandtab tabstop=4 shiftwidth=4 softtabstop=4 nowrap
@@ -0,0 +1,578 @@
+import numpy as np
+
+from . import stl_arrays
+from .point3d import Point3D
+from .facet3d import Facet3D
+from .line_segment3d import LineSegment3D
+
+
+def _csr(keys, n):
+    """
+    Groups the positions of an array of integer keys below n into CSR form.
+    Returns (ptr, idx), where idx[ptr[k]:ptr[k+1]] are the positions of key k.
+    """
+    keys = np.asarray(keys).ravel()
+    ptr = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(np.bincount(keys, minlength=n), out=ptr[1:])
+    idx = np.argsort(keys, kind='stable')
+    return ptr, idx
+
+
+def _index_dtype(n):
+    return np.int32 if n < 2**31 else np.int64
+
+
+def normalize_facets(vertices, tris, normals, chunk_size=1 << 16):
+    """
+    Puts an Nx3 triangle index array into the same vertex order and winding
+    that Facet3D uses: the least vertex first, and counter-clockwise relative
+    to the normal.  Zero length normals are calculated from the vertices.
+    The tris and normals arrays are updated in place, a chunk at a time.
+    """
+    for start in range(0, len(tris), chunk_size):
+        t = tris[start:start + chunk_size]
+        n = normals[start:start + chunk_size]
+        # Vertices are welded in Point3D order, so the least index is least.
+        rot = np.argmin(t, axis=1)[:, None]
+        t[:] = np.take_along_axis(t, (rot + np.arange(3)) % 3, axis=1)
+        a = vertices[t[:, 0]]
+        b = vertices[t[:, 1]]
+        c = vertices[t[:, 2]]
+        nlen = np.sqrt(np.einsum('ij,ij->i', n, n))
+        cw = np.einsum('ij,ij->i', n, np.cross(b - a, c - a)) < 0
+        swap = (nlen > 0) & cw
+        t[swap] = t[swap][:, [0, 2, 1]]
+        zero = ~(nlen > 0)
+        if np.any(zero):
+            calc = np.cross(c[zero] - a[zero], b[zero] - a[zero])
+            clen = np.sqrt(np.einsum('ij,ij->i', calc, calc))
+            big = clen > 1e-6
+            calc[big] /= clen[big][:, None]
+            n[zero] = calc
+    return tris, normals
+
+
+class IndexedMesh(object):
+    """
+    Compact array-backed triangle mesh.  Vertices are welded and stored once,
+    facets are rows of vertex indices, and edge adjacency is kept in CSR form.
+    """
+
+    def __init__(self):
+        """Initialize as an empty mesh."""
+        self._transform = None
+        self._bounds = None
+        self.vertices = np.zeros((0, 3), dtype=np.float64)
+        self.triangles = np.zeros((0, 3), dtype=np.int32)
+        self.normals = np.zeros((0, 3), dtype=np.float64)
+        self.facet_counts = np.zeros(0, dtype=np.int32)
+        self.edges = np.zeros((0, 2), dtype=np.int32)
+        self.edge_counts = np.zeros(0, dtype=np.int32)
+        self.facet_edges = np.zeros((0, 3), dtype=np.int32)
+        self._edge_keys = None
+        self._pending = []
+        self._adjacency = {}
+        self.point_view = MeshPoints(self)
+        self.edge_view = MeshEdges(self)
+        self.facet_view = MeshFacets(self)
+
+    @property
+    def vertices(self):
+        """Vx3 vertex coordinates, with any pending transform applied."""
+        if self._transform is not None:
+            self._apply_transform()
+        return self._vertices
+
+    @vertices.setter
+    def vertices(self, value):
+        self._vertices = value
+        self._transform = None
+        self._bounds = None
+        # Vertices in Z, Y, X order, as welded, allow binary search lookups.
+        self.ordered = True
+
+    @property
+    def normals(self):
+        """Nx3 facet normals, with any pending transform applied."""
+        if self._transform is not None:
+            self._apply_transform()
+        return self._normals
+
+    @normals.setter
+    def normals(self, value):
+        self._normals = value
+
+    @property
+    def triangles(self):
+        """Nx3 vertex indices of each facet."""
+        if self._transform is not None:
+            self._apply_transform()
+        return self._triangles
+
+    @triangles.setter
+    def triangles(self, value):
+        self._triangles = value
+
+    @property
+    def bounds(self):
+        """(minx, miny, minz, maxx, maxy, maxz) of all the vertices."""
+        if self._bounds is None:
+            self._update_bounds()
+        return self._bounds
+
+    def add_batch(self, points, tris, normals, counts=None):
+        """
+        Queues a batch of facets for the mesh.  points is a Px3 coordinate
+        array, tris an Nx3 array of indices into it, and normals Nx3.
+        The batch is merged into the mesh arrays by build().
+        """
+        if counts is None:
+            counts = np.ones(len(tris), dtype=np.int32)
+        self._pending.append((
+            np.asarray(points, dtype=np.float64),
+            np.asarray(tris).astype(_index_dtype(len(points))),
+            np.asarray(normals),
+            np.asarray(counts),
+        ))
+
+    def build(self):
+        """Merges any queued facet batches into the mesh arrays."""
+        if not self._pending:
+            return self
+        batches = self._pending
+        self._pending = []
+        if len(self.triangles):
+            batches.insert(0, (
+                self.vertices, self.triangles, self.normals, self.facet_counts
+            ))
+        nverts = sum(len(b[0]) for b in batches)
+        nfacets = sum(len(b[1]) for b in batches)
+        idx_type = _index_dtype(nverts)
+        coords = np.empty((nverts, 3), dtype=np.float64)
+        tris = np.empty((nfacets, 3), dtype=idx_type)
+        normals = np.empty((nfacets, 3), dtype=np.float64)
+        counts = np.empty(nfacets, dtype=np.int32)
+        vpos = fpos = 0
+        while batches:
+            pts, t, n, c = batches.pop(0)
+            coords[vpos:vpos + len(pts)] = pts
+            tris[fpos:fpos + len(t)] = t + vpos
+            normals[fpos:fpos + len(t)] = n
+            counts[fpos:fpos + len(t)] = c
+            vpos += len(pts)
+            fpos += len(t)
+
+        vertices, inverse = stl_arrays.weld_points(coords)
+        del coords
+        np.take(inverse.astype(idx_type), tris, out=tris)
+        del inverse
+        # Drop vertices that no facet uses.
+        used = np.zeros(len(vertices), dtype=bool)
+        used[tris.ravel()] = True
+        vertices = vertices[used]
+        np.take((np.cumsum(used) - 1).astype(idx_type), tris, out=tris)
+        del used
+        normalize_facets(vertices, tris, normals)
+
+        # Merge duplicate facets, keeping the first one's normal.
+        first, inverse = stl_arrays.group_rows(tris)
+        counts = np.bincount(inverse, weights=counts, minlength=len(first))
+        del inverse
+        self.vertices = vertices
+        self.triangles = tris[first]
+        self.normals = normals[first]
+        self.facet_counts = counts.astype(np.int32)
+        del tris, normals, first
+        self._build_edges()
+        return self
+
+    def arrays(self):
+        """Returns the built mesh data as a dict of arrays, for sharing or saving."""
+        self.build()
+        return {
+            "vertices": self.vertices,
+            "triangles": self.triangles,
+            "normals": self.normals,
+            "facet_counts": self.facet_counts,
+            "edges": self.edges,
+            "edge_counts": self.edge_counts,
+            "facet_edges": self.facet_edges,
+        }
+
+    def load_arrays(self, arrays):
+        """
+        Replaces the mesh data with the arrays() dict, without copying them,
+        so memory-mapped arrays stay mapped.  Queued batches are dropped.
+        """
+        self._pending = []
+        self._adjacency = {}
+        self._edge_keys = None
+        self.vertices = arrays["vertices"]
+        self.triangles = arrays["triangles"]
+        self.normals = arrays["normals"]
+        self.facet_counts = arrays["facet_counts"]
+        self.edges = arrays["edges"]
+        self.edge_counts = arrays["edge_counts"]
+        self.facet_edges = arrays["facet_edges"]
+        return self
+
+    def _build_edges(self):
+        """Finds the unique edges, their use counts, and each facet's edges."""
+        tris = self.triangles
+        nverts = max(len(self.vertices), 1)
+        keys = np.empty((len(tris), 3), dtype=np.int64)
+        for k in range(3):
+            a = tris[:, k].astype(np.int64)
+            b = tris[:, (k + 1) % 3].astype(np.int64)
+            keys[:, k] = np.minimum(a, b) * nverts + np.maximum(a, b)
+        keys = keys.ravel()
+        order = np.argsort(keys)
+        keys = keys[order]
+        new = np.empty(len(keys), dtype=bool)
+        new[:1] = True
+        new[1:] = keys[1:] != keys[:-1]
+        uniq = keys[new]
+        del keys
+        edge_type = _index_dtype(len(uniq))
+        inverse = np.empty(len(order), dtype=edge_type)
+        inverse[order] = np.cumsum(new, dtype=np.int64) - 1
+        del order, new
+        self.edges = np.stack(
+            [uniq // nverts, uniq % nverts], axis=1
+        ).astype(_index_dtype(nverts))
+        self.edge_counts = np.bincount(
+            inverse, weights=np.repeat(self.facet_counts, 3),
+            minlength=len(uniq)
+        ).astype(np.int32)
+        self.facet_edges = inverse.reshape(-1, 3)
+        # The sorted edge keys, for find_edge() lookups.
+        self._edge_keys = uniq
+        self._adjacency = {}
+
+    def _update_bounds(self):
+        """Recalculates the volume cube that contains all the vertices."""
+        verts = self.vertices
+        if not len(verts):
+            self._bounds = (9e99, 9e99, 9e99, -9e99, -9e99, -9e99)
+            return
+        mins = verts.min(axis=0).tolist()
+        maxs = verts.max(axis=0).tolist()
+        self._bounds = tuple(mins + maxs)
+
+    def transform(self, matrix):
+        """
+        Applies a 4x4 affine transform to the mesh.  Transforms are only
+        composed here, and the vertices are updated in a single array
+        operation the next time they are used.  Bounds follow translations
+        and axis-aligned scaling without touching the vertices at all.
+        """
+        self.build()
+        matrix = np.asarray(matrix, dtype=np.float64)
+        if self._transform is None:
+            self._transform = matrix.copy()
+        else:
+            self._transform = matrix.dot(self._transform)
+        lin = matrix[0:3, 0:3]
+        if self._bounds is not None and \
+                np.count_nonzero(lin - np.diag(np.diag(lin))) == 0:
+            lo = np.array(self._bounds[0:3])
+            hi = np.array(self._bounds[3:6])
+            if len(self._vertices):
+                diag = np.diag(lin)
+                a = lo * diag + matrix[0:3, 3]
+                b = hi * diag + matrix[0:3, 3]
+                lo, hi = np.minimum(a, b), np.maximum(a, b)
+            self._bounds = tuple(lo.tolist() + hi.tolist())
+        else:
+            self._bounds = None
+
+    def _apply_transform(self):
+        """Applies the pending transform to the vertex and normal arrays."""
+        matrix = self._transform
+        self._transform = None
+        lin = matrix[0:3, 0:3]
+        verts = self._vertices
+        if not np.array_equal(lin, np.eye(3)):
+            verts = verts.dot(lin.T)
+            # Normals transform by the inverse transpose, and stay unit length.
+            normals = self._normals.dot(np.linalg.inv(lin))
+            lens = np.sqrt(np.einsum('ij,ij->i', normals, normals))
+            lens[lens == 0] = 1.0
+            self._normals = normals / lens[:, None]
+            if np.linalg.det(lin) < 0:
+                # Mirrored, so flip the winding to keep it counter-clockwise.
+                self._triangles = self._triangles[:, [0, 2, 1]]
+            diag = np.diag(lin)
+            if np.count_nonzero(lin - np.diag(diag)) or np.any(diag <= 0):
+                self.ordered = False
+        if verts.flags.writeable:
+            verts += matrix[0:3, 3]
+        else:
+            # Memory-mapped cache arrays are read-only.
+            verts = verts + matrix[0:3, 3]
+        self._vertices = verts
+
+    def _get_adjacency(self, kind):
+        """Lazily builds and returns a CSR adjacency table."""
+        if kind not in self._adjacency:
+            if kind == 'edge_facets':
+                ptr, idx = _csr(self.facet_edges, len(self.edges))
+                idx //= 3
+            elif kind == 'vertex_facets':
+                ptr, idx = _csr(self.triangles, len(self.vertices))
+                idx //= 3
+            else:  # vertex_edges
+                ptr, idx = _csr(self.edges, len(self.vertices))
+                idx //= 2
+            self._adjacency[kind] = (ptr, idx.astype(_index_dtype(len(idx))))
+        return self._adjacency[kind]
+
+    def edge_facet_ids(self, edge):
+        """Returns the indices of the facets that share the given edge."""
+        ptr, idx = self._get_adjacency('edge_facets')
+        return idx[ptr[edge]:ptr[edge + 1]]
+
+    def vertex_facet_ids(self, vert):
+        """Returns the indices of the facets that use the given vertex."""
+        ptr, idx = self._get_adjacency('vertex_facets')
+        return idx[ptr[vert]:ptr[vert + 1]]
+
+    def vertex_edge_ids(self, vert):
+        """Returns the indices of the edges that end at the given vertex."""
+        ptr, idx = self._get_adjacency('vertex_edges')
+        return idx[ptr[vert]:ptr[vert + 1]]
+
+    def find_vertex(self, pt):
+        """Returns the index of the vertex at the given point, or None."""
+        if not self.ordered:
+            hits = np.flatnonzero(np.all(self.vertices == np.asarray(pt[0:3]), axis=1))
+            return int(hits[0]) if len(hits) else None
+        lo, hi = 0, len(self.vertices)
+        for axis in (2, 1, 0):
+            col = self.vertices[lo:hi, axis]
+            val = pt[axis]
+            lo, hi = (
+                lo + int(np.searchsorted(col, val, 'left')),
+                lo + int(np.searchsorted(col, val, 'right')),
+            )
+            if lo >= hi:
+                return None
+        return lo
+
+    def find_edge(self, v1, v2):
+        """Returns the index of the edge between two vertex indices, or None."""
+        if v1 > v2:
+            v1, v2 = v2, v1
+        n = max(len(self.vertices), 1)
+        keys = self._edge_keys
+        if keys is None:
+            # Loaded by load_arrays(), so the keys are made on first use.
+            keys = self.edges[:, 0].astype(np.int64) * n + self.edges[:, 1]
+            self._edge_keys = keys
+        key = v1 * n + v2
+        pos = int(np.searchsorted(keys, key))
+        if pos < len(keys) and keys[pos] == key:
+            return pos
+        return None
+
+    def translate(self, offset):
+        """Translates all vertices in the mesh."""
+        matrix = np.eye(4)
+        matrix[0:3, 3] = offset[0:3]
+        self.transform(matrix)
+
+    def sort_order(self):
+        """
+        Returns facet indices in the order that Facet3D comparisons would
+        sort them: by sorted Z coordinates, then Y, then X.
+        """
+        self.build()
+        coords = np.sort(self.vertices[self.triangles], axis=1)
+        keys = [coords[:, i, axis] for axis in range(3) for i in (2, 1, 0)]
+        return np.lexsort(keys)
+
+    def facet_hashes(self, places=4):
+        """
+        Returns a 64-bit hash of each facet's vertex coordinates, rounded
+        to the given decimal places, like the keys of Facet3DCache's
+        facet_hash.  Facets keep their vertex order from normalization, so
+        the same facet in two meshes hashes the same.
+        """
+        self.build()
+        coords = np.round(self.vertices[self.triangles].reshape(-1, 9) * 10 ** places)
+        coords = coords.astype(np.int64).view(np.uint64)
+        h = np.full(len(coords), 0xcbf29ce484222325, dtype=np.uint64)
+        mult = np.uint64(0x100000001b3)
+        with np.errstate(over='ignore'):
+            for k in range(9):
+                h = (h ^ coords[:, k]) * mult
+                h ^= h >> np.uint64(29)
+        return h
+
+    def point(self, vert):
+        """Returns a Point3D for the given vertex index."""
+        return Point3D.from_tuple(tuple(self.vertices[vert].tolist()))
+
+    def segment(self, edge):
+        """Returns a LineSegment3D for the given edge index."""
+        v1, v2 = self.edges[edge].tolist()
+        seg = LineSegment3D(self.point(v1), self.point(v2))
+        seg.count = int(self.edge_counts[edge])
+        return seg
+
+    def facet(self, idx):
+        """Returns a Facet3D for the given facet index."""
+        verts = self.vertices[self.triangles[idx]].tolist()
+        return Facet3D.from_normalized(
+            verts, self.normals[idx].tolist(), int(self.facet_counts[idx])
+        )
+
+    def __len__(self):
+        """Number of unique facets."""
+        self.build()
+        return len(self.triangles)
+
+    def nbytes(self):
+        """Returns the memory used by the mesh arrays, in bytes."""
+        arrays = [
+            self.vertices, self.triangles, self.normals, self.facet_counts,
+            self.edges, self.edge_counts, self.facet_edges,
+        ]
+        for ptr, idx in self._adjacency.values():
+            arrays.extend([ptr, idx])
+        if self._edge_keys is not None:
+            arrays.append(self._edge_keys)
+        return sum(a.nbytes for a in arrays)
+
+
+class MeshPoints(object):
+    """Read-only Point3DCache style view of the vertices of an IndexedMesh."""
+
+    def __init__(self, mesh):
+        self.mesh = mesh
+
+    minx = property(lambda self: self._bounds()[0])
+    miny = property(lambda self: self._bounds()[1])
+    minz = property(lambda self: self._bounds()[2])
+    maxx = property(lambda self: self._bounds()[3])
+    maxy = property(lambda self: self._bounds()[4])
+    maxz = property(lambda self: self._bounds()[5])
+
+    def _bounds(self):
+        return self.mesh.build().bounds
+
+    def get_volume(self):
+        """Returns the 3D volume that contains all the points in the mesh."""
+        return self._bounds()
+
+    def translate(self, offset):
+        """Translates all points."""
+        self.mesh.translate(offset)
+
+    def __len__(self):
+        """Length of sequence."""
+        return len(self.mesh.build().vertices)
+
+    def __iter__(self):
+        """Creates an iterator for the points in the mesh."""
+        for pt in self.mesh.build().vertices.tolist():
+            yield Point3D.from_tuple(tuple(pt))
+
+
+class MeshEdges(object):
+    """Read-only LineSegment3DCache style view of the edges of an IndexedMesh."""
+
+    def __init__(self, mesh):
+        self.mesh = mesh
+
+    def translate(self, offset):
+        """Translate vertices of all edges."""
+        self.mesh.translate(offset)
+
+    def endpoint_segments(self, p):
+        """get list of edges that end at point p"""
+        mesh = self.mesh.build()
+        vert = mesh.find_vertex(p)
+        if vert is None:
+            return []
+        return [mesh.segment(e) for e in mesh.vertex_edge_ids(vert).tolist()]
+
+    def get(self, p1, p2):
+        """Given 2 endpoints, return a LineSegment3D for that edge, if any."""
+        mesh = self.mesh.build()
+        v1 = mesh.find_vertex(p1)
+        v2 = mesh.find_vertex(p2)
+        if v1 is None or v2 is None:
+            return None
+        edge = mesh.find_edge(v1, v2)
+        if edge is None:
+            return None
+        return mesh.segment(edge)
+
+    def __iter__(self):
+        """Creates an iterator for the line segments in the mesh."""
+        mesh = self.mesh.build()
+        for edge in range(len(mesh.edges)):
+            yield mesh.segment(edge)
+
+    def __len__(self):
+        """Length of sequence."""
+        return len(self.mesh.build().edges)
+
+
+class MeshFacets(object):
+    """Read-only Facet3DCache style view of the facets of an IndexedMesh."""
+
+    def __init__(self, mesh):
+        self.mesh = mesh
+
+    def translate(self, offset):
+        """Translates vertices of all facets."""
+        self.mesh.translate(offset)
+
+    def vertex_facets(self, pt):
+        """Returns the facets that have a given vertex."""
+        mesh = self.mesh.build()
+        vert = mesh.find_vertex(pt)
+        if vert is None:
+            return []
+        return [mesh.facet(i) for i in mesh.vertex_facet_ids(vert).tolist()]
+
+    def edge_facets(self, p1, p2):
+        """Returns the facets that have a given edge."""
+        mesh = self.mesh.build()
+        v1 = mesh.find_vertex(p1)
+        v2 = mesh.find_vertex(p2)
+        if v1 is None or v2 is None:
+            return []
+        edge = mesh.find_edge(v1, v2)
+        if edge is None:
+            return []
+        return [mesh.facet(i) for i in mesh.edge_facet_ids(edge).tolist()]
+
+    def get(self, p1, p2, p3):
+        """Given 3 vertices, return a Facet3D for that face, if any."""
+        p3 = tuple(p3)
+        for facet in self.edge_facets(p1, p2):
+            if any(tuple(v) == p3 for v in facet.vertices):
+                return facet
+        return None
+
+    def sorted(self):
+        """Returns a sorted iterator."""
+        mesh = self.mesh
+        for idx in mesh.sort_order().tolist():
+            yield mesh.facet(idx)
+
+    def __iter__(self):
+        """Creates an iterator for the facets in the mesh."""
+        mesh = self.mesh.build()
+        for idx in range(len(mesh.triangles)):
+            yield mesh.facet(idx)
+
+    def __len__(self):
+        """Length of sequence."""
+        return len(self.mesh)
+
+
+# vim: expandtab tabstop=4 shiftwidth=4 softtabstop=4 nowrap
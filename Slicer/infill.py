@@ -0,0 +1,324 @@
+import math
+from collections import OrderedDict
+
+import numpy as np
+
+from .instrument import timed
+
+
+class LineSet(object):
+    """
+    Set of open polylines held in two arrays: all the points, as a Px2
+    array, and the start offset of each line in it, plus the end.
+    """
+
+    def __init__(self, points=None, offsets=None):
+        """Initialize from a Px2 point array and an N+1 offset array."""
+        if points is None:
+            points = np.zeros((0, 2), dtype=np.float64)
+            offsets = np.zeros(1, dtype=np.int64)
+        self.points = points
+        self.offsets = offsets
+
+    @classmethod
+    def from_segments(cls, segs):
+        """Makes a LineSet from an Nx2x2 array of two point lines."""
+        segs = np.asarray(segs, dtype=np.float64).reshape(-1, 2, 2)
+        return cls(segs.reshape(-1, 2), np.arange(0, 2 * len(segs) + 1, 2))
+
+    @classmethod
+    def from_paths(cls, paths):
+        """Makes a LineSet from a list of paths of (x, y) points."""
+        paths = [path for path in paths if len(path)]
+        if not paths:
+            return cls()
+        lens = [len(path) for path in paths]
+        offsets = np.zeros(len(paths) + 1, dtype=np.int64)
+        np.cumsum(lens, out=offsets[1:])
+        points = np.concatenate([np.asarray(p, dtype=np.float64).reshape(-1, 2) for p in paths])
+        return cls(points, offsets)
+
+    @classmethod
+    def concatenate(cls, sets):
+        """Joins several LineSets into one."""
+        sets = [s for s in sets if len(s)]
+        if not sets:
+            return cls()
+        offsets = [sets[0].offsets]
+        base = sets[0].offsets[-1]
+        for s in sets[1:]:
+            offsets.append(s.offsets[1:] + base)
+            base += s.offsets[-1]
+        points = np.concatenate([s.points for s in sets])
+        return cls(points, np.concatenate(offsets))
+
+    def __len__(self):
+        """Number of lines."""
+        return len(self.offsets) - 1
+
+    def bounds(self):
+        """Returns Nx2 arrays (mins, maxs) of the bounds of each line."""
+        if not len(self):
+            empty = np.zeros((0, 2), dtype=np.float64)
+            return empty, empty
+        starts = self.offsets[:-1]
+        return (
+            np.minimum.reduceat(self.points, starts, axis=0),
+            np.maximum.reduceat(self.points, starts, axis=0),
+        )
+
+    def select(self, mask):
+        """Returns a LineSet of the lines where the boolean mask is set."""
+        idx = np.flatnonzero(mask)
+        starts = self.offsets[idx]
+        lens = self.offsets[idx + 1] - starts
+        offsets = np.zeros(len(idx) + 1, dtype=np.int64)
+        np.cumsum(lens, out=offsets[1:])
+        pos = np.repeat(starts - offsets[:-1], lens) + np.arange(offsets[-1])
+        return LineSet(self.points[pos], offsets)
+
+    def crop(self, rect):
+        """Returns the lines whose bounds overlap rect (minx, miny, maxx, maxy)."""
+        lo, hi = self.bounds()
+        mask = (hi[:, 0] >= rect[0]) & (hi[:, 1] >= rect[1]) & \
+            (lo[:, 0] <= rect[2]) & (lo[:, 1] <= rect[3])
+        return self.select(mask)
+
+    def split(self):
+        """Returns a list of Kx2 point arrays, one per line."""
+        return np.split(self.points, self.offsets[1:-1])
+
+    def to_paths(self):
+        """Returns the lines as a list of lists of (x, y) tuples."""
+        pts = [tuple(pt) for pt in self.points.tolist()]
+        offs = self.offsets.tolist()
+        return [pts[offs[i]:offs[i + 1]] for i in range(len(self))]
+
+
+def _frame(angle):
+    """Returns unit vectors along, and normal to, lines at angle degrees."""
+    a = math.radians(angle)
+    return np.array([math.cos(a), math.sin(a)]), np.array([-math.sin(a), math.cos(a)])
+
+
+def _rect_corners(rect):
+    minx, miny, maxx, maxy = rect
+    return np.array([(minx, miny), (maxx, miny), (maxx, maxy), (minx, maxy)], dtype=np.float64)
+
+
+def parallel_lines(rect, angle, spacing, offset=0.0, skip_multiple=None):
+    """
+    Returns a LineSet of the lines at angle degrees that cross rect, laid
+    on a global grid: line k is at distance k * spacing + offset from the
+    origin.  Lines where k is a multiple of skip_multiple are left out.
+    """
+    u, v = _frame(angle)
+    corners = _rect_corners(rect)
+    t = corners.dot(u)
+    s = corners.dot(v)
+    kmin = int(math.ceil((s.min() - offset) / spacing))
+    kmax = int(math.floor((s.max() - offset) / spacing))
+    k = np.arange(kmin, kmax + 1)
+    if skip_multiple:
+        k = k[k % skip_multiple != 0]
+    dist = (k * spacing + offset)[:, None]
+    segs = np.stack([dist * v + t.min() * u, dist * v + t.max() * u], axis=1)
+    return LineSet.from_segments(segs)
+
+
+def hexagon_lines(rect, angle, spacing, ewidth):
+    """
+    Returns a LineSet of zig-zag columns that together make a honeycomb,
+    with columns spacing apart, on a global grid rotated by angle degrees.
+    """
+    ext = 0.5 * ewidth / math.tan(math.radians(60.0))
+    row_spacing = spacing * 3.0 / math.sin(math.radians(60.0))
+    u, v = _frame(angle)
+    corners = _rect_corners(rect)
+    cx = corners.dot(u)
+    cy = corners.dot(v)
+    cols = np.arange(int(math.floor(cx.min() / spacing)) - 1, int(math.ceil(cx.max() / spacing)) + 1)
+    rows = np.arange(int(math.floor(cy.min() / row_spacing)) - 1, int(math.ceil(cy.max() / row_spacing)) + 1)
+    if not len(cols) or not len(rows):
+        return LineSet()
+    x1 = cols * spacing + ewidth / 2.0
+    x2 = cols * spacing + spacing - ewidth / 2.0
+    odd = cols % 2 != 0
+    x1, x2 = np.where(odd, x2, x1), np.where(odd, x1, x2)
+    shape = (len(cols), len(rows), 4)
+    xs = np.broadcast_to(np.stack([x1, x2, x2, x1], axis=1)[:, None, :], shape)
+    dy = np.array([
+        ext, row_spacing / 6.0 - ext,
+        row_spacing / 2.0 + ext, row_spacing * 2.0 / 3.0 - ext,
+    ])
+    ys = np.broadcast_to((rows * row_spacing)[None, :, None] + dy, shape)
+    xs = xs.reshape(len(cols), -1, 1)
+    ys = ys.reshape(len(cols), -1, 1)
+    pts = xs * u + ys * v
+    offsets = np.arange(0, pts.shape[0] * pts.shape[1] + 1, pts.shape[1])
+    return LineSet(pts.reshape(-1, 2), offsets)
+
+
+def gyroid_lines(rect, spacing, z, resolution=8):
+    """
+    Returns a LineSet of the cross section at height z of a gyroid surface
+    whose walls are about spacing apart, on a global grid, sampled at
+    resolution points per spacing.  The surface is
+        sin(x) cos(y) + sin(y) cos(z) + sin(z) cos(x) = 0,
+    which, for a fixed x and z, has the form a cos(y) + b sin(y) = -c, and
+    so can be solved for y on both branches of an arccos.  Where |sin(z)|
+    is bigger than |cos(z)|, it is solved for x along y instead, which
+    keeps a solution for every sample.  Each branch, repeated every
+    period, is one wavy line.
+    """
+    freq = math.pi / spacing
+    step = spacing / float(resolution)
+    fz = freq * z
+    minx, miny, maxx, maxy = rect
+    swap = abs(math.sin(fz)) > abs(math.cos(fz))
+    if swap:
+        minx, miny, maxx, maxy = miny, minx, maxy, maxx
+        p, q = math.cos(fz), math.sin(fz)
+    else:
+        p, q = math.sin(fz), math.cos(fz)
+    us = np.arange(math.floor(minx / step), math.ceil(maxx / step) + 1) * step
+    if not len(us):
+        return LineSet()
+    fu = freq * us
+    # Unswapped: a = sin(x), b = cos(z), c = sin(z) cos(x).
+    # Swapped, for x along y: a = sin(z), b = cos(y), c = cos(z) sin(y).
+    if swap:
+        a, b, c = np.full(len(fu), q), np.cos(fu), p * np.sin(fu)
+    else:
+        a, b, c = np.sin(fu), np.full(len(fu), q), p * np.cos(fu)
+    r = np.hypot(a, b)
+    phi = np.arctan2(b, a)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        dv = np.arccos(np.clip(-c / r, -1.0, 1.0))
+    branches = np.stack([phi - dv, phi + dv])
+    period = 2.0 * math.pi
+    kmin = int(math.floor((freq * miny - branches.max()) / period))
+    kmax = int(math.ceil((freq * maxy - branches.min()) / period))
+    k = np.arange(kmin, kmax + 1) * period
+    vs = (branches[None, :, :] + k[:, None, None]).reshape(-1, len(us)) / freq
+    keep = (vs.max(axis=1) >= miny) & (vs.min(axis=1) <= maxy)
+    vs = vs[keep]
+    us = np.broadcast_to(us, vs.shape)
+    if swap:
+        pts = np.stack([vs, us], axis=2)
+    else:
+        pts = np.stack([us, vs], axis=2)
+    offsets = np.arange(0, vs.size + 1, len(us[0]) if len(vs) else 1)
+    return LineSet(pts.reshape(-1, 2), offsets)
+
+
+def cubic_shift(z):
+    """
+    How far, at height z, the walls of a cubic lattice stood on one corner
+    have moved across the layer.  The walls lean at atan(sqrt(2)) from the
+    horizontal, so they move by z / sqrt(2).
+    """
+    return z / math.sqrt(2.0)
+
+
+class PatternCache(object):
+    """
+    LRU cache of generated infill patterns.  Each entry holds a pattern
+    generated over an extent somewhat bigger than the rects asked for, so
+    layers whose bounds change a little reuse it, by cropping it to their
+    bounds.  Patterns are laid on a global grid, so the crop is exact.
+    """
+
+    def __init__(self, max_entries=32, margin=0.25):
+        """Initialize an empty cache, holding at most max_entries patterns."""
+        self.max_entries = max_entries
+        self.margin = margin
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, rect, build):
+        """
+        Returns the pattern for key, cropped to rect.  If it isn't cached
+        for an extent holding rect, build(extent) is called to make it.
+        """
+        entry = self.entries.pop(key, None)
+        if entry is not None and \
+                entry[0][0] <= rect[0] and entry[0][1] <= rect[1] and \
+                entry[0][2] >= rect[2] and entry[0][3] >= rect[3]:
+            self.hits += 1
+        else:
+            self.misses += 1
+            extent = rect
+            if entry is not None:
+                old = entry[0]
+                extent = (
+                    min(old[0], rect[0]), min(old[1], rect[1]),
+                    max(old[2], rect[2]), max(old[3], rect[3]),
+                )
+            w = (extent[2] - extent[0]) * self.margin
+            h = (extent[3] - extent[1]) * self.margin
+            extent = (extent[0] - w, extent[1] - h, extent[2] + w, extent[3] + h)
+            entry = (extent, build(extent))
+        self.entries[key] = entry
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        return entry[1].crop(rect)
+
+    def clear(self):
+        """Removes all cached patterns."""
+        self.entries.clear()
+
+
+default_cache = PatternCache()
+
+
+def _phase(value, period):
+    """Quantizes value modulo period to a cache key, and returns (key, value)."""
+    key = int(round((value % period) * 1e6)) % int(round(period * 1e6))
+    return key, key / 1e6
+
+
+@timed("pattern")
+def pattern_lines(pattern, rect, angle, spacing, z=0.0, ewidth=0.0, skip_multiple=None, cache=None):
+    """
+    Returns a LineSet of an infill pattern covering rect, taken from cache
+    (default_cache if not given) when possible.  Patterns are "lines",
+    "grid", "triangles", "hexagons", "cubic" and "gyroid".  The cubic and
+    gyroid patterns change with z; the gyroid is not rotated by angle.
+    """
+    if cache is None:
+        cache = default_cache
+    rect = tuple(float(v) for v in rect)
+    if pattern == "lines":
+        rots = [0]
+    elif pattern == "grid":
+        rots = [0, 90]
+    elif pattern == "triangles":
+        rots = [0, 60, 120]
+    elif pattern == "cubic":
+        rots = [0, 120, 240]
+    elif pattern == "hexagons":
+        key = (pattern, round(angle, 6), round(spacing, 6), round(ewidth, 6))
+        return cache.get(key, rect, lambda ext: hexagon_lines(ext, angle, spacing, ewidth))
+    elif pattern == "gyroid":
+        phase, zp = _phase(z, 2.0 * spacing)
+        key = (pattern, round(spacing, 6), phase)
+        return cache.get(key, rect, lambda ext: gyroid_lines(ext, spacing, zp))
+    else:
+        raise ValueError("Unknown infill pattern: {0}".format(pattern))
+    offset = cubic_shift(z) if pattern == "cubic" else 0.0
+    period = spacing * (skip_multiple or 1)
+    phase, offset = _phase(offset, period)
+    sets = []
+    for rot in rots:
+        key = ("lines", round(angle + rot, 6), round(spacing, 6), phase, skip_multiple)
+        ang = angle + rot
+        sets.append(cache.get(
+            key, rect,
+            lambda ext: parallel_lines(ext, ang, spacing, offset, skip_multiple)
+        ))
+    return LineSet.concatenate(sets)
+
+
+# vim: expandtab tabstop=4 shiftwidth=4 softtabstop=4 nowrap
@@ -0,0 +1,312 @@
+from __future__ import print_function
+
+import json
+import time
+import functools
+from contextlib import contextmanager
+
+from .TextThermometer import TextThermometer
+
+
+STAGES = (
+    "read", "weld", "validate", "layer_assign", "slice", "slice_layers",
+    "stitch", "offset", "boolean", "orient", "pattern", "infill", "write",
+)
+
+
+class StageStats(object):
+    """Accumulated timing of one pipeline stage."""
+
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+        self.items = 0
+
+    def add(self, seconds, items=0):
+        self.calls += 1
+        self.seconds += seconds
+        self.items += items
+        if seconds > self.max_seconds:
+            self.max_seconds = seconds
+
+    def as_dict(self):
+        rate = self.items / self.seconds if self.seconds > 0 else 0.0
+        return {
+            "calls": self.calls,
+            "seconds": self.seconds,
+            "max_seconds": self.max_seconds,
+            "items": self.items,
+            "items_per_second": rate,
+        }
+
+
+class Progress(object):
+    """
+    Progress of a long stage towards a target.  update() is cheap enough
+    to call per item: it only reads the clock every stride items, and the
+    stride adapts so that the clock is read a few times per period.
+    """
+
+    def __init__(self, instruments, stage, target, period=0.5):
+        self.instruments = instruments
+        self.stage = stage
+        self.target = target
+        self.period = period
+        self.value = 0
+        self.stride = 1
+        self.next_check = 0
+        self.last_time = self.start_time = time.time()
+        self.last_value = 0
+
+    def update(self, value):
+        self.value = value
+        if value < self.next_check:
+            return
+        now = time.time()
+        elapsed = now - self.last_time
+        if elapsed >= self.period:
+            rate = (value - self.last_value) / elapsed
+            self.stride = max(1, int(rate * self.period / 4))
+            self.last_time = now
+            self.last_value = value
+            self.instruments._emit("on_progress", self.stage, value, self.target)
+        self.next_check = value + self.stride
+
+    def done(self):
+        self.instruments._emit("on_progress_done", self.stage, self.value, self.target)
+
+
+class Instruments(object):
+    """
+    Collects per-stage timers and named counters for the slicing pipeline,
+    and passes events on to sinks.  Runs of hot stages are only tallied,
+    and passed on to the sinks as one event per stage at the next stage
+    boundary: the next record() or flush().  A sink is any object with
+    some of the methods on_stage(name, seconds, items), on_progress(stage,
+    value, target), on_progress_done(stage, value, target) and close().
+    """
+
+    def __init__(self, sinks=None):
+        """Initialize with no recorded data, and the given list of sinks."""
+        self.sinks = list(sinks or [])
+        self.reset()
+
+    def reset(self):
+        """Forgets all recorded timings and counters."""
+        self.stages = {}
+        self.counters = {}
+        self.pending = {}
+        self.start_time = time.time()
+
+    def add_sink(self, sink):
+        self.sinks.append(sink)
+
+    def remove_sink(self, sink):
+        self.sinks.remove(sink)
+
+    def _emit(self, method, *args):
+        for sink in self.sinks:
+            func = getattr(sink, method, None)
+            if func is not None:
+                func(*args)
+
+    def _stats(self, name):
+        stats = self.stages.get(name)
+        if stats is None:
+            stats = self.stages[name] = StageStats(name)
+        return stats
+
+    def record(self, name, seconds, items=0):
+        """Records one timed run of a stage, that handled items items."""
+        self._stats(name).add(seconds, items)
+        self.flush()
+        self._emit("on_stage", name, seconds, items)
+
+    def tally(self, name, seconds, items=0):
+        """
+        Records one run of a hot stage, without telling the sinks.  The
+        runs since the last flush() are passed on to them as one event.
+        """
+        self._stats(name).add(seconds, items)
+        pend = self.pending.get(name)
+        if pend is None:
+            self.pending[name] = [seconds, items]
+        else:
+            pend[0] += seconds
+            pend[1] += items
+
+    def flush(self):
+        """Passes the tallied runs of each stage on to the sinks as one event."""
+        if not self.pending:
+            return
+        pending, self.pending = self.pending, {}
+        for name, (seconds, items) in pending.items():
+            self._emit("on_stage", name, seconds, items)
+
+    @contextmanager
+    def stage(self, name, items=0):
+        """
+        Context manager that times a stage.  The item count can be given,
+        or set later on the yielded dict, as in:
+            with instruments.stage("read") as st:
+                st["items"] = facets
+        """
+        info = {"items": items}
+        start = time.perf_counter()
+        try:
+            yield info
+        finally:
+            self.record(name, time.perf_counter() - start, info["items"])
+
+    def merge(self, other):
+        """
+        Adds the timings and counters of another Instruments to these, as
+        for work timed separately in a thread.  Each merged stage is passed
+        on to the sinks as one event.
+        """
+        for name, st in other.stages.items():
+            stats = self._stats(name)
+            stats.calls += st.calls
+            stats.seconds += st.seconds
+            stats.items += st.items
+            stats.max_seconds = max(stats.max_seconds, st.max_seconds)
+            self._emit("on_stage", name, st.seconds, st.items)
+        for name, value in other.counters.items():
+            self.count(name, value)
+
+    def count(self, name, value=1):
+        """Adds value to a named counter."""
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def progress(self, stage, target, period=0.5):
+        """Returns a Progress for a stage with the given target value."""
+        return Progress(self, stage, target, period)
+
+    def as_dict(self):
+        """Returns all stage timings and counters as a JSON serializable dict."""
+        return {
+            "elapsed": time.time() - self.start_time,
+            "stages": dict((name, st.as_dict()) for name, st in self.stages.items()),
+            "counters": dict(self.counters),
+        }
+
+    def prometheus_text(self, prefix="slicer"):
+        """Returns the timings and counters in Prometheus text exposition format."""
+        lines = []
+        metrics = [
+            ("stage_seconds_total", "counter", "Time spent in each stage.", "seconds"),
+            ("stage_calls_total", "counter", "Number of runs of each stage.", "calls"),
+            ("stage_items_total", "counter", "Items handled by each stage.", "items"),
+            ("stage_max_seconds", "gauge", "Longest single run of each stage.", "max_seconds"),
+        ]
+        for metric, kind, help_text, attr in metrics:
+            name = "{0}_{1}".format(prefix, metric)
+            lines.append("# HELP {0} {1}".format(name, help_text))
+            lines.append("# TYPE {0} {1}".format(name, kind))
+            for stage in sorted(self.stages):
+                lines.append('{0}{{stage="{1}"}} {2}'.format(
+                    name, stage, getattr(self.stages[stage], attr)))
+        if self.counters:
+            name = "{0}_count_total".format(prefix)
+            lines.append("# HELP {0} Pipeline counters.".format(name))
+            lines.append("# TYPE {0} counter".format(name))
+            for counter in sorted(self.counters):
+                lines.append('{0}{{name="{1}"}} {2}'.format(
+                    name, counter, self.counters[counter]))
+        return "\n".join(lines) + "\n"
+
+    def close(self):
+        """Passes on any tallied runs, and closes all sinks."""
+        self.flush()
+        self._emit("close")
+
+
+class TerminalBar(object):
+    """Sink that shows progress as a TextThermometer bar on the terminal."""
+
+    def __init__(self):
+        self.thermos = {}
+
+    def on_progress(self, stage, value, target):
+        thermo = self.thermos.get(stage)
+        if thermo is None:
+            thermo = self.thermos[stage] = TextThermometer(target, update_period=0.0)
+        thermo.update(value)
+
+    def on_progress_done(self, stage, value, target):
+        thermo = self.thermos.pop(stage, None)
+        if thermo is not None:
+            thermo.clear()
+
+
+class JsonLinesSink(object):
+    """
+    Sink that writes every stage and progress event as a line of JSON.
+    The stream is flushed at most every flush_period seconds, and when
+    the sink is closed.
+    """
+
+    def __init__(self, stream, flush_period=1.0):
+        """Initialize with a file name, or an open text stream."""
+        self.owned = not hasattr(stream, "write")
+        self.stream = open(stream, "a") if self.owned else stream
+        self.flush_period = flush_period
+        self.last_flush = time.time()
+
+    def _write(self, event):
+        now = event["time"] = time.time()
+        self.stream.write(json.dumps(event) + "\n")
+        if now - self.last_flush >= self.flush_period:
+            self.stream.flush()
+            self.last_flush = now
+
+    def on_stage(self, name, seconds, items):
+        self._write({"event": "stage", "stage": name, "seconds": seconds, "items": items})
+
+    def on_progress(self, stage, value, target):
+        self._write({"event": "progress", "stage": stage, "value": value, "target": target})
+
+    def close(self):
+        if self.owned:
+            self.stream.close()
+        else:
+            self.stream.flush()
+
+
+class PrometheusFileSink(object):
+    """Sink that writes a Prometheus text dump of the instruments when closed."""
+
+    def __init__(self, instruments, filename):
+        self.instruments = instruments
+        self.filename = filename
+
+    def close(self):
+        with open(self.filename, "w") as f:
+            f.write(self.instruments.prometheus_text())
+
+
+# Shared by the pipeline modules, and shows progress bars like before.
+instruments = Instruments([TerminalBar()])
+
+
+def timed(name):
+    """
+    Decorator that tallies each call of a function as a run of a stage.
+    It is meant for functions called many times per layer, so the sinks
+    get the runs in one event per stage at the next stage boundary.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                instruments.tally(name, time.perf_counter() - start, 1)
+        return wrapper
+    return decorator
+
+
+# vim: expandtab tabstop=4 shiftwidth=4 softtabstop=4 nowrap
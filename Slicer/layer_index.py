@@ -0,0 +1,144 @@
+import math
+
+import numpy as np
+
+
+class LayerIndex(object):
+    """
+    Compact index from layer numbers to the facets that span them.
+
+    Each facet covers an inclusive [first, last] range of layers.  Ranges
+    are binned by size class (the power of two above their span) and then
+    by first layer within that class, so a lookup only has to look at two
+    bins per size class, no matter how many layers a facet spans.
+
+    Layers are either a fixed height apart, or follow a schedule of layer
+    boundary heights, kept in bounds.
+    """
+
+    def __init__(self, first, last, bounds=None):
+        """Build the index from arrays of per-facet first and last layers."""
+        self.bounds = bounds
+        first = np.asarray(first, dtype=np.int64)
+        last = np.asarray(last, dtype=np.int64)
+        span = np.maximum(last - first, 0)
+        levels = np.frexp(span.astype(np.float64))[1].astype(np.int64)
+        bins = first >> levels
+        order = np.lexsort((bins, levels))
+        self.count = len(first)
+        self.facets = order.astype(np.int32 if len(order) < 2**31 else np.int64)
+        self.first = first[order].astype(np.int32)
+        self.last = last[order].astype(np.int32)
+        self.bins = bins[order].astype(np.int32)
+        levels = levels[order]
+        self.levels = []
+        for level in np.unique(levels).tolist():
+            lo = int(np.searchsorted(levels, level, 'left'))
+            hi = int(np.searchsorted(levels, level, 'right'))
+            self.levels.append((level, lo, hi))
+        self._update_range()
+
+    @classmethod
+    def from_schedule(cls, zmin, zmax, bounds):
+        """
+        Build the index for variable height layers, from arrays of facet
+        minimum and maximum Z, and the layer boundaries.  Layer i spans
+        bounds[i] to bounds[i+1].
+        """
+        bounds = np.asarray(bounds, dtype=np.float64)
+        first = np.searchsorted(bounds[1:], zmin, 'left')
+        last = np.searchsorted(bounds[:-1], zmax, 'right') - 1
+        return cls(first, last, bounds)
+
+    def layer_at(self, z, layer_h=None):
+        """Returns the number of the layer at height z."""
+        if self.bounds is not None:
+            return int(np.searchsorted(self.bounds, z, 'right')) - 1
+        return math.floor(z / layer_h + 0.5)
+
+    def _update_range(self):
+        if len(self.first):
+            self.min_layer = int(self.first.min())
+            self.max_layer = int(self.last.max())
+        else:
+            self.min_layer, self.max_layer = 0, -1
+
+    def arrays(self):
+        """Returns the index data as a dict of arrays, for sharing or saving."""
+        arrays = {
+            "facets": self.facets,
+            "first": self.first,
+            "last": self.last,
+            "bins": self.bins,
+            "levels": np.array(self.levels, dtype=np.int64).reshape(-1, 3),
+        }
+        if self.bounds is not None:
+            arrays["bounds"] = self.bounds
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        """Recreates an index from the arrays() dict, without copying them."""
+        index = cls.__new__(cls)
+        index.facets = arrays["facets"]
+        index.first = arrays["first"]
+        index.last = arrays["last"]
+        index.bins = arrays["bins"]
+        index.levels = [tuple(row) for row in arrays["levels"].tolist()]
+        index.bounds = arrays.get("bounds")
+        index.count = len(index.facets)
+        index._update_range()
+        return index
+
+    def __len__(self):
+        """Number of indexed facets."""
+        return self.count
+
+    def layer_range(self):
+        """Returns the (lowest, highest) layer that any facet spans."""
+        return (self.min_layer, self.max_layer)
+
+    def query(self, layer):
+        """Returns an array of the indices of the facets that span a layer."""
+        parts = []
+        for level, lo, hi in self.levels:
+            b = layer >> level
+            bins = self.bins[lo:hi]
+            start = lo + int(np.searchsorted(bins, b - 1, 'left'))
+            end = lo + int(np.searchsorted(bins, b, 'right'))
+            if start < end:
+                parts.append(slice(start, end))
+        if not parts:
+            return self.facets[:0]
+        if len(parts) == 1:
+            pos = np.arange(parts[0].start, parts[0].stop)
+        else:
+            pos = np.concatenate([np.arange(s.start, s.stop) for s in parts])
+        hit = (self.first[pos] <= layer) & (self.last[pos] >= layer)
+        return self.facets[pos[hit]]
+
+    def sweep(self, start=None, stop=None):
+        """
+        Generates (layer, facet indices) for each layer from start up to and
+        including stop, keeping an active set of facets instead of doing a
+        separate lookup for each layer.
+        """
+        if start is None:
+            start = self.min_layer
+        if stop is None:
+            stop = self.max_layer
+        order = np.argsort(self.first, kind='stable')
+        firsts = self.first[order]
+        pos = int(np.searchsorted(firsts, start, 'left'))
+        active = np.flatnonzero(self.first < start)
+        active = active[self.last[active] >= start]
+        for layer in range(start, stop + 1):
+            end = int(np.searchsorted(firsts, layer, 'right'))
+            if end > pos:
+                active = np.concatenate([active, order[pos:end]])
+                pos = end
+            active = active[self.last[active] >= layer]
+            yield layer, self.facets[active]
+
+
+# vim: expandtab tabstop=4 shiftwidth=4 softtabstop=4 nowrap
@@ -0,0 +1,120 @@
+import math
+
+import numpy as np
+
+from .stl_arrays import concat_ranges
+
+
+def facet_layer_heights(normals, min_h, max_h, max_cusp):
+    """
+    Returns the tallest layer height each facet allows, for an Nx3 normal
+    array.  A layer of height h leaves a stair step (cusp) of h * |nz| on a
+    facet, where |nz| is the sine of its Facet3D.overhang_angle(), so the
+    height is max_cusp / |nz|, clamped to [min_h, max_h].
+    """
+    nz = np.abs(np.asarray(normals, dtype=np.float64)[:, 2])
+    with np.errstate(divide='ignore'):
+        heights = max_cusp / nz
+    return np.clip(heights, min_h, max_h)
+
+
+def plan_layers(mesh, min_h, max_h, max_cusp=None, band=None):
+    """
+    Plans variable layer heights for an IndexedMesh.  The Z range is cut
+    into bands band thick (min_h / 2 by default), and each band gets the
+    smallest height allowed by the sloped facets crossing it.  Horizontal
+    facets don't leave a cusp, and are ignored.  Layers are then stacked
+    from the bottom, each as tall as all the bands it covers allow.
+    max_cusp defaults to min_h.  Returns an array of the layer boundary
+    heights, from the bottom of the model to the top.
+    """
+    if max_cusp is None:
+        max_cusp = min_h
+    if band is None:
+        band = min_h / 2.0
+    mesh.build()
+    if not len(mesh.triangles):
+        return np.zeros(0, dtype=np.float64)
+    tz = mesh.vertices[:, 2][mesh.triangles]
+    zmin = tz.min(axis=1)
+    zmax = tz.max(axis=1)
+    z0 = float(zmin.min())
+    z1 = float(zmax.max())
+    heights = facet_layer_heights(mesh.normals, min_h, max_h, max_cusp)
+    flat = np.abs(mesh.normals[:, 2]) > 1.0 - 1e-9
+    live = ~flat & (heights < max_h)
+
+    nbands = int(math.ceil((z1 - z0) / band)) + 1
+    allowed = np.full(nbands, float(max_h))
+    b0 = np.clip(((zmin[live] - z0) / band).astype(np.int64), 0, nbands - 1)
+    b1 = np.clip(((zmax[live] - z0) / band).astype(np.int64), 0, nbands - 1)
+    counts = b1 - b0 + 1
+    np.minimum.at(allowed, concat_ranges(b0, counts), np.repeat(heights[live], counts))
+
+    bounds = [z0]
+    z = z0
+    while z1 - z > 1e-9:
+        lo = min(int((z - z0) / band), nbands - 1)
+        h = float(max_h)
+        while True:
+            hi = max(int(math.ceil((z + h - z0) / band)), lo + 1)
+            limit = float(allowed[lo:hi].min())
+            if limit >= h:
+                break
+            h = limit
+        if z + h + min_h > z1:
+            # Don't leave a sliver of a last layer.
+            _finish_layers(bounds, z1, min_h, allowed, z0, band)
+            break
+        z += h
+        bounds.append(z)
+    bounds = np.array(bounds)
+    # min_h is what the printer can do, so no layer may be thinner, unless
+    # the whole model is.
+    assert z1 - z0 < min_h or np.diff(bounds).min() >= min_h - 1e-9, \
+        "Planned a layer thinner than min_h"
+    return bounds
+
+
+def _finish_layers(bounds, z1, min_h, allowed, z0, band, max_back=8):
+    """
+    Adds the layers from bounds[-1] up to z1 to a schedule, none thinner
+    than min_h.  The rest goes in as few equal layers as the slopes above
+    allow.  If those would be thinner than min_h, up to max_back of the
+    last layers are taken back, and spread over the rest with it.  If no
+    such spread fits, the spread with the thinnest layers of at least
+    min_h is used, and the cusp bound is relaxed.
+    """
+    eps = 1e-9
+    backs = range(min(max_back, len(bounds) - 1) + 1)
+    for back in backs:
+        start = bounds[len(bounds) - 1 - back]
+        lo = min(int((start - z0) / band), len(allowed) - 1)
+        limit = float(allowed[lo:].min())
+        span = z1 - start
+        count = max(1, int(math.ceil(span / limit - eps)))
+        if span / count >= min_h - eps:
+            break
+    else:
+        def thinnest(back):
+            span = z1 - bounds[len(bounds) - 1 - back]
+            return span / max(1, int(math.floor(span / min_h + eps)))
+        back = min(backs, key=thinnest)
+        start = bounds[len(bounds) - 1 - back]
+        span = z1 - start
+        count = max(1, int(math.floor(span / min_h + eps)))
+        print("Warning: layers above Z={0:.3f} exceed the cusp limit, to keep them at least {1} thick.".format(
+            start, min_h))
+    del bounds[len(bounds) - back:]
+    step = span / count
+    bounds.extend(start + step * i for i in range(1, count))
+    bounds.append(z1)
+
+
+def layer_midpoints(bounds):
+    """Returns the Z heights halfway through each layer of a schedule."""
+    bounds = np.asarray(bounds, dtype=np.float64)
+    return (bounds[:-1] + bounds[1:]) / 2.0
+
+
+# vim: expandtab tabstop=4 shiftwidth=4 softtabstop=4 nowrap
@@ -2,6 +2,8 @@
 class LineSegment3D(object):
     """A class to represent a 3D line segment."""
 
+    __slots__ = ("p1", "p2", "count")
+
     def __init__(self, p1, p2):
         """Initialize with twwo endpoints."""
         if p1 > p2:
@@ -31,8 +33,14 @@ class LineSegment3D(object):
         """Returns hash value for endpoints"""
         return hash((self.p1, self.p2))
 
+    def __getstate__(self):
+        return (self.p1, self.p2, self.count)
+
+    def __setstate__(self, state):
+        self.p1, self.p2, self.count = state
+
     def __lt__(self, p):
-        return self < p
+        return self.__cmp__(p) < 0
 
     def __cmp__(self, p):
         """Compare points for sort ordering in an arbitrary heirarchy."""
@@ -68,8 +76,8 @@ class LineSegment3D(object):
 
     def translate(self,offset):
         """Translate the endpoint's vertices"""
-        self.p1 = (self.p1[a] + offset[a] for a in range(3))
-        self.p2 = (self.p2[a] + offset[a] for a in range(3))
+        self.p1.translate(offset)
+        self.p2.translate(offset)
 
     def length(self):
         """Returns the length of the line."""
@@ -0,0 +1,128 @@
+import numpy as np
+
+
+class ManifoldReport(object):
+    """Counts and capped samples of the manifold problems found in a mesh."""
+
+    def __init__(self, facets=0, edges=0):
+        """Initialize as a report with no problems found."""
+        self.facets = facets
+        self.edges = edges
+        self.dupe_face_count = 0
+        self.hole_edge_count = 0
+        self.dupe_edge_count = 0
+        self.dupe_faces = np.zeros(0, dtype=np.int64)
+        self.hole_edges = np.zeros((0, 2), dtype=np.int64)
+        self.dupe_edges = np.zeros((0, 2), dtype=np.int64)
+
+    @property
+    def is_manifold(self):
+        """True if no duplicate faces, hole edges or excess edges were found."""
+        return not (
+            self.dupe_face_count or
+            self.hole_edge_count or
+            self.dupe_edge_count
+        )
+
+    def as_dict(self):
+        """Returns the report as a JSON serializable dictionary."""
+        return {
+            "is_manifold": self.is_manifold,
+            "facets": self.facets,
+            "edges": self.edges,
+            "dupe_face_count": self.dupe_face_count,
+            "hole_edge_count": self.hole_edge_count,
+            "dupe_edge_count": self.dupe_edge_count,
+            "dupe_faces": self.dupe_faces.tolist(),
+            "hole_edges": self.hole_edges.tolist(),
+            "dupe_edges": self.dupe_edges.tolist(),
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        """Recreates a report from its as_dict() form."""
+        report = cls(facets=data["facets"], edges=data["edges"])
+        report.dupe_face_count = data["dupe_face_count"]
+        report.hole_edge_count = data["hole_edge_count"]
+        report.dupe_edge_count = data["dupe_edge_count"]
+        report.dupe_faces = np.array(data["dupe_faces"], dtype=np.int64)
+        report.hole_edges = np.array(data["hole_edges"], dtype=np.int64).reshape(-1, 2)
+        report.dupe_edges = np.array(data["dupe_edges"], dtype=np.int64).reshape(-1, 2)
+        return report
+
+    def __str__(self):
+        return (
+            "{0} facets, {1} edges: {2} duplicate faces, "
+            "{3} hole edges, {4} excess edges"
+            .format(
+                self.facets, self.edges, self.dupe_face_count,
+                self.hole_edge_count, self.dupe_edge_count
+            )
+        )
+
+
+def _group_counts(keys, weights):
+    """
+    Sorts a 1D array of integer keys, and returns the unique keys, the
+    summed weights for each, and the first position of each in keys.
+    """
+    order = np.argsort(keys, kind='stable')
+    srt = keys[order]
+    new = np.empty(len(srt), dtype=bool)
+    new[:1] = True
+    new[1:] = srt[1:] != srt[:-1]
+    starts = np.flatnonzero(new)
+    totals = np.add.reduceat(weights[order], starts) if len(srt) else weights[:0]
+    return srt[starts], totals, order[starts]
+
+
+def check_triangles(tris, counts=None, max_samples=10):
+    """
+    Checks an Nx3 triangle vertex index array for manifold problems.
+    counts optionally gives how many times each row occurs in the model.
+    Faces are duplicates if they use the same three vertices in any order.
+    Edges are packed into single integer keys and counted by sorting; an
+    edge used once borders a hole, and one used more than twice is excess.
+    Returns a ManifoldReport, holding at most max_samples of each problem.
+    """
+    tris = np.asarray(tris, dtype=np.int64).reshape(-1, 3)
+    if counts is None:
+        counts = np.ones(len(tris), dtype=np.int64)
+    counts = np.asarray(counts, dtype=np.int64)
+    nverts = int(tris.max()) + 1 if len(tris) else 1
+
+    srt = np.sort(tris, axis=1)
+    if nverts ** 3 < 2 ** 63:
+        face_keys = (srt[:, 0] * nverts + srt[:, 1]) * nverts + srt[:, 2]
+    else:
+        # Too many vertices to pack three indices into one int64 key.
+        _, face_keys = np.unique(srt, axis=0, return_inverse=True)
+        face_keys = face_keys.ravel()
+    _, face_totals, face_first = _group_counts(face_keys, counts)
+    dupes = face_totals > 1
+
+    edge_keys = np.concatenate([
+        srt[:, 0] * nverts + srt[:, 1],
+        srt[:, 1] * nverts + srt[:, 2],
+        srt[:, 0] * nverts + srt[:, 2],
+    ])
+    del srt
+    edge_uniq, edge_totals, _ = _group_counts(edge_keys, np.tile(counts, 3))
+    holes = edge_totals == 1
+    excess = edge_totals > 2
+
+    def edge_samples(mask):
+        keys = edge_uniq[mask][:max_samples]
+        return np.stack([keys // nverts, keys % nverts], axis=1)
+
+    report = ManifoldReport(facets=len(tris), edges=len(edge_uniq))
+    report.dupe_face_count = int(np.count_nonzero(dupes))
+    report.hole_edge_count = int(np.count_nonzero(holes))
+    report.dupe_edge_count = int(np.count_nonzero(excess))
+    report.dupe_faces = np.sort(face_first[dupes])[:max_samples]
+    report.hole_edges = edge_samples(holes)
+    report.dupe_edges = edge_samples(excess)
+    return report
+
+
+# vim: expandtab tabstop=4 shiftwidth=4 softtabstop=4 nowrap
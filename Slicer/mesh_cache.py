@@ -0,0 +1,151 @@
+import os
+import os.path
+import json
+import shutil
+import hashlib
+import tempfile
+
+import numpy as np
+
+
+FORMAT_VERSION = 1
+
+
+def default_cache_dir():
+    """Returns $SLICER_CACHE_DIR, or ~/.cache/slicer/meshes if not set."""
+    path = os.environ.get("SLICER_CACHE_DIR")
+    if not path:
+        path = os.path.join(os.path.expanduser("~"), ".cache", "slicer", "meshes")
+    return path
+
+
+def file_key(filename, *settings):
+    """
+    Returns a cache key for an STL file: a hash of its contents, of the
+    cache format version, and of any settings that change the loaded mesh.
+    """
+    h = hashlib.sha256()
+    h.update(repr((FORMAT_VERSION,) + settings).encode('utf-8'))
+    with open(filename, 'rb') as f:
+        while True:
+            chunk = f.read(1 << 20)
+            if not chunk:
+                break
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class MeshCache(object):
+    """
+    Directory of cached mesh data.  Each entry is a subdirectory named by
+    its key, holding named groups of arrays as .npy files, which are loaded
+    memory-mapped, and a meta.json file.  Once the total size of the cache
+    exceeds max_bytes, the least recently used entries are removed.
+    """
+
+    def __init__(self, path=None, max_bytes=1 << 30):
+        """Initialize with a cache directory, created on first store."""
+        if path is None:
+            path = default_cache_dir()
+        self.path = path
+        self.max_bytes = max_bytes
+
+    def _entry(self, key):
+        return os.path.join(self.path, key)
+
+    def _meta_file(self, key):
+        return os.path.join(self._entry(key), "meta.json")
+
+    def get_meta(self, key):
+        """Returns the meta dict for an entry, or None if it isn't cached."""
+        try:
+            with open(self._meta_file(key), 'r') as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+
+    def set_meta(self, key, meta):
+        """Replaces the meta dict of an entry, creating the entry if needed."""
+        entry = self._entry(key)
+        os.makedirs(entry, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=entry, suffix=".tmp")
+        with os.fdopen(fd, 'w') as f:
+            json.dump(meta, f)
+        os.replace(tmp, self._meta_file(key))
+
+    def load(self, key, group="mesh"):
+        """
+        Returns a dict of memory-mapped arrays for a group of a cached entry,
+        or None if it isn't cached.  Marks the entry as recently used.
+        """
+        meta = self.get_meta(key)
+        if meta is None or group not in meta.get("groups", {}):
+            return None
+        entry = self._entry(key)
+        arrays = {}
+        try:
+            for name in meta["groups"][group]:
+                fname = os.path.join(entry, "{0}.{1}.npy".format(group, name))
+                arrays[name] = np.load(fname, mmap_mode='r')
+            os.utime(self._meta_file(key), None)
+        except (IOError, OSError, ValueError):
+            return None
+        return arrays
+
+    def store(self, key, arrays, group="mesh", **info):
+        """
+        Saves a dict of arrays as a group of a cache entry, along with any
+        extra JSON serializable info for the meta dict.  The group is only
+        listed in meta.json once all its files are written, so a partly
+        written group is never loaded.  Evicts old entries afterwards.
+        """
+        entry = self._entry(key)
+        os.makedirs(entry, exist_ok=True)
+        for name, arr in arrays.items():
+            fd, tmp = tempfile.mkstemp(dir=entry, suffix=".tmp")
+            with os.fdopen(fd, 'wb') as f:
+                np.save(f, np.ascontiguousarray(arr))
+            os.replace(tmp, os.path.join(entry, "{0}.{1}.npy".format(group, name)))
+        meta = self.get_meta(key) or {}
+        meta.setdefault("groups", {})[group] = sorted(arrays.keys())
+        meta.update(info)
+        self.set_meta(key, meta)
+        self.evict(keep=key)
+
+    def entries(self):
+        """Returns a list of (last used time, size in bytes, key) of all entries."""
+        out = []
+        if not os.path.isdir(self.path):
+            return out
+        for key in os.listdir(self.path):
+            entry = self._entry(key)
+            try:
+                used = os.path.getmtime(self._meta_file(key))
+                size = sum(
+                    os.path.getsize(os.path.join(entry, fname))
+                    for fname in os.listdir(entry)
+                )
+            except OSError:
+                continue
+            out.append((used, size, key))
+        return out
+
+    def evict(self, keep=None):
+        """Removes least recently used entries until the cache fits max_bytes."""
+        entries = sorted(self.entries())
+        total = sum(size for _, size, _ in entries)
+        for used, size, key in entries:
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            shutil.rmtree(self._entry(key), ignore_errors=True)
+            total -= size
+
+    def clear(self):
+        """Removes all cache entries."""
+        for _, _, key in self.entries():
+            shutil.rmtree(self._entry(key), ignore_errors=True)
+
+
+# vim: expandtab tabstop=4 shiftwidth=4 softtabstop=4 nowrap
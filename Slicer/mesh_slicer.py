@@ -0,0 +1,138 @@
+import numpy as np
+
+
+def _clockwise(p, q, norm2d, ref):
+    """
+    Vectorized Facet3D._clockwise_line().  Swaps the ends of the segments
+    p -> q where the point ref + norm2d lies on their right side.
+    """
+    pt = ref + norm2d
+    side = (q[:, 0] - p[:, 0]) * (pt[:, 1] - p[:, 1]) - \
+        (q[:, 1] - p[:, 1]) * (pt[:, 0] - p[:, 0])
+    flip = side < 0
+    p2 = np.where(flip[:, None], q, p)
+    q2 = np.where(flip[:, None], p, q)
+    return np.stack([p2, q2], axis=1)
+
+
+def _lerp_xy(v1, v2, z):
+    """
+    Returns the XY points where the lines v1 -> v2 reach height z.  Each
+    line is worked out from its lower end, so that the two facets sharing
+    an edge get bitwise equal points, whichever way round they list it.
+    """
+    swap = (v1[:, 2] > v2[:, 2])[:, None]
+    v1, v2 = np.where(swap, v2, v1), np.where(swap, v1, v2)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        u = (z - v1[:, 2]) / (v2[:, 2] - v1[:, 2])
+    return v1[:, 0:2] + u[:, None] * (v2[:, 0:2] - v1[:, 0:2])
+
+
+def slice_triangles(coords, normals, z, quanta=1e-3):
+    """
+    Intersects a batch of facets with the plane at height z, the same way
+    Facet3D.slice_at_z() does for one facet, including its handling of
+    vertices and edges lying on the plane and of horizontal facets.
+    coords is a Kx3x3 array of facet vertices, and normals is Kx3.
+    Returns (segments, hits), where segments is an Mx2x2 array of clockwise
+    XY segments, and hits holds the index into coords of each segment.
+    """
+    coords = np.asarray(coords, dtype=np.float64)
+    normals = np.asarray(normals, dtype=np.float64)
+    z = np.floor(z / quanta + 0.5) * quanta + quanta / 2
+    vz = coords[:, :, 2]
+    minz = vz.min(axis=1)
+    maxz = vz.max(axis=1)
+    live = (z >= minz) & (z <= maxz) & \
+        (np.hypot(normals[:, 0], normals[:, 1]) >= 1e-6)
+    hits = np.flatnonzero(live)
+    coords = coords[hits]
+    norm2d = normals[hits, 0:2]
+    vz = vz[hits]
+    minz = minz[hits]
+    maxz = maxz[hits]
+    k = len(hits)
+    segs = np.zeros((k, 2, 2), dtype=np.float64)
+    done = np.zeros(k, dtype=bool)
+    rows = np.arange(k)
+
+    # An edge lying on the plane becomes the segment.
+    on = vz == z
+    edge_on = on & np.roll(on, -1, axis=1)
+    has = edge_on.any(axis=1)
+    if has.any():
+        i = np.argmax(edge_on, axis=1)[has]
+        v1 = coords[rows[has], i]
+        v2 = coords[rows[has], (i + 1) % 3]
+        segs[has] = _clockwise(
+            v1[:, 0:2], v2[:, 0:2], norm2d[has], v1[:, 0:2])
+        done |= has
+
+    # Facets that just touch the plane at their top or bottom are skipped.
+    touch = ~done & ((z == minz) | (z == maxz))
+
+    # A vertex lying on the plane is one end of the segment.
+    todo = ~done & ~touch
+    vert_on = on & todo[:, None]
+    has = vert_on.any(axis=1)
+    if has.any():
+        i = np.argmax(vert_on, axis=1)[has]
+        r = rows[has]
+        v1 = coords[r, (i + 2) % 3]
+        v2 = coords[r, i]
+        v3 = coords[r, (i + 1) % 3]
+        p = v2[:, 0:2]
+        q = _lerp_xy(v1, v3, z)
+        segs[has] = _clockwise(p, q, norm2d[has], p)
+        done |= has
+
+    # Otherwise, exactly two edges cross the plane.
+    todo = ~done & ~touch
+    if todo.any():
+        r = rows[todo]
+        c = coords[r]
+        cz = vz[r]
+        nz = np.roll(cz, -1, axis=1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            u = (z - cz) / (nz - cz)
+        cross = (cz != nz) & (u >= 0.0) & (u <= 1.0)
+        first = np.argsort(~cross, axis=1, kind='stable')[:, 0:2]
+        rr = np.arange(len(r))
+        e1, e2 = first[:, 0], first[:, 1]
+        p = _lerp_xy(c[rr, e1], c[rr, (e1 + 1) % 3], z)
+        q = _lerp_xy(c[rr, e2], c[rr, (e2 + 1) % 3], z)
+        segs[todo] = _clockwise(p, q, norm2d[todo], p)
+        done |= todo
+
+    return segs[done], hits[done]
+
+
+def slice_mesh(mesh, facet_ids, z, quanta=1e-3):
+    """
+    Slices the given facets of an IndexedMesh at height z.  Returns
+    (segments, ids), with the mesh facet index of each segment in ids.
+    """
+    facet_ids = np.asarray(facet_ids, dtype=np.int64)
+    coords = mesh.vertices[mesh.triangles[facet_ids]]
+    segs, hits = slice_triangles(coords, mesh.normals[facet_ids], z, quanta)
+    return segs, facet_ids[hits]
+
+
+def sweep_slices(mesh, layer_index, layer_h, start=None, stop=None, quanta=1e-3):
+    """
+    Generates (layer, z, segments, ids) for every layer of a mesh in one
+    pass, using the active facet set of a LayerIndex sweep.  If the index
+    has a layer schedule, each layer is sliced at its midpoint instead of
+    at layer * layer_h.
+    """
+    bounds = layer_index.bounds
+    for layer, facet_ids in layer_index.sweep(start, stop):
+        if bounds is not None:
+            z = (bounds[layer] + bounds[layer + 1]) / 2.0
+        else:
+            z = layer * layer_h
+        segs, ids = slice_mesh(mesh, facet_ids, z, quanta)
+        yield layer, z, segs, ids
+
+
+# vim: expandtab tabstop=4 shiftwidth=4 softtabstop=4 nowrap
@@ -0,0 +1,104 @@
+import math
+
+import numpy as np
+import pyclipper
+
+from .stl_arrays import concat_ranges
+
+
+def path_areas(paths):
+    """Returns an array of the signed (shoelace) areas of a list of paths."""
+    areas = np.zeros(len(paths), dtype=np.float64)
+    for i, path in enumerate(paths):
+        pts = np.asarray(path, dtype=np.float64).reshape(-1, 2)
+        x, y = pts[:, 0], pts[:, 1]
+        areas[i] = 0.5 * (np.dot(x, np.roll(y, -1)) - np.dot(np.roll(x, -1), y))
+    return areas
+
+
+def _grid_candidates(lo, hi, points):
+    """
+    Finds the (point, box) pairs where a box might contain a point, using
+    a uniform grid of about one cell per box.  Each box is registered in
+    the cells it overlaps, and each point is looked up in its own cell.
+    """
+    n = len(lo)
+    glo = lo.min(axis=0)
+    span = hi.max(axis=0) - glo
+    size = int(min(max(math.ceil(math.sqrt(n)), 1), 1024))
+    cell = np.where(span > 0, span / size, 1.0)
+
+    def cells(xy):
+        return np.clip(((xy - glo) / cell).astype(np.int64), 0, size - 1)
+
+    c0 = cells(lo)
+    c1 = cells(hi)
+    nx = c1[:, 0] - c0[:, 0] + 1
+    ny = c1[:, 1] - c0[:, 1] + 1
+    counts = nx * ny
+    boxes = np.repeat(np.arange(n), counts)
+    k = concat_ranges(np.zeros(n, dtype=np.int64), counts)
+    ix = c0[boxes, 0] + k % nx[boxes]
+    iy = c0[boxes, 1] + k // nx[boxes]
+    reg_cells = iy * size + ix
+    order = np.argsort(reg_cells, kind='stable')
+    reg_cells = reg_cells[order]
+    reg_boxes = boxes[order]
+
+    pc = cells(points)
+    pcell = pc[:, 1] * size + pc[:, 0]
+    start = np.searchsorted(reg_cells, pcell, 'left')
+    end = np.searchsorted(reg_cells, pcell, 'right')
+    hits = end - start
+    pidx = np.repeat(np.arange(len(points)), hits)
+    bidx = reg_boxes[concat_ranges(start, hits)]
+    return pidx, bidx
+
+
+def nest_paths(paths):
+    """
+    Works out how a list of non-crossing closed paths in integer (Clipper)
+    coordinates nest inside each other.  A path is inside another if its
+    first point is.  Candidate containers are found with a grid index and
+    bounding box and area checks, so only a few exact point in polygon
+    tests are done per path.  Returns (parents, depths, areas): the index
+    of the smallest path containing each path, or -1, how many paths
+    contain each path, and their signed areas.
+    """
+    n = len(paths)
+    areas = path_areas(paths)
+    if not n:
+        empty = np.zeros(0, dtype=np.int64)
+        return empty, empty, areas
+    lo = np.array([np.min(path, axis=0) for path in paths], dtype=np.float64)
+    hi = np.array([np.max(path, axis=0) for path in paths], dtype=np.float64)
+    points = np.array([path[0] for path in paths], dtype=np.float64)
+    size = np.abs(areas)
+
+    i, j = _grid_candidates(lo, hi, points)
+    # A container must be bigger, and its box must hold the whole path.
+    # Equal sized duplicates nest in list order.
+    keep = (i != j) & (
+        (size[j] > size[i]) | ((size[j] == size[i]) & (j < i))
+    )
+    keep &= np.all(lo[j] <= lo[i], axis=1) & np.all(hi[j] >= hi[i], axis=1)
+    i, j = i[keep], j[keep]
+    inside = np.array([
+        pyclipper.PointInPolygon(paths[a][0], paths[b]) != 0
+        for a, b in zip(i.tolist(), j.tolist())
+    ], dtype=bool).reshape(-1)
+    i, j = i[inside], j[inside]
+
+    depths = np.bincount(i, minlength=n)
+    parents = np.full(n, -1, dtype=np.int64)
+    if len(i):
+        # The smallest container is the direct parent.
+        order = np.lexsort((size[j], i))
+        i, j = i[order], j[order]
+        first = np.ones(len(i), dtype=bool)
+        first[1:] = i[1:] != i[:-1]
+        parents[i[first]] = j[first]
+    return parents, depths, areas
+
+
+# vim: expandtab tabstop=4 shiftwidth=4 softtabstop=4 nowrap
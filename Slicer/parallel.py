@@ -0,0 +1,124 @@
+import math
+import multiprocessing
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from .indexed_mesh import IndexedMesh
+from .layer_index import LayerIndex
+from .mesh_slicer import slice_mesh
+from .contours import assemble_contours
+
+
+class SharedArrays(object):
+    """
+    Copies a dict of named arrays into shared memory blocks, so that worker
+    processes can map them instead of unpickling their own copies.
+    """
+
+    def __init__(self, arrays):
+        """Copy the given arrays into new shared memory blocks."""
+        self.blocks = []
+        self.spec = {}
+        for name, arr in arrays.items():
+            arr = np.ascontiguousarray(arr)
+            shm = shared_memory.SharedMemory(create=True, size=max(arr.nbytes, 1))
+            np.ndarray(arr.shape, dtype=arr.dtype, buffer=shm.buf)[...] = arr
+            self.blocks.append(shm)
+            self.spec[name] = (shm.name, arr.shape, arr.dtype.str)
+
+    def close(self):
+        """Release and remove the shared memory blocks."""
+        for shm in self.blocks:
+            shm.close()
+            shm.unlink()
+        self.blocks = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def attach_arrays(spec):
+    """
+    Maps the arrays described by a SharedArrays spec into this process.
+    Returns (arrays, blocks); keep blocks alive while the arrays are used.
+    """
+    arrays = {}
+    blocks = []
+    for name, (shm_name, shape, dtype) in spec.items():
+        shm = shared_memory.SharedMemory(name=shm_name)
+        blocks.append(shm)
+        arrays[name] = np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
+    return arrays, blocks
+
+
+_worker = {}
+
+
+def _init_worker(spec):
+    arrays, blocks = attach_arrays(spec)
+    mesh = IndexedMesh()
+    mesh.vertices = arrays.pop("vertices")
+    mesh.triangles = arrays.pop("triangles")
+    mesh.normals = arrays.pop("normals")
+    _worker["mesh"] = mesh
+    _worker["index"] = LayerIndex.from_arrays(arrays)
+    _worker["blocks"] = blocks
+
+
+def _slice_chunk(task):
+    zs, layer_h = task
+    mesh = _worker["mesh"]
+    index = _worker["index"]
+    out = []
+    for z in zs:
+        segs, _ = slice_mesh(mesh, index.query(index.layer_at(z, layer_h)), z)
+        out.append(assemble_contours(segs))
+    return out
+
+
+def slice_layers(stl, zs, layer_h, jobs=None, chunk_layers=None):
+    """
+    Slices an StlData model at each Z level in zs using a pool of jobs worker
+    processes.  The mesh and layer index arrays are passed to the workers
+    through shared memory.  Each worker gets contiguous runs of layers.
+    Returns a list of (outpaths, deadpaths) in the same order as zs.
+    layer_h may be None if the model's layer index has a layer schedule.
+    """
+    zs = list(zs)
+    if jobs is None:
+        jobs = multiprocessing.cpu_count()
+    if stl.layer_index is None:
+        stl.assign_layers(layer_h)
+    if jobs <= 1 or len(zs) < 2:
+        return [stl.slice_at_z(z, layer_h) for z in zs]
+    if chunk_layers is None:
+        # A few chunks per worker evens out layers of different complexity.
+        chunk_layers = max(1, int(math.ceil(len(zs) / (jobs * 4.0))))
+    mesh = stl.mesh.build()
+    arrays = dict(stl.layer_index.arrays())
+    arrays["vertices"] = mesh.vertices
+    arrays["triangles"] = mesh.triangles
+    arrays["normals"] = mesh.normals
+    tasks = [
+        (zs[pos:pos + chunk_layers], layer_h)
+        for pos in range(0, len(zs), chunk_layers)
+    ]
+    results = []
+    with SharedArrays(arrays) as shared:
+        pool = multiprocessing.Pool(
+            jobs, initializer=_init_worker, initargs=(shared.spec,))
+        try:
+            # imap keeps results in task order, and so in Z order.
+            for chunk in pool.imap(_slice_chunk, tasks):
+                results.extend(chunk)
+        finally:
+            pool.close()
+            pool.join()
+    return results
+
+
+# vim: expandtab tabstop=4 shiftwidth=4 softtabstop=4 nowrap
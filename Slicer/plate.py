@@ -0,0 +1,134 @@
+from multiprocessing.pool import ThreadPool
+
+import numpy as np
+
+from .stl_data import StlData
+from .instrument import Instruments, instruments as default_instruments
+
+
+class PlateFullError(Exception):
+    """Exception class for models that don't all fit on the bed."""
+    pass
+
+
+def pack_boxes(sizes, bed_size, spacing=5.0):
+    """
+    Packs rectangles of the given (width, depth) sizes onto a bed of
+    (width, depth) bed_size, keeping them spacing apart.  Rectangles are
+    placed deepest first, left to right in rows (shelves) as deep as their
+    first rectangle.  The whole layout is then centered on the bed.
+    Returns the (x, y) of the low corner of each rectangle, in the order
+    given.  Raises PlateFullError if they don't all fit.
+    """
+    bed_w, bed_d = bed_size
+    order = sorted(range(len(sizes)), key=lambda i: (-sizes[i][1], -sizes[i][0], i))
+    pos = [None] * len(sizes)
+    x = y = shelf_d = used_w = 0.0
+    for i in order:
+        w, d = sizes[i]
+        if w > bed_w or d > bed_d:
+            raise PlateFullError("Model {0} is bigger than the bed.".format(i))
+        if x > 0 and x + w > bed_w:
+            # Start a new shelf.
+            y += shelf_d + spacing
+            x = shelf_d = 0.0
+        if y + d > bed_d:
+            raise PlateFullError("Only {0} of {1} models fit on the bed.".format(
+                sum(p is not None for p in pos), len(sizes)))
+        pos[i] = (x, y)
+        used_w = max(used_w, x + w)
+        shelf_d = max(shelf_d, d)
+        x += w + spacing
+    used_d = y + shelf_d
+    dx = (bed_w - used_w) / 2.0
+    dy = (bed_d - used_d) / 2.0
+    return [(px + dx, py + dy) for px, py in pos]
+
+
+def _copy_model(stl):
+    """Returns a new StlData with a copy of a loaded model's mesh."""
+    out = StlData(instruments=stl.instruments)
+    out.filename = stl.filename
+    arrays = stl.mesh.arrays()
+    out.mesh.load_arrays(dict((k, np.array(v)) for k, v in arrays.items()))
+    return out
+
+
+def load_models(filenames, cache=None, jobs=None):
+    """
+    Reads STL files in a pool of jobs threads, one per file by default.
+    Each file is read once, and files given more than once are copied.
+    Each read is timed on its own Instruments, which are merged into the
+    shared instruments afterwards.  Returns the StlData for each filename.
+    """
+    unique = sorted(set(filenames), key=filenames.index)
+    if jobs is None:
+        jobs = len(unique)
+
+    def load(filename):
+        stl = StlData(cache=cache, instruments=Instruments())
+        stl.read_file(filename)
+        return stl
+
+    if jobs > 1 and len(unique) > 1:
+        pool = ThreadPool(min(jobs, len(unique)))
+        try:
+            loaded = pool.map(load, unique)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        loaded = [load(filename) for filename in unique]
+    for stl in loaded:
+        default_instruments.merge(stl.instruments)
+        stl.instruments = default_instruments
+    by_name = dict(zip(unique, loaded))
+    models = []
+    for filename in filenames:
+        stl = by_name.pop(filename, None)
+        models.append(stl if stl is not None else _copy_model(models[filenames.index(filename)]))
+    return models
+
+
+def arrange_models(models, bed_size, spacing=5.0):
+    """
+    Places models on the bed with pack_boxes(), by their bounding boxes.
+    Each model is moved with StlData.center() so that it rests on Z=0.
+    """
+    sizes = []
+    for stl in models:
+        minx, miny, minz, maxx, maxy, maxz = stl.points.get_volume()
+        sizes.append((maxx - minx, maxy - miny, maxz - minz))
+    spots = pack_boxes([s[0:2] for s in sizes], bed_size, spacing)
+    for stl, (w, d, h), (x, y) in zip(models, sizes, spots):
+        stl.center((x + w / 2.0, y + d / 2.0, h / 2.0))
+
+
+def merge_models(models):
+    """
+    Merges placed models into one StlData, so that they share one layer
+    index and are sliced in one pass.  The welded meshes are queued as
+    batches and merged by a single IndexedMesh.build().
+    """
+    plate = StlData(instruments=models[0].instruments if models else None)
+    plate.filename = " ".join(stl.filename for stl in models)
+    for stl in models:
+        mesh = stl.mesh.build()
+        plate.mesh.add_batch(mesh.vertices, mesh.triangles, mesh.normals, mesh.facet_counts)
+    with plate.instruments.stage("weld") as st:
+        plate.mesh.build()
+        st["items"] = len(plate.mesh.triangles)
+    return plate
+
+
+def load_plate(filenames, bed_size=(200.0, 200.0), spacing=5.0, cache=None, jobs=None):
+    """
+    Loads STL files, arranges them on the bed, and merges them into one
+    StlData to slice as a single model.  Returns (plate, models).
+    """
+    models = load_models(filenames, cache=cache, jobs=jobs)
+    arrange_models(models, bed_size, spacing)
+    return merge_models(models), models
+
+
+# vim: expandtab tabstop=4 shiftwidth=4 softtabstop=4 nowrap
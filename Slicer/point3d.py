@@ -8,20 +8,29 @@ except ImportError:
     from itertools import izip_longest as ziplong
 
 from .float_fmt import float_fmt
+from .vector import Vector
+
+
+_new_object = object.__new__
 
 
 class Point3D(object):
-    """Class to represent a 3D Point."""
+    """
+    Class to represent a 3D Point.  The coordinates are kept in a tuple,
+    in a slot, so points are small and quick to make.
+    """
+
+    __slots__ = ("_values",)
 
     def __init__(self, *args):
-        self._values = [0.0, 0.0, 0.0]
+        values = [0.0, 0.0, 0.0]
         if len(args) == 1:
             val = args[0]
             if isinstance(val, numbers.Real):
-                self._values = [val, 0.0, 0.0]
+                self._values = (val, 0.0, 0.0)
                 return
             elif isinstance(val, numbers.Complex):
-                self._values = [val.real, val.imag, 0.0]
+                self._values = (val.real, val.imag, 0.0)
                 return
         else:
             val = args
@@ -29,30 +38,49 @@ class Point3D(object):
             for i, x in enumerate(val):
                 if not isinstance(x, numbers.Real):
                     raise TypeError('Expected sequence of real numbers.')
-                self._values[i] = x
+                values[i] = x
         except:
             pass
+        self._values = tuple(values)
+
+    @classmethod
+    def from_tuple(cls, values):
+        """
+        Makes a point from a tuple of three real numbers, without checking
+        them.  For internal callers that already have clean coordinates.
+        """
+        pt = _new_object(cls)
+        pt._values = values
+        return pt
+
+    def __getstate__(self):
+        return self._values
+
+    def __setstate__(self, state):
+        self._values = state
 
     def __iter__(self):
         """Iterator generator for point values."""
-        for idx in range(3):
-            yield self[idx]
+        return iter(self._values)
 
     def __len__(self):
         return 3
 
     def __setitem__(self, idx, val):
-        self._values[idx] = val
+        values = list(self._values)
+        values[idx] = val
+        self._values = tuple(values)
 
     def __getitem__(self, idx):
         """Given a vertex number, returns a vertex coordinate vector."""
-        if type(idx) is not slice and idx >= len(self._values):
+        try:
+            return self._values[idx]
+        except IndexError:
             return 0.0
-        return self._values[idx]
 
     def __hash__(self):
         """Returns hash value for point coords"""
-        return hash(tuple(self._values))
+        return hash(self._values)
 
     def __cmp__(self, p):
         """Compare points for sort ordering in an arbitrary heirarchy."""
@@ -68,17 +96,31 @@ class Point3D(object):
         """Equality comparison for points."""
         return self._values == other._values
 
+    def __ne__(self, other):
+        return self._values != other._values
+
     def __lt__(self, other):
-        return self.__cmp__(other) < 0
+        a = self._values
+        b = other._values if type(other) is Point3D else None
+        if b is None:
+            return self.__cmp__(other) < 0
+        # Same order as __cmp__(): by Z, then Y, then X.
+        return (a[2], a[1], a[0]) < (b[2], b[1], b[0])
 
     def __gt__(self, other):
-        return self.__cmp__(other) > 0
+        a = self._values
+        b = other._values if type(other) is Point3D else None
+        if b is None:
+            return self.__cmp__(other) > 0
+        return (a[2], a[1], a[0]) > (b[2], b[1], b[0])
 
     def __sub__(self, v):
-        return Point3D(self[i] - v[i] for i in range(3))
+        a = self._values
+        return Point3D.from_tuple((a[0] - v[0], a[1] - v[1], a[2] - v[2]))
 
     def __rsub__(self, v):
-        return Point3D(v[i] - self[i] for i in range(3))
+        a = self._values
+        return Point3D.from_tuple((v[0] - a[0], v[1] - a[1], v[2] - a[2]))
 
     def __add__(self, v):
         return Vector(i + j for i, j in zip(self._values, v))
@@ -90,6 +132,8 @@ class Point3D(object):
         """Divide each element in a vector by a scalar."""
         return Vector(x / s for x in self._values)
 
+    __truediv__ = __div__
+
     def __format__(self, fmt):
         vals = [float_fmt(x) for x in self._values]
         if "a" in fmt:
@@ -109,7 +153,7 @@ class Point3D(object):
 
     def translate(self, offset):
         """Translates the coordinates of this point."""
-        self._values = [i + j for i, j in zip(offset, self._values)]
+        self._values = tuple(i + j for i, j in zip(offset, self._values))
 
     def distFromPoint(self, v):
         """Returns the distance from another point."""
@@ -189,7 +233,7 @@ class Point3DCache(object):
         key = tuple(round(n, 4) for n in [x, y, z])
         if key in self.point_hash:
             return self.point_hash[key]
-        pt = Point3D(key)
+        pt = Point3D.from_tuple(key)
         self.point_hash[key] = pt
         self._update_volume(pt)
         return pt
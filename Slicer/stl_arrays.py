@@ -0,0 +1,239 @@
+import re
+
+import numpy as np
+
+
+BINARY_FACET_DTYPE = np.dtype([
+    ('normal', '<f4', (3,)),
+    ('vertices', '<f4', (3, 3)),
+    ('attr', '<u2'),
+])
+
+
+def iter_binary_facet_batches(f, count, batch_size=1 << 16):
+    """
+    Reads up to count binary STL facet records from the file f, yielding
+    (normals, vertices) arrays of at most batch_size facets each.
+    Normals are Nx3 float32, vertices are Nx3x3 float64.
+    """
+    itemsize = BINARY_FACET_DTYPE.itemsize
+    remaining = count
+    while remaining > 0:
+        n = min(batch_size, remaining)
+        buf = f.read(n * itemsize)
+        n = len(buf) // itemsize
+        if n == 0:
+            return  # Truncated file.
+        data = np.frombuffer(buf, dtype=BINARY_FACET_DTYPE, count=n)
+        yield data['normal'], data['vertices'].astype(np.float64)
+        remaining -= n
+
+
+_ASCII_NUM = br'([-+]?(?:\d+\.?\d*|\.\d+)(?:e[-+]?\d+)?|[-+]?nan|[-+]?inf(?:inity)?)'
+_ASCII_VERTEX = br'\s+vertex' + (br'\s+' + _ASCII_NUM) * 3
+_ASCII_FACET_RE = re.compile(
+    br'\bfacet\s+normal' + (br'\s+' + _ASCII_NUM) * 3 +
+    br'\s+outer\s+loop' + _ASCII_VERTEX * 3 +
+    br'\s+endloop\s+endfacet\b'
+)
+
+
+def _ascii_facets_to_arrays(records):
+    vals = np.array(records, dtype='S').astype(np.float64)
+    return vals[:, 0:3], vals[:, 3:12].reshape(-1, 3, 3)
+
+
+def iter_ascii_facet_batches(f, batch_size=1 << 16, chunk_size=1 << 22):
+    """
+    Reads ASCII STL facet records from the file f in large blocks, yielding
+    (normals, vertices) arrays of at most batch_size facets each.  Only one
+    block and one batch are held in memory at a time.  Malformed facets are
+    skipped, and reading stops at the first endsolid line.
+    """
+    pending = []
+    tail = b""
+    done = False
+    while not done:
+        chunk = f.read(chunk_size)
+        buf = tail + chunk.lower()
+        end = buf.find(b"endsolid")
+        if end >= 0:
+            buf = buf[:end]
+            done = True
+        elif not chunk:
+            done = True
+        if done:
+            tail = b""
+        else:
+            cut = buf.rfind(b"endfacet")
+            if cut < 0:
+                # No complete facet yet.  Don't let junk grow the tail forever.
+                tail = buf if len(buf) < 4 * chunk_size else buf[-1024:]
+                continue
+            cut += len(b"endfacet")
+            buf, tail = buf[:cut], buf[cut:]
+        pending.extend(_ASCII_FACET_RE.findall(buf))
+        while len(pending) >= batch_size or (done and pending):
+            batch, pending = pending[:batch_size], pending[batch_size:]
+            yield _ascii_facets_to_arrays(batch)
+
+
+_TRAILING_ZEROS_RE = re.compile(br'\.?0+(?=[ \n])')
+_NEGATIVE_ZERO_RE = re.compile(br'(?<![0-9.])-0(?=[ \n])')
+_ASCII_FACET_FMT = (
+    "  facet normal %.6f %.6f %.6f\n"
+    "    outer loop\n"
+    "      vertex %.6f %.6f %.6f\n"
+    "      vertex %.6f %.6f %.6f\n"
+    "      vertex %.6f %.6f %.6f\n"
+    "    endloop\n"
+    "  endfacet\n"
+)
+
+
+def format_ascii_facets(normals, verts):
+    """
+    Formats Nx3 normals and Nx3x3 vertices as ASCII STL facet records,
+    returning bytes.  Numbers are trimmed the same way as float_fmt().
+    """
+    vals = np.concatenate(
+        [np.asarray(normals).reshape(-1, 3), np.asarray(verts).reshape(-1, 9)],
+        axis=1
+    )
+    if not len(vals):
+        return b""
+    text = (_ASCII_FACET_FMT * len(vals)) % tuple(vals.ravel().tolist())
+    text = _TRAILING_ZEROS_RE.sub(b"", text.encode('utf-8'))
+    return _NEGATIVE_ZERO_RE.sub(b"0", text)
+
+
+def pack_binary_facets(normals, verts):
+    """Packs Nx3 normals and Nx3x3 vertices into binary STL facet records."""
+    data = np.zeros(len(normals), dtype=BINARY_FACET_DTYPE)
+    data['normal'] = normals
+    data['vertices'] = verts
+    return data.tobytes()
+
+
+def quantize_z(verts, quanta=1e-3):
+    """
+    Quantize the Z coordinates of an Nx3x3 vertex array so that they
+    won't be exactly on a layer.  Returns a new array.
+    """
+    verts = np.array(verts, dtype=np.float64)
+    verts[..., 2] = np.floor(verts[..., 2] / quanta + 0.5) * quanta
+    return verts
+
+
+def nondegenerate_mask(verts):
+    """
+    Returns a boolean mask of the facets in an Nx3x3 vertex array that
+    have non-zero area, using the same tests as the per-facet reader.
+    """
+    v1, v2, v3 = verts[:, 0], verts[:, 1], verts[:, 2]
+    mask = ~(
+        np.all(v1 == v2, axis=1) |
+        np.all(v2 == v3, axis=1) |
+        np.all(v3 == v1, axis=1)
+    )
+    vec1 = v1 - v2
+    vec2 = v3 - v2
+    l = np.sqrt(np.einsum('ij,ij->i', vec1, vec1)) * \
+        np.sqrt(np.einsum('ij,ij->i', vec2, vec2))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cos = np.einsum('ij,ij->i', vec1, vec2) / l
+        ang = np.arccos(np.clip(cos, -1.0, 1.0))
+    mask &= (l != 0) & ~(ang < 1e-8)
+    return mask
+
+
+def weld_points(points, places=4):
+    """
+    Merges the points of a Px3 array that are equal once rounded to the
+    given number of decimal places.  Returns (uniq, inverse), where uniq
+    holds the unique rounded coordinates and inverse maps each input point
+    to its row in uniq.  Points are sorted in the same Z, Y, X order that
+    Point3D comparisons use, so a lower index always means a lesser point.
+    """
+    flat = np.round(np.asarray(points, dtype=np.float64).reshape(-1, 3), places)
+    flat += 0.0  # Fold -0.0 into 0.0, as tuple keys do.
+    if not len(flat):
+        return flat, np.zeros(0, dtype=np.int64)
+    order = np.lexsort((flat[:, 0], flat[:, 1], flat[:, 2]))
+    srt = flat[order]
+    new = np.empty(len(srt), dtype=bool)
+    new[0] = True
+    new[1:] = np.any(srt[1:] != srt[:-1], axis=1)
+    inverse = np.empty(len(flat), dtype=np.int64)
+    inverse[order] = np.cumsum(new) - 1
+    return srt[new], inverse
+
+
+def weld_vertices(verts, places=4):
+    """
+    Welds the vertices of an Nx3x3 facet array.  Returns (points, tris),
+    where points is a Px3 array of unique coordinates, sorted as by
+    weld_points(), and tris is an Nx3 array of indices into it.
+    """
+    points, inverse = weld_points(verts, places)
+    return points, inverse.reshape(-1, 3)
+
+
+def group_rows(rows):
+    """
+    Groups the equal rows of a 2D integer array.  Returns (first, inverse),
+    where first holds the index of the first occurrence of each distinct
+    row, in order of first occurrence, and inverse maps each row to its
+    position in first.
+    """
+    rows = np.asarray(rows)
+    n = len(rows)
+    if not n:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    order = np.lexsort(rows.T[::-1])
+    srt = rows[order]
+    new = np.empty(n, dtype=bool)
+    new[0] = True
+    new[1:] = np.any(srt[1:] != srt[:-1], axis=1)
+    del srt
+    first = np.minimum.reduceat(order, np.flatnonzero(new))
+    perm = np.argsort(first, kind='stable')
+    rank = np.empty(len(perm), dtype=np.int64)
+    rank[perm] = np.arange(len(perm))
+    inverse = np.empty(n, dtype=np.int64)
+    inverse[order] = rank[np.cumsum(new) - 1]
+    return first[perm], inverse
+
+
+def unique_rows(rows):
+    """
+    Finds the unique rows of an integer array.  Returns (uniq, first, counts)
+    ordered by the first occurrence of each row, where first holds the index
+    of that first occurrence and counts how many times the row appears.
+    """
+    rows = np.asarray(rows)
+    first, inverse = group_rows(rows)
+    return rows[first], first, np.bincount(inverse, minlength=len(first))
+
+
+def facet_edges(tris):
+    """
+    Returns the 3N x 2 array of (lesser, greater) vertex index pairs for
+    the edges of each facet in an Nx3 triangle index array.
+    """
+    pairs = np.stack([
+        tris[:, [0, 1]],
+        tris[:, [1, 2]],
+        tris[:, [2, 0]],
+    ], axis=1).reshape(-1, 2)
+    return np.sort(pairs, axis=1)
+
+
+def concat_ranges(starts, counts):
+    """Concatenates arange(start, start + count) for each start and count."""
+    counts = np.asarray(counts, dtype=np.int64)
+    offsets = np.repeat(np.cumsum(counts) - counts, counts)
+    return np.repeat(starts, counts) + np.arange(int(counts.sum())) - offsets
+
+
+# vim: expandtab tabstop=4 shiftwidth=4 softtabstop=4 nowrap
@@ -2,16 +2,23 @@ from __future__ import print_function
 
 import os.path
 import sys
+import hashlib
 import math
 import time
 import struct
+import numpy as np
 from pyquaternion import Quaternion
 
-from .TextThermometer import TextThermometer
-from .point3d import Point3DCache
-from .vector import Vector
-from .facet3d import Facet3DCache
-from .line_segment3d import LineSegment3DCache
+from . import stl_arrays
+from . import parallel
+from . import layer_planner
+from .instrument import instruments as default_instruments
+from .indexed_mesh import IndexedMesh
+from .layer_index import LayerIndex
+from .manifold import ManifoldReport, check_triangles
+from .mesh_cache import file_key
+from .mesh_slicer import slice_mesh
+from .contours import assemble_contours
 
 
 class StlEndOfFileException(Exception):
@@ -27,38 +34,37 @@ class StlMalformedLineException(Exception):
 class StlData(object):
     """Class to read, write, and validate STL file data."""
 
-    def __init__(self):
-        """Initialize with empty data set."""
-        self.points = Point3DCache()
-        self.edges = LineSegment3DCache()
-        self.facets = Facet3DCache()
+    def __init__(self, cache=None, instruments=None):
+        """
+        Initialize with empty data set.  If a MeshCache is given, loaded
+        meshes, manifold checks and layer indexes are cached in it.  Stage
+        timings and progress go to the given Instruments, or to the shared
+        instrument.instruments.
+        """
+        if instruments is None:
+            instruments = default_instruments
+        self.instruments = instruments
+        self._reset_mesh()
         self.filename = ""
         self.dupe_faces = []
         self.dupe_edges = []
         self.hole_edges = []
-        self.layer_facets = {}
-
-    def _read_ascii_line(self, f, watchwords=None):
-        line = f.readline(1024).decode('utf-8')
-        if line == "":
-            raise StlEndOfFileException()
-        words = line.strip(' \t\n\r').lower().split()
-        if not words:
-            return []
-        if words[0] == 'endsolid':
-            raise StlEndOfFileException()
-        argstart = 0
-        if watchwords:
-            watchwords = watchwords.lower().split()
-            argstart = len(watchwords)
-            for i in range(argstart):
-                if words[i] != watchwords[i]:
-                    raise StlMalformedLineException()
-        return [float(val) for val in words[argstart:]]
-
-    def _read_ascii_vertex(self, f):
-        point = self._read_ascii_line(f, watchwords='vertex')
-        return self.points.add(*point)
+        self.manifold_report = None
+        self.layer_index = None
+        self.incomplete_layers = {}
+        self.slice_cache = {}
+        self.keep_slices = False
+        self.layer_params = None
+        self.changed_ranges = []
+        self.cache = cache
+        self.cache_key = None
+        self.placement = np.eye(4)
+
+    def _reset_mesh(self):
+        self.mesh = IndexedMesh()
+        self.points = self.mesh.point_view
+        self.edges = self.mesh.edge_view
+        self.facets = self.mesh.facet_view
 
     def quantz(self, pt, quanta=1e-3):
         """Quantize the Z coordinate of the given point so that it won't be exactly on a layer."""
@@ -66,156 +72,175 @@ class StlData(object):
         z = math.floor(z / quanta + 0.5) * quanta
         return (x, y, z)
 
-    def _read_ascii_facet(self, f, quanta=1e-3):
-        while True:
-            try:
-                normal = self._read_ascii_line(f, watchwords='facet normal')
-                self._read_ascii_line(f, watchwords='outer loop')
-                vertex1 = self._read_ascii_vertex(f)
-                vertex2 = self._read_ascii_vertex(f)
-                vertex3 = self._read_ascii_vertex(f)
-                self._read_ascii_line(f, watchwords='endloop')
-                self._read_ascii_line(f, watchwords='endfacet')
-                if quanta > 0.0:
-                    vertex1 = self.quantz(vertex1, quanta)
-                    vertex2 = self.quantz(vertex2, quanta)
-                    vertex3 = self.quantz(vertex3, quanta)
-                    if vertex1 == vertex2 or vertex2 == vertex3 or vertex3 == vertex1:
-                        continue  # zero area facet.  Skip to next facet.
-                    vec1 = Vector(vertex1) - Vector(vertex2)
-                    vec2 = Vector(vertex3) - Vector(vertex2)
-                    if vec1.angle(vec2) < 1e-8:
-                        continue  # zero area facet.  Skip to next facet.
-            except StlEndOfFileException:
-                return None
-            except StlMalformedLineException:
-                continue  # Skip to next facet.
-            self.edges.add(vertex1, vertex2)
-            self.edges.add(vertex2, vertex3)
-            self.edges.add(vertex3, vertex1)
-            return self.facets.add(vertex1, vertex2, vertex3, normal)
-
-    def _read_binary_facet(self, f, quanta=1e-3):
-        data = struct.unpack('<3f 3f 3f 3f H', f.read(4*4*3+2))
-        normal = data[0:3]
-        vertex1 = data[3:6]
-        vertex2 = data[6:9]
-        vertex3 = data[9:12]
+    def _add_facet_batch(self, normals, verts, quanta=1e-3):
+        """
+        Adds a batch of facets, given as Nx3 normal and Nx3x3 vertex arrays.
+        Quantization, zero area facet rejection and vertex welding are done
+        on the whole batch at once.  The batch is queued on the mesh, and
+        merged into it by IndexedMesh.build().  Returns the number of facets
+        kept.
+        """
         if quanta > 0.0:
-            vertex1 = self.quantz(vertex1, quanta)
-            vertex2 = self.quantz(vertex2, quanta)
-            vertex3 = self.quantz(vertex3, quanta)
-            if vertex1 == vertex2 or vertex2 == vertex3 or vertex3 == vertex1:
-                return None
-            vec1 = Vector(vertex1) - Vector(vertex2)
-            vec2 = Vector(vertex3) - Vector(vertex2)
-            if vec1.angle(vec2) < 1e-8:
-                return None
-        v1 = self.points.add(*vertex1)
-        v2 = self.points.add(*vertex2)
-        v3 = self.points.add(*vertex3)
-        self.edges.add(v1, v2)
-        self.edges.add(v2, v3)
-        self.edges.add(v3, v1)
-        return self.facets.add(v1, v2, v3, normal)
+            verts = stl_arrays.quantize_z(verts, quanta)
+            keep = stl_arrays.nondegenerate_mask(verts)
+            verts = verts[keep]
+            normals = normals[keep]
+        if not len(verts):
+            return 0
+        with self.instruments.stage("weld", len(verts)):
+            coords, tris = stl_arrays.weld_vertices(verts)
+        if quanta > 0.0:
+            # Facets whose vertices welded together have zero area too.
+            keep = (tris[:, 0] != tris[:, 1]) & \
+                (tris[:, 1] != tris[:, 2]) & \
+                (tris[:, 2] != tris[:, 0])
+            tris = tris[keep]
+            normals = normals[keep]
+        self.mesh.add_batch(coords, tris, normals)
+        return len(tris)
 
     def read_file(self, filename):
         """Read the model data from the given STL file."""
         self.filename = filename
+        self.slice_cache = {}
+        if self.cache is not None and self._read_cached(filename):
+            return
+        # Cached data only stands for a mesh read from one file.
+        fresh = not len(self.mesh)
         print("Loading model")
         file_size = os.path.getsize(filename)
-        with open(filename, 'rb') as f:
+        inst = self.instruments
+        with inst.stage("read") as st, open(filename, 'rb') as f:
             line = f.readline(80)
             if line == "":
                 return  # End of file.
             if line[0:6].lower() == b"solid " and len(line) < 80:
                 # Reading ASCII STL file.
-                thermo = TextThermometer(file_size)
-                while self._read_ascii_facet(f) is not None:
-                    thermo.update(f.tell())
-                thermo.clear()
+                progress = inst.progress("read", file_size)
+                for normals, verts in stl_arrays.iter_ascii_facet_batches(f):
+                    st["items"] += len(verts)
+                    self._add_facet_batch(normals, verts)
+                    progress.update(f.tell())
+                progress.done()
             else:
                 # Reading Binary STL file.
                 chunk = f.read(4)
                 facets = struct.unpack('<I', chunk)[0]
-                thermo = TextThermometer(facets)
-                for n in range(facets):
-                    thermo.update(n)
-                    if self._read_binary_facet(f) is None:
-                        pass
-                thermo.clear()
-
-    def _write_ascii_file(self, filename):
+                progress = inst.progress("read", facets)
+                batches = stl_arrays.iter_binary_facet_batches(f, facets)
+                for normals, verts in batches:
+                    st["items"] += len(verts)
+                    self._add_facet_batch(normals, verts)
+                    progress.update(st["items"])
+                progress.done()
+            with inst.stage("weld") as wst:
+                self.mesh.build()
+                wst["items"] = len(self.mesh.triangles)
+        inst.count("facets_read", st["items"])
+        if self.cache is not None and fresh:
+            self.cache.store(self.cache_key, self.mesh.arrays(), facets=len(self.mesh))
+        else:
+            self.cache_key = None
+
+    def _read_cached(self, filename):
+        """
+        Looks up the given STL file in the mesh cache, by the hash of its
+        contents, and loads the cached mesh arrays if they are found there.
+        Returns True if the mesh was loaded from the cache.
+        """
+        self.cache_key = None
+        if len(self.mesh):
+            return False
+        self.cache_key = file_key(filename, "stl", 1e-3)
+        self.placement = np.eye(4)
+        arrays = self.cache.load(self.cache_key)
+        if arrays is None:
+            return False
+        print("Loading model from cache")
+        self.mesh.load_arrays(arrays)
+        return True
+
+    def _iter_facet_chunks(self, sort=True, chunk_size=1 << 16):
+        """Generates (normals, vertices) arrays for chunks of the facets."""
+        mesh = self.mesh.build()
+        order = mesh.sort_order() if sort else None
+        for pos in range(0, len(mesh.triangles), chunk_size):
+            if order is None:
+                idx = slice(pos, pos + chunk_size)
+            else:
+                idx = order[pos:pos + chunk_size]
+            yield mesh.normals[idx], mesh.vertices[mesh.triangles[idx]]
+
+    def _write_ascii_file(self, filename, sort=True):
         with open(filename, 'wb') as f:
             f.write(b"solid Model\n")
-            for facet in self.facets.sorted():
-                f.write(
-                    "  facet normal {norm:s}\n"
-                    "    outer loop\n"
-                    "      vertex {v0:s}\n"
-                    "      vertex {v1:s}\n"
-                    "      vertex {v2:s}\n"
-                    "    endloop\n"
-                    "  endfacet\n"
-                    .format(
-                        v0=facet[0],
-                        v1=facet[1],
-                        v2=facet[2],
-                        norm=facet.norm
-                    )
-                    .encode('utf-8')
-                )
+            for normals, verts in self._iter_facet_chunks(sort):
+                f.write(stl_arrays.format_ascii_facets(normals, verts))
             f.write(b"endsolid Model\n")
 
-    def _write_binary_file(self, filename):
+    def _write_binary_file(self, filename, sort=True):
         with open(filename, 'wb') as f:
-            f.write('{0:-80s}'.format('Binary STL Model'))
+            f.write(b'Binary STL Model'.ljust(80))
             f.write(struct.pack('<I', len(self.facets)))
-            for facet in self.facets.sorted():
-                f.write(struct.pack(
-                    '<3f 3f 3f 3f H',
-                    facet.norm[0], facet.norm[1], facet.norm[2],
-                    facet[0][0], facet[0][1], facet[0][2],
-                    facet[1][0], facet[1][1], facet[1][2],
-                    facet[2][0], facet[2][1], facet[2][2],
-                    0
-                ))
-
-    def write_file(self, filename, binary=False):
-        """Write the model data to an STL file."""
-        if binary:
-            self._write_binary_file(filename)
-        else:
-            self._write_ascii_file(filename)
-
-    def _check_manifold_duplicate_faces(self):
-        return [facet for facet in self.facets if facet.count != 1]
-
-    def _check_manifold_hole_edges(self):
-        return [edge for edge in self.edges if edge.count == 1]
-
-    def _check_manifold_excess_edges(self):
-        return [edge for edge in self.edges if edge.count > 2]
-
-    def check_manifold(self, verbose=False):
-        """Validate if the model is manifold, and therefore printable."""
-        is_manifold = True
-        self.dupe_faces = self._check_manifold_duplicate_faces()
-        for face in self.dupe_faces:
-            is_manifold = False
-            print("NON-MANIFOLD DUPLICATE FACE! {0}: {1}"
-                  .format(self.filename, face))
-        self.hole_edges = self._check_manifold_hole_edges()
-        for edge in self.hole_edges:
-            is_manifold = False
-            print("NON-MANIFOLD HOLE EDGE! {0}: {1}"
-                  .format(self.filename, edge))
-        self.dupe_edges = self._check_manifold_excess_edges()
-        for edge in self.dupe_edges:
-            is_manifold = False
-            print("NON-MANIFOLD DUPLICATE EDGE! {0}: {1}"
-                  .format(self.filename, edge))
-        return is_manifold
+            for normals, verts in self._iter_facet_chunks(sort):
+                f.write(stl_arrays.pack_binary_facets(normals, verts))
+
+    def write_file(self, filename, binary=False, sort=True):
+        """
+        Write the model data to an STL file.  Facets are written in chunks.
+        If sort is True, they are written in a deterministic order, using a
+        sort key computed for all facets at once.
+        """
+        with self.instruments.stage("write", len(self.mesh)):
+            if binary:
+                self._write_binary_file(filename, sort)
+            else:
+                self._write_ascii_file(filename, sort)
+
+    def _mesh_segments(self, pairs):
+        mesh = self.mesh
+        return [mesh.segment(mesh.find_edge(v1, v2)) for v1, v2 in pairs.tolist()]
+
+    def check_manifold(self, verbose=False, max_samples=10):
+        """
+        Validate if the model is manifold, and therefore printable.
+        At most max_samples of each kind of problem are printed and kept in
+        dupe_faces, hole_edges and dupe_edges.  The full counts are kept in
+        manifold_report.
+        """
+        mesh = self.mesh.build()
+        report = None
+        meta = {}
+        if self.cache_key is not None:
+            meta = self.cache.get_meta(self.cache_key) or {}
+            cached = meta.get("manifold", {}).get(str(max_samples))
+            if cached is not None:
+                report = ManifoldReport.from_dict(cached)
+        if report is None:
+            with self.instruments.stage("validate", len(mesh.triangles)):
+                report = check_triangles(mesh.triangles, mesh.facet_counts, max_samples)
+            if self.cache_key is not None:
+                meta.setdefault("manifold", {})[str(max_samples)] = report.as_dict()
+                self.cache.set_meta(self.cache_key, meta)
+        self.manifold_report = report
+        self.dupe_faces = [mesh.facet(i) for i in report.dupe_faces.tolist()]
+        self.hole_edges = self._mesh_segments(report.hole_edges)
+        self.dupe_edges = self._mesh_segments(report.dupe_edges)
+        problems = [
+            ("DUPLICATE FACE", self.dupe_faces, report.dupe_face_count),
+            ("HOLE EDGE", self.hole_edges, report.hole_edge_count),
+            ("DUPLICATE EDGE", self.dupe_edges, report.dupe_edge_count),
+        ]
+        for name, samples, count in problems:
+            for item in samples:
+                print("NON-MANIFOLD {0}! {1}: {2}"
+                      .format(name, self.filename, item))
+            if count > len(samples):
+                print("NON-MANIFOLD {0}! {1}: ...and {2} more"
+                      .format(name, self.filename, count - len(samples)))
+        if verbose:
+            print("{0}: {1}".format(self.filename, report))
+        return report.is_manifold
 
     def get_facets(self):
         return self.facets
@@ -224,93 +249,254 @@ class StlData(object):
         return self.edges
 
     def center(self, cp):
-        """Centers the model at the given centerpoint cp."""
-        cx = (self.points.minx + self.points.maxx)/2.0
-        cy = (self.points.miny + self.points.maxy)/2.0
-        cz = (self.points.minz + self.points.maxz)/2.0
-        self.translate((cp[0]-cx, cp[1]-cy, cp[2]-cz))
+        """
+        Centers the model at the given centerpoint cp.  Offsets below
+        rounding error are dropped, so that centering a model again at the
+        same point leaves it, and its kept slices, alone.
+        """
+        cx, cy, cz = self.get_center()
+        offset = [d if abs(d) > 1e-9 else 0.0 for d in (cp[0]-cx, cp[1]-cy, cp[2]-cz)]
+        self.translate(offset)
 
     def translate(self, offset):
         """Translates vertices of all facets in the STL model."""
-        self.points.translate(offset)
-        self.edges.translate(offset)
-        self.facets.translate(offset)
-
-    def assign_layers(self, layer_height):
-        """Calculate which layers intersect which facets, for faster lookup."""
-        self.layer_facets = {}
-        for facet in self.facets:
-            minz, maxz = facet.z_range()
-            minl = int(math.floor(minz / layer_height + 0.01))
-            maxl = int(math.ceil(maxz / layer_height - 0.01))
-            for layer in range(minl, maxl + 1):
-                if layer not in self.layer_facets:
-                    self.layer_facets[layer] = []
-                self.layer_facets[layer].append(facet)
+        if any(offset):
+            self.slice_cache = {}
+            self.placement[0:3, 3] += offset
+        self.mesh.translate(offset)
+
+    def transform(self, matrix):
+        """
+        Applies a 4x4 affine transform matrix to the STL model.  This is
+        only recorded on the mesh, and applied in one array operation when
+        the vertices are next needed.
+        """
+        self.slice_cache = {}
+        self.placement = np.dot(matrix, self.placement)
+        self.mesh.transform(matrix)
+
+    def _about_point(self, lin, cp):
+        """Transform by a 3x3 matrix, keeping the point cp fixed."""
+        if cp is None:
+            cp = self.get_center()
+        cp = np.asarray(cp, dtype=np.float64)
+        matrix = np.eye(4)
+        matrix[0:3, 0:3] = lin
+        matrix[0:3, 3] = cp - np.dot(lin, cp)
+        self.transform(matrix)
+
+    def get_center(self):
+        """Returns the center point of the model's bounding box."""
+        return (
+            (self.points.minx + self.points.maxx)/2.0,
+            (self.points.miny + self.points.maxy)/2.0,
+            (self.points.minz + self.points.maxz)/2.0,
+        )
+
+    def scale(self, factor, cp=None):
+        """
+        Scales the model by a factor, or a sequence of X, Y and Z factors,
+        about the point cp, or about the model's center if not given.
+        """
+        factor = np.broadcast_to(np.asarray(factor, dtype=np.float64), (3,))
+        self._about_point(np.diag(factor), cp)
+
+    def rotate(self, axis, angle, cp=None):
+        """
+        Rotates the model by angle degrees around the given axis vector,
+        through the point cp, or through the model's center if not given.
+        """
+        quat = Quaternion(axis=axis, degrees=angle)
+        self._about_point(quat.rotation_matrix, cp)
+
+    def assign_layers(self, layer_height=None, schedule=None):
+        """
+        Calculate which layers intersect which facets, for faster lookup.
+        Layers are either layer_height apart, or follow a schedule of layer
+        boundary heights, as made by plan_layers().
+        """
+        self.layer_params = (layer_height, schedule)
+        group = None
+        if self.cache_key is not None:
+            # The layers depend on where the model has been moved to.
+            if layer_height is not None:
+                layer_height = float(layer_height)
+            h = hashlib.sha1(repr(layer_height).encode('utf-8'))
+            if schedule is not None:
+                h.update(np.asarray(schedule, dtype=np.float64).tobytes())
+            h.update((np.round(self.placement, 9) + 0.0).tobytes())
+            group = "layers-" + h.hexdigest()
+            arrays = self.cache.load(self.cache_key, group)
+            if arrays is not None:
+                self.layer_index = LayerIndex.from_arrays(arrays)
+                return
+        mesh = self.mesh.build()
+        with self.instruments.stage("layer_assign", len(mesh.triangles)):
+            allz = mesh.vertices[mesh.triangles, 2]
+            if schedule is not None:
+                self.layer_index = LayerIndex.from_schedule(
+                    allz.min(axis=1), allz.max(axis=1), schedule)
+            else:
+                minl = np.floor(allz.min(axis=1) / layer_height + 0.01)
+                maxl = np.ceil(allz.max(axis=1) / layer_height - 0.01)
+                self.layer_index = LayerIndex(minl, maxl)
+        if group is not None:
+            self.cache.store(self.cache_key, self.layer_index.arrays(), group)
+
+    def plan_layers(self, min_h, max_h, max_cusp=None):
+        """
+        Plans variable layer heights between min_h and max_h from the slopes
+        of the facets, keeping the stair step left on sloped surfaces under
+        max_cusp, and indexes the facets by those layers.  Returns the array
+        of layer boundary heights.  Slice each layer at its midpoint, as
+        given by layer_planner.layer_midpoints().
+        """
+        bounds = layer_planner.plan_layers(self.mesh, min_h, max_h, max_cusp)
+        self.assign_layers(schedule=bounds)
+        return bounds
+
+    def get_layer_facet_ids(self, layer):
+        """Get the mesh indices of all facets that intersect the given layer."""
+        if self.layer_index is None:
+            return np.zeros(0, dtype=np.int64)
+        return self.layer_index.query(layer)
 
     def get_layer_facets(self, layer):
         """Get all facets that intersect the given layer."""
-        if layer not in self.layer_facets:
-            return []
-        return self.layer_facets[layer]
-
-    def slice_at_z(self, z, layer_h):
-        """Get paths outlines of where this model intersects the given Z level."""
-
-        def ptkey(pt):
-            return "{0:.3f}, {1:.3f}".format(pt[0], pt[1])
-
-        layer = math.floor(z / layer_h + 0.5)
-        paths = {}
-        for facet in self.get_layer_facets(layer):
-            line = facet.slice_at_z(z)
-            if line is None:
-                continue
-            path = list(line)
-            key1 = ptkey(path[0])
-            key2 = ptkey(path[-1])
-            if key2 in paths and paths[key2][-1] == path[0]:
-                continue
-            if key1 not in paths:
-                paths[key1] = []
-            paths[key1].append(path)
-
-        outpaths = []
-        deadpaths = []
-        while paths:
-            path = paths[next(iter(paths))][0]
-            key1 = ptkey(path[0])
-            key2 = ptkey(path[-1])
-            del paths[key1][0]
-            if not paths[key1]:
-                del paths[key1]
-            if key1 == key2:
-                outpaths.append(path)
-                continue
-            elif key2 in paths:
-                opath = paths[key2][0]
-                del paths[key2][0]
-                if not paths[key2]:
-                    del paths[key2]
-                path.extend(opath[1:])
-            elif key1 in paths:
-                opath = paths[key1][0]
-                del paths[key1][0]
-                if not paths[key1]:
-                    del paths[key1]
-                opath = list(reversed(opath))
-                opath.extend(path[1:])
-                path = opath
-            else:
-                deadpaths.append(path)
-                continue
-            key1 = ptkey(path[0])
-            if key1 not in paths:
-                paths[key1] = []
-            paths[key1].append(path)
+        return [self.mesh.facet(i) for i in self.get_layer_facet_ids(layer).tolist()]
+
+    @staticmethod
+    def _slice_key(z, layer_h=None, quanta=1e-3):
+        """
+        Returns the slice_cache key for a Z level.  Slicing rounds Z to the
+        nearest quanta, so Z levels are keyed by that rounding, and the
+        same layer is found however its Z was worked out.
+        """
+        if layer_h is not None:
+            layer_h = int(math.floor(layer_h / quanta + 0.5))
+        return (int(math.floor(z / quanta + 0.5)), layer_h)
+
+    def slice_at_z(self, z, layer_h=None):
+        """
+        Get paths outlines of where this model intersects the given Z level.
+        Returns (outpaths, deadpaths).  The number of paths that couldn't be
+        closed is also recorded by Z in incomplete_layers.  layer_h may be
+        left out if the layers were planned with a schedule.
+        """
+        key = self._slice_key(z, layer_h)
+        if self.keep_slices:
+            result = self.slice_cache.get(key)
+        else:
+            result = self.slice_cache.pop(key, None)
+        self.instruments.count("slice_cache_misses" if result is None else "slice_cache_hits")
+        if result is None:
+            layer = 0
+            if self.layer_index is not None:
+                layer = self.layer_index.layer_at(z, layer_h)
+            with self.instruments.stage("slice", 1):
+                segs, _ = slice_mesh(self.mesh, self.get_layer_facet_ids(layer), z)
+            with self.instruments.stage("stitch", len(segs)):
+                result = assemble_contours(segs)
+            if self.keep_slices:
+                self.slice_cache[key] = result
+        outpaths, deadpaths = result
         if deadpaths:
-            print("\nIncomplete Polygon at z=%s" % z)
+            self.incomplete_layers[z] = len(deadpaths)
+        else:
+            self.incomplete_layers.pop(z, None)
         return (outpaths, deadpaths)
 
+    def slice_layers(self, zs=None, layer_h=None, jobs=1):
+        """
+        Slices the model at every Z level in zs, using jobs worker processes.
+        If zs is not given, the midpoints of the planned layers are used.
+        The results are returned in Z order, and also kept so that the next
+        slice_at_z() call for each of those Z levels returns immediately.
+        """
+        if zs is None:
+            zs = layer_planner.layer_midpoints(self.layer_index.bounds).tolist()
+        zs = list(zs)
+        self.slice_cache = {}
+        with self.instruments.stage("slice_layers", len(zs)):
+            results = parallel.slice_layers(self, zs, layer_h, jobs)
+        for z, result in zip(zs, results):
+            self.slice_cache[self._slice_key(z, layer_h)] = result
+        return results
+
+    def _facet_z_ranges(self):
+        mesh = self.mesh.build()
+        allz = mesh.vertices[:, 2][mesh.triangles]
+        return allz.min(axis=1), allz.max(axis=1)
+
+    def update_file(self, filename):
+        """
+        Reloads the model from an edited STL file, for incremental slicing.
+        The new mesh is put where the old one was moved to, and its facets
+        are diffed against the old ones by facet hash.  Kept slices are only
+        dropped for Z levels within the Z range of an added or removed
+        facet, and the layer index is rebuilt with the same layers.
+        Returns the merged list of (zmin, zmax) ranges that changed, which
+        is also kept in changed_ranges.
+        """
+        old_keys = self.mesh.facet_hashes()
+        old_zmin, old_zmax = self._facet_z_ranges()
+        placement = self.placement
+        slice_cache = self.slice_cache
+        self._reset_mesh()
+        self.read_file(filename)
+        self.placement = np.eye(4)
+        if not np.array_equal(placement, np.eye(4)):
+            self.transform(placement)
+        self.slice_cache = slice_cache
+        self.manifold_report = None
+
+        new_keys = self.mesh.facet_hashes()
+        new_zmin, new_zmax = self._facet_z_ranges()
+        removed = ~np.isin(old_keys, new_keys)
+        added = ~np.isin(new_keys, old_keys)
+        zmin = np.concatenate([old_zmin[removed], new_zmin[added]])
+        zmax = np.concatenate([old_zmax[removed], new_zmax[added]])
+        merged = []
+        for lo, hi in sorted(zip(zmin.tolist(), zmax.tolist())):
+            if merged and lo <= merged[-1][1]:
+                merged[-1] = (merged[-1][0], max(merged[-1][1], hi))
+            else:
+                merged.append((lo, hi))
+        self.changed_ranges = merged
+
+        if merged:
+            los = np.array([r[0] for r in merged])
+            his = np.array([r[1] for r in merged])
+            for key in list(self.slice_cache.keys()):
+                z = key[0] * 1e-3
+                # The last range starting at or below z is the only candidate.
+                i = int(np.searchsorted(los, z + 1e-9, 'right')) - 1
+                if i >= 0 and z <= his[i] + 1e-9:
+                    del self.slice_cache[key]
+        if self.layer_params is not None:
+            self.assign_layers(*self.layer_params)
+        return merged
+
+    def reslice(self, zs=None, layer_h=None, jobs=1):
+        """
+        Slices the model at every Z level in zs like slice_layers(), but
+        only the levels that aren't already kept from a previous slicing
+        are sliced.  Slices are kept from now on, so that after the next
+        update_file() only the changed layers are sliced again.  Returns
+        (results, sliced): the results in Z order, and the Z levels that
+        had to be sliced.
+        """
+        if zs is None:
+            zs = layer_planner.layer_midpoints(self.layer_index.bounds).tolist()
+        zs = list(zs)
+        self.keep_slices = True
+        todo = [z for z in zs if self._slice_key(z, layer_h) not in self.slice_cache]
+        if todo:
+            with self.instruments.stage("slice_layers", len(todo)):
+                results = parallel.slice_layers(self, todo, layer_h, jobs)
+            for z, result in zip(todo, results):
+                self.slice_cache[self._slice_key(z, layer_h)] = result
+        return [self.slice_at_z(z, layer_h) for z in zs], todo
+
 
 # vim: expandtab tabstop=4 shiftwidth=4 softtabstop=4 nowrap
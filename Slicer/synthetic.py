@@ -0,0 +1,267 @@
+import math
+
+import numpy as np
+
+from . import stl_arrays
+
+
+def uv_sphere(facets, radius=10.0):
+    """
+    Returns (normals, verts) for a tessellated sphere of about the given
+    number of facets, resting on Z=0, as Nx3 and Nx3x3 arrays.
+    """
+    rings = max(2, int(round(math.sqrt(facets / 4.0))))
+    segs = 2 * rings
+    th = np.linspace(0.0, math.pi, rings + 1)
+    ph = np.linspace(0.0, 2.0 * math.pi, segs + 1)
+    pts = np.stack([
+        radius * np.sin(th)[:, None] * np.cos(ph)[None, :],
+        radius * np.sin(th)[:, None] * np.sin(ph)[None, :],
+        radius + radius * np.cos(th)[:, None] + 0.0 * ph[None, :],
+    ], axis=2)
+    a = pts[:-1, :-1]
+    b = pts[1:, :-1]
+    c = pts[1:, 1:]
+    d = pts[:-1, 1:]
+    # The first and last rings of quads each have one side on a pole.
+    tris = [
+        np.stack([a[:-1], b[:-1], c[:-1]], axis=2).reshape(-1, 3, 3),
+        np.stack([a[1:], c[1:], d[1:]], axis=2).reshape(-1, 3, 3),
+    ]
+    verts = np.concatenate(tris)
+    return _outward_normals(verts), verts
+
+
+def _outward_normals(verts):
+    n = np.cross(verts[:, 1] - verts[:, 0], verts[:, 2] - verts[:, 0])
+    lens = np.sqrt(np.einsum('ij,ij->i', n, n))
+    lens[lens == 0] = 1.0
+    return n / lens[:, None]
+
+
+# The six tetrahedra of a cube around its 0-7 diagonal.  Corner bits are
+# X=1, Y=2, Z=4.  Neighboring cubes split their shared faces the same way.
+_CUBE_TETS = [
+    (0, 1, 3, 7), (0, 1, 5, 7), (0, 2, 3, 7),
+    (0, 2, 6, 7), (0, 4, 5, 7), (0, 4, 6, 7),
+]
+
+
+def marching_tetrahedra(values, origin=(0.0, 0.0, 0.0), step=1.0):
+    """
+    Triangulates the surface of the solid where a 3D grid of function
+    values is negative.  values[i, j, k] is sampled at origin + step *
+    (i, j, k).  Edge crossings are computed the same way from both sides,
+    so the surface is watertight if the grid border is positive.  Returns
+    (normals, verts) arrays, with the normals pointing out of the solid.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    nx, ny, nz = values.shape
+    flat = values.ravel()
+    ii, jj, kk = np.meshgrid(
+        np.arange(nx - 1), np.arange(ny - 1), np.arange(nz - 1), indexing='ij')
+    base = (ii * ny + jj) * nz + kk
+    base = base.ravel()
+    corner_offsets = [
+        (c & 1) * ny * nz + ((c >> 1) & 1) * nz + ((c >> 2) & 1)
+        for c in range(8)
+    ]
+    origin = np.asarray(origin, dtype=np.float64)
+
+    def coords(idx):
+        i = idx // (ny * nz)
+        j = (idx // nz) % ny
+        k = idx % nz
+        return origin + step * np.stack([i, j, k], axis=-1).astype(np.float64)
+
+    def crossing(p, q):
+        # Always interpolate from the lower grid index, so that both cubes
+        # sharing an edge get exactly the same point.
+        lo = np.minimum(p, q)
+        hi = np.maximum(p, q)
+        fl = flat[lo]
+        fh = flat[hi]
+        t = (fl / (fl - fh))[:, None]
+        return coords(lo) + t * (coords(hi) - coords(lo))
+
+    out = []
+    for tet in _CUBE_TETS:
+        idx = np.stack([base + corner_offsets[c] for c in tet], axis=1)
+        inside = flat[idx] < 0
+        case = inside.dot([1, 2, 4, 8])
+        live = (case != 0) & (case != 15)
+        idx = idx[live]
+        inside = inside[live]
+        ins = inside.sum(axis=1)
+        for count in (1, 2, 3):
+            sel = ins == count
+            if not sel.any():
+                continue
+            sub = idx[sel]
+            sin = inside[sel]
+            # Put the inside corners first, keeping their order stable.
+            order = np.argsort(~sin, axis=1, kind='stable')
+            srt = np.take_along_axis(sub, order, axis=1)
+            inner = srt[:, :count]
+            outer = srt[:, count:]
+            if count == 1:
+                tris = [np.stack([crossing(inner[:, 0], outer[:, k]) for k in range(3)], axis=1)]
+            elif count == 3:
+                tris = [np.stack([crossing(inner[:, k], outer[:, 0]) for k in range(3)], axis=1)]
+            else:
+                p00 = crossing(inner[:, 0], outer[:, 0])
+                p01 = crossing(inner[:, 0], outer[:, 1])
+                p11 = crossing(inner[:, 1], outer[:, 1])
+                p10 = crossing(inner[:, 1], outer[:, 0])
+                tris = [np.stack([p00, p01, p11], axis=1), np.stack([p00, p11, p10], axis=1)]
+            # Point each normal from the inside corners to the outside ones.
+            away = coords(outer).mean(axis=1) - coords(inner).mean(axis=1)
+            for tri in tris:
+                n = np.cross(tri[:, 1] - tri[:, 0], tri[:, 2] - tri[:, 0])
+                flip = np.einsum('ij,ij->i', n, away) < 0
+                tri[flip] = tri[flip][:, [0, 2, 1]]
+                out.append(tri)
+    if not out:
+        empty = np.zeros((0, 3, 3), dtype=np.float64)
+        return np.zeros((0, 3), dtype=np.float64), empty
+    verts = np.concatenate(out)
+    keep = stl_arrays.nondegenerate_mask(verts)
+    verts = verts[keep]
+    return _outward_normals(verts), verts
+
+
+def _grid(size, res):
+    """Sample points of a cube of the given size, with a one-sample border."""
+    step = size / float(res)
+    ax = (np.arange(res + 3) - 1) * step
+    x, y, z = np.meshgrid(ax, ax, ax, indexing='ij')
+    return x, y, z, step
+
+
+def _closed(values):
+    """Makes the grid border positive, so that the surface is closed."""
+    values[0, :, :] = values[-1, :, :] = 1.0
+    values[:, 0, :] = values[:, -1, :] = 1.0
+    values[:, :, 0] = values[:, :, -1] = 1.0
+    return values
+
+
+def gyroid_lattice(res, cells=3, cell_size=10.0, thickness=0.3):
+    """Returns (normals, verts) for a sheet gyroid lattice block of cells^3 cells."""
+    size = cells * cell_size
+    x, y, z, step = _grid(size, res)
+    f = 2.0 * math.pi / cell_size
+    g = np.sin(f * x) * np.cos(f * y) + np.sin(f * y) * np.cos(f * z) + np.sin(f * z) * np.cos(f * x)
+    del x, y, z
+    values = _closed(np.abs(g) - thickness)
+    return marching_tetrahedra(values, (-step, -step, -step), step)
+
+
+def box_surface(lo, hi, divs, inward=False):
+    """
+    Returns an Nx3x3 array of the facets of an axis aligned box, with each
+    side cut into a divs x divs grid of quads.  Sides share their edge
+    points exactly.  Facets wind outwards, or inwards for a cavity.
+    """
+    lo = np.asarray(lo, dtype=np.float64)
+    hi = np.asarray(hi, dtype=np.float64)
+    t = np.linspace(0.0, 1.0, divs + 1)
+    u, v = np.meshgrid(t, t, indexing='ij')
+    sides = []
+    for axis in range(3):
+        a1, a2 = (axis + 1) % 3, (axis + 2) % 3
+        for end in (0, 1):
+            pts = np.empty(u.shape + (3,))
+            pts[..., axis] = hi[axis] if end else lo[axis]
+            pts[..., a1] = lo[a1] + u * (hi[a1] - lo[a1])
+            pts[..., a2] = lo[a2] + v * (hi[a2] - lo[a2])
+            p00, p10 = pts[:-1, :-1], pts[1:, :-1]
+            p11, p01 = pts[1:, 1:], pts[:-1, 1:]
+            quads = [np.stack([p00, p10, p11], axis=2), np.stack([p00, p11, p01], axis=2)]
+            tris = np.concatenate([q.reshape(-1, 3, 3) for q in quads])
+            # (a1, a2, axis) is right handed, so these wind towards +axis.
+            if (end == 0) != inward:
+                tris = tris[:, [0, 2, 1]]
+            sides.append(tris)
+    return np.concatenate(sides)
+
+
+def thin_walled_box(facets, size=40.0, wall=1.2):
+    """
+    Returns (normals, verts) for a closed box shell with the given wall
+    thickness and about the given number of facets.
+    """
+    divs = max(1, int(round(math.sqrt(facets / 24.0))))
+    lo = np.zeros(3)
+    hi = np.full(3, size)
+    verts = np.concatenate([
+        box_surface(lo, hi, divs),
+        box_surface(lo + wall, hi - wall, divs, inward=True),
+    ])
+    return _outward_normals(verts), verts
+
+
+def holey_plate(res, size=60.0, holes=10, thickness=4.0, hole_frac=0.3):
+    """Returns (normals, verts) for a plate with a holes x holes grid of round holes."""
+    step = size / float(res)
+    ax = (np.arange(res + 3) - 1) * step
+    zs = (np.arange(int(math.ceil(thickness / step)) + 5) - 2) * step
+    x, y, z = np.meshgrid(ax, ax, zs, indexing='ij')
+    pitch = size / float(holes)
+    hx = np.mod(x, pitch) - pitch / 2.0
+    hy = np.mod(y, pitch) - pitch / 2.0
+    hole = pitch * hole_frac - np.hypot(hx, hy)
+    slab = np.maximum(
+        np.maximum(np.abs(x - size / 2.0), np.abs(y - size / 2.0)) - (size / 2.0 - step),
+        np.abs(z - thickness / 2.0) - thickness / 2.0,
+    )
+    del x, y, z, hx, hy
+    values = _closed(np.maximum(slab, hole))
+    return marching_tetrahedra(values, (-step, -step, zs[0]), step)
+
+
+# Shapes built from a facet count, and shapes sampled on a grid.
+SHAPES = {
+    "sphere": uv_sphere,
+    "box": thin_walled_box,
+}
+GRID_SHAPES = {
+    "gyroid": gyroid_lattice,
+    "plate": holey_plate,
+}
+KINDS = ("sphere", "gyroid", "box", "plate")
+
+
+def make_mesh(kind, facets):
+    """
+    Returns (normals, verts) for a synthetic mesh of the given kind with
+    roughly the given number of facets.  The output only depends on the
+    arguments.  Grid shapes are sampled at a probe resolution first, and
+    the resolution is scaled from the facet count that gives, since
+    surface facets grow with its square.
+    """
+    if kind in SHAPES:
+        return SHAPES[kind](facets)
+    gen = GRID_SHAPES[kind]
+    res = 32
+    for i in range(2):
+        mesh = gen(res)
+        count = len(mesh[1])
+        new_res = max(8, int(round(res * math.sqrt(facets / float(max(count, 1))))))
+        if abs(new_res - res) <= res // 20:
+            return mesh
+        res = new_res
+    return gen(res)
+
+
+def write_binary_stl(filename, normals, verts, chunk_size=1 << 16):
+    """Writes facet arrays to a binary STL file."""
+    with open(filename, 'wb') as f:
+        f.write(b'Synthetic STL Model'.ljust(80))
+        f.write(np.array([len(verts)], dtype='<u4').tobytes())
+        for pos in range(0, len(verts), chunk_size):
+            f.write(stl_arrays.pack_binary_facets(
+                normals[pos:pos + chunk_size], verts[pos:pos + chunk_size]))
+
+
+# vim: expandtab tabstop=4 shiftwidth=4 softtabstop=4 nowrap
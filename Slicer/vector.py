@@ -10,33 +10,57 @@ except ImportError:
 from .float_fmt import float_fmt
 
 
+_new_object = object.__new__
+
+
 class Vector(object):
-    """Class to represent an N dimentional vector."""
+    """
+    Class to represent an N dimentional vector.  The values are kept in a
+    tuple, in a slot, so vectors are small and quick to make.
+    """
+
+    __slots__ = ("_values",)
 
     def __init__(self, *args):
-        self._values = []
         if len(args) == 1:
             val = args[0]
             if isinstance(val, numbers.Real):
-                self._values = [val]
+                self._values = (val,)
                 return
             elif isinstance(val, numbers.Complex):
-                self._values = [val.real, val.imag]
+                self._values = (val.real, val.imag)
                 return
         else:
             val = args
+        values = []
         try:
             for x in val:
                 if not isinstance(x, numbers.Real):
                     raise TypeError('Expected sequence of real numbers.')
-                self._values.append(x)
+                values.append(x)
         except:
             pass
+        self._values = tuple(values)
+
+    @classmethod
+    def from_tuple(cls, values):
+        """
+        Makes a vector from a tuple of real numbers, without checking them.
+        For internal callers that already have clean values.
+        """
+        vec = _new_object(cls)
+        vec._values = values
+        return vec
+
+    def __getstate__(self):
+        return self._values
+
+    def __setstate__(self, state):
+        self._values = state
 
     def __iter__(self):
         """Iterator generator for vector values."""
-        for idx in self._values:
-            yield idx
+        return iter(self._values)
 
     def __len__(self):
         return len(self._values)
@@ -47,12 +71,15 @@ class Vector(object):
 
     def __hash__(self):
         """Returns hash value for vector coords"""
-        return hash(tuple(self._values))
+        return hash(self._values)
 
     def __eq__(self, other):
         """Equality comparison for points."""
         return self._values == other._values
 
+    def __ne__(self, other):
+        return self._values != other._values
+
     def __cmp__(self, other):
         """Compare points for sort ordering in an arbitrary heirarchy."""
         longzip = ziplong(self._values, other, fillvalue=0.0)
@@ -64,24 +91,27 @@ class Vector(object):
         return 0
 
     def __sub__(self, v):
-        return Vector(i - j for i, j in zip(self._values, v))
+        return Vector.from_tuple(tuple(i - j for i, j in zip(self._values, v)))
 
     def __rsub__(self, v):
-        return Vector(i - j for i, j in zip(v, self._values))
+        return Vector.from_tuple(tuple(i - j for i, j in zip(v, self._values)))
 
     def __add__(self, v):
-        return Vector(i + j for i, j in zip(self._values, v))
+        return Vector.from_tuple(tuple(i + j for i, j in zip(self._values, v)))
 
     def __radd__(self, v):
-        return Vector(i + j for i, j in zip(v, self._values))
+        return Vector.from_tuple(tuple(i + j for i, j in zip(v, self._values)))
 
     def __div__(self, s):
         """Divide each element in a vector by a scalar."""
-        return Vector(x / (s+0.0) for x in self._values)
+        s = float(s)
+        return Vector.from_tuple(tuple(x / s for x in self._values))
+
+    __truediv__ = __div__
 
     def __mul__(self, s):
         """Multiplies each element in a vector by a scalar."""
-        return Vector(x * s for x in self._values)
+        return Vector.from_tuple(tuple(x * s for x in self._values))
 
     def __format__(self, fmt):
         vals = [float_fmt(x) for x in self._values]
@@ -90,7 +120,7 @@ class Vector(object):
         if "s" in fmt:
             return " ".join(vals)
         if "b" in fmt:
-            return struct.pack('<{0:d)f'.format(len(self._values)), *self._values)
+            return struct.pack('<{0:d}f'.format(len(self._values)), *self._values)
         return "({0})".format(", ".join(vals))
 
     def __repr__(self):
@@ -102,18 +132,19 @@ class Vector(object):
 
     def dot(self, v):
         """Dot (scalar) product of two vectors."""
-        return sum(p*q for p, q in zip(self, v))
+        return sum(p*q for p, q in zip(self._values, v))
 
     def cross(self, v):
         """
         Cross (vector) product against another 3D Vector.
         Returned 3D Vector will be perpendicular to both original 3D Vectors.
         """
-        return Vector(
-            self._values[1]*v[2] - self._values[2]*v[1],
-            self._values[2]*v[0] - self._values[0]*v[2],
-            self._values[0]*v[1] - self._values[1]*v[0]
-        )
+        a = self._values
+        return Vector.from_tuple((
+            a[1]*v[2] - a[2]*v[1],
+            a[2]*v[0] - a[0]*v[2],
+            a[0]*v[1] - a[1]*v[0]
+        ))
 
     def length(self):
         """Returns the length of the vector."""
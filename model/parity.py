@@ -0,0 +1,166 @@
+"""
+Compare the inference backends of model.py on the prompt sets in
+train/prompts.  Each backend is loaded in its own worker process, the way
+the server loads it, and generates every prompt one at a time.  For each
+backend, the report gives the share of prompts whose parsed output matches
+the reference (first) backend's and the training label, the median and 95th
+percentile latency, and the worker's peak resident memory.
+
+Run it from the model directory, as for the server:
+
+    python parity.py --backends pytorch int8 onnx onnx-int8 --save parity.json
+"""
+import os
+import sys
+import json
+import glob
+import time
+import argparse
+import resource
+import tempfile
+import subprocess
+
+PROMPTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "train", "prompts")
+WARMUP_PROMPTS = 3
+
+def load_prompts(filename, limit=None):
+    """Read the (input, output) rows of a prompt set."""
+    rows = []
+    with open(filename, "r") as file:
+        for line in file:
+            if line.strip():
+                rows.append(json.loads(line))
+    return rows[:limit] if limit else rows
+
+def peak_rss_mb():
+    """Peak resident memory of this process, in MB."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS, and in kilobytes elsewhere
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+def run_worker(backend, filenames, limit=None):
+    """Load the model with a backend, and generate the prompt sets.  Runs in the worker process."""
+    os.environ["MODEL_BACKEND"] = backend
+    import model
+
+    if not model.generator:
+        raise RuntimeError(f"Model failed to load with the {backend} backend")
+    load_rss = peak_rss_mb()
+
+    prompt_sets = {os.path.basename(name): load_prompts(name, limit) for name in filenames}
+    warmup = [row["input"] for rows in prompt_sets.values() for row in rows][:WARMUP_PROMPTS]
+    for command in warmup:
+        model.service.generate_batch([command])
+
+    results = {}
+    for name, rows in prompt_sets.items():
+        results[name] = []
+        for row in rows:
+            start = time.perf_counter()
+            generated_text = model.service.generate_batch([row["input"]])[0]
+            seconds = time.perf_counter() - start
+            results[name].append({
+                "input": row["input"],
+                "parsed": model.parse_generated_text(generated_text),
+                "label": model.parse_generated_text(row["output"]),
+                "seconds": seconds
+            })
+    return {"backend": backend, "load_rss_mb": load_rss, "peak_rss_mb": peak_rss_mb(), "prompt_sets": results}
+
+def run_backend(backend, filenames, limit=None):
+    """Run a backend in a worker process, and return its results, or None if it failed."""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        out_file = os.path.join(tmp_dir, "results.json")
+        args = [sys.executable, os.path.abspath(__file__), "--worker", backend, "--out", out_file]
+        if limit:
+            args += ["--limit", str(limit)]
+        completed = subprocess.run(args + list(filenames))
+        if completed.returncode != 0 or not os.path.exists(out_file):
+            print(f"{backend}: worker failed with exit code {completed.returncode}", file=sys.stderr)
+            return None
+        with open(out_file, "r") as file:
+            return json.load(file)
+
+def percentile(values, fraction):
+    """The value at a fraction of the way through the sorted values."""
+    values = sorted(values)
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+def summarize(results, reference):
+    """Parity, latency and memory of one backend's results against the reference backend's."""
+    summary = {"prompt_sets": {}}
+    all_seconds = []
+    for name, rows in results["prompt_sets"].items():
+        ref_rows = reference["prompt_sets"][name]
+        seconds = [row["seconds"] for row in rows]
+        all_seconds += seconds
+        summary["prompt_sets"][name] = {
+            "prompts": len(rows),
+            "match_reference": sum(row["parsed"] == ref["parsed"] for row, ref in zip(rows, ref_rows)) / max(1, len(rows)),
+            "match_label": sum(row["parsed"] == row["label"] for row in rows) / max(1, len(rows)),
+            "p50_ms": percentile(seconds, 0.5) * 1000,
+            "p95_ms": percentile(seconds, 0.95) * 1000
+        }
+    ref_seconds = [row["seconds"] for rows in reference["prompt_sets"].values() for row in rows]
+    summary["p50_ms"] = percentile(all_seconds, 0.5) * 1000
+    summary["p95_ms"] = percentile(all_seconds, 0.95) * 1000
+    summary["speedup"] = percentile(ref_seconds, 0.5) / max(percentile(all_seconds, 0.5), 1e-9)
+    summary["load_rss_mb"] = results["load_rss_mb"]
+    summary["peak_rss_mb"] = results["peak_rss_mb"]
+    summary["memory_ratio"] = results["peak_rss_mb"] / max(reference["peak_rss_mb"], 1e-9)
+    return summary
+
+def print_report(summaries):
+    """Print a table per prompt set, and the overall latency and memory of each backend."""
+    for name in next(iter(summaries.values()))["prompt_sets"]:
+        print(f"\n{name}")
+        print(f"  {'backend':<10} {'prompts':>7} {'=ref':>7} {'=label':>7} {'p50 ms':>8} {'p95 ms':>8}")
+        for backend, summary in summaries.items():
+            row = summary["prompt_sets"][name]
+            print(f"  {backend:<10} {row['prompts']:>7} {row['match_reference']:>7.1%} "
+                  f"{row['match_label']:>7.1%} {row['p50_ms']:>8.1f} {row['p95_ms']:>8.1f}")
+    print(f"\n  {'backend':<10} {'p50 ms':>8} {'speedup':>8} {'load MB':>8} {'peak MB':>8} {'memory':>7}")
+    for backend, summary in summaries.items():
+        print(f"  {backend:<10} {summary['p50_ms']:>8.1f} {summary['speedup']:>7.2f}x "
+              f"{summary['load_rss_mb']:>8.0f} {summary['peak_rss_mb']:>8.0f} {summary['memory_ratio']:>6.0%}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare model inference backends on the prompt sets.")
+    parser.add_argument("prompt_files", nargs="*", help="Prompt sets to run (default: all in train/prompts)")
+    parser.add_argument("--backends", nargs="+", default=["pytorch", "int8", "onnx", "onnx-int8"],
+                        help="Backends to compare; the first is the reference")
+    parser.add_argument("--limit", type=int, help="Only run the first LIMIT prompts of each set")
+    parser.add_argument("--save", help="Write the summaries to this JSON file")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    parser.add_argument("--out", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    filenames = args.prompt_files or sorted(glob.glob(os.path.join(PROMPTS_DIR, "*.jsonl")))
+    if args.worker:
+        results = run_worker(args.worker, filenames, args.limit)
+        with open(args.out, "w") as file:
+            json.dump(results, file)
+        return 0
+
+    results = {}
+    for backend in args.backends:
+        print(f"Running the {backend} backend...", file=sys.stderr)
+        backend_results = run_backend(backend, filenames, args.limit)
+        if backend_results is not None:
+            results[backend] = backend_results
+    if args.backends[0] not in results:
+        print(f"The reference backend {args.backends[0]} failed", file=sys.stderr)
+        return 1
+
+    reference = results[args.backends[0]]
+    summaries = {backend: summarize(backend_results, reference) for backend, backend_results in results.items()}
+    print_report(summaries)
+    if args.save:
+        with open(args.save, "w") as file:
+            json.dump(summaries, file, indent=4)
+    return 0 if len(results) == len(args.backends) else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,888 @@
+"""
+Serving machinery shared by the model servers (model/model.py, src/model.py
+and backend/model_comm/model_flask_seperate.py): model loading with the
+selectable inference backends, output parsing, the grammar fast path, the
+prompt cache, request batching, and the Flask and ASGI front ends.  A
+server loads its model, makes a CommandService for it, and registers the
+routes on its Flask app.
+"""
+import os
+import re
+import copy
+import json
+import time
+import uuid
+import queue
+import atexit
+import shutil
+import asyncio
+import hashlib
+import logging
+import tempfile
+import threading
+from datetime import datetime
+from urllib.parse import unquote
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import wraps, partial
+
+from flask import request, jsonify
+
+logger = logging.getLogger(__name__)
+
+# Request batching configuration
+BATCH_CONFIG = {
+    "max_batch_size": int(os.environ.get("BATCH_MAX_SIZE", 8)),
+    "max_wait_ms": float(os.environ.get("BATCH_MAX_WAIT_MS", 10)),
+    "max_queue_size": int(os.environ.get("BATCH_MAX_QUEUE", 256)),
+    "workers": int(os.environ.get("BATCH_WORKERS", 1)),
+}
+
+# Prompt cache configuration
+CACHE_CONFIG = {
+    "max_entries": int(os.environ.get("PROMPT_CACHE_SIZE", 4096)),
+    "ttl_seconds": float(os.environ.get("PROMPT_CACHE_TTL", 0)),  # 0 keeps entries until evicted
+    "path": os.environ.get("PROMPT_CACHE_FILE") or None,
+    "save_interval": float(os.environ.get("PROMPT_CACHE_SAVE_SECONDS", 30)),
+}
+
+# Grammar fast path configuration
+GRAMMAR_CONFIG = {
+    "enabled": os.environ.get("GRAMMAR_FAST_PATH", "1") != "0",
+    # Above the arc rule's score, so arcs are left to the model by default
+    "min_confidence": float(os.environ.get("GRAMMAR_MIN_CONFIDENCE", 0.9)),
+}
+
+MODEL_BACKENDS = ("pytorch", "int8", "onnx", "onnx-int8")
+
+def quantize_model(model):
+    """Quantize the weights of the model's linear layers to int8, in place."""
+    import torch
+    return torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+
+def load_onnx_model(model_config, quantize=False):
+    """Load the model with ONNX Runtime, exporting (and quantizing) it on first use."""
+    from optimum.onnxruntime import ORTModelForSeq2SeqLM, ORTQuantizer
+    from optimum.onnxruntime.configuration import AutoQuantizationConfig
+
+    export_dir = model_config["onnx_dir"] or f"{model_config['model_name'].rstrip('/')}_onnx"
+    if not os.path.isdir(export_dir):
+        logger.info(f"Exporting model to ONNX in {export_dir}")
+        model = ORTModelForSeq2SeqLM.from_pretrained(
+            model_config["model_name"],
+            token=model_config["token"],
+            export=True,
+            use_cache=True
+        )
+        model.save_pretrained(export_dir)
+    if not quantize:
+        return ORTModelForSeq2SeqLM.from_pretrained(export_dir, use_cache=True)
+
+    model_files = ("encoder_model", "decoder_model", "decoder_with_past_model")
+    quantized_dir = os.path.join(export_dir, "int8")
+    if not os.path.isdir(quantized_dir):
+        logger.info(f"Quantizing ONNX model to int8 in {quantized_dir}")
+        config = AutoQuantizationConfig.avx2(is_static=False, per_channel=False)
+        for name in model_files:
+            quantizer = ORTQuantizer.from_pretrained(export_dir, file_name=f"{name}.onnx")
+            quantizer.quantize(save_dir=quantized_dir, quantization_config=config)
+        for name in ("config.json", "generation_config.json"):
+            if os.path.exists(os.path.join(export_dir, name)):
+                shutil.copy(os.path.join(export_dir, name), quantized_dir)
+    encoder, decoder, decoder_with_past = (f"{name}_quantized.onnx" for name in model_files)
+    return ORTModelForSeq2SeqLM.from_pretrained(
+        quantized_dir,
+        use_cache=True,
+        encoder_file_name=encoder,
+        decoder_file_name=decoder,
+        decoder_with_past_file_name=decoder_with_past
+    )
+
+def initialize_model(model_config):
+    """Initialize the model and tokenizer, with the configured backend."""
+    from transformers import AutoTokenizer, AutoModelForSeq2SeqLM, pipeline
+
+    try:
+        backend = model_config["backend"]
+        if backend not in MODEL_BACKENDS:
+            raise ValueError(f"Unknown model backend {backend!r}, expected one of {', '.join(MODEL_BACKENDS)}")
+        tokenizer = AutoTokenizer.from_pretrained(
+            model_config["model_name"], 
+            token=model_config["token"]
+        )
+        if backend.startswith("onnx"):
+            model = load_onnx_model(model_config, quantize=backend == "onnx-int8")
+        else:
+            model = AutoModelForSeq2SeqLM.from_pretrained(
+                model_config["model_name"], 
+                token=model_config["token"]
+            )
+            if backend == "int8":
+                model = quantize_model(model)
+        generator = pipeline("text2text-generation", model=model, tokenizer=tokenizer)
+        logger.info(f"Loaded {model_config['model_name']} with the {backend} backend")
+        return generator
+    except Exception as e:
+        logger.error(f"Failed to initialize model: {str(e)}")
+        raise
+
+def parse_generated_text(input_string):
+    """Parse the generated text into structured data."""
+    try:
+        structured_data = {
+            "shape": None,
+            "parameters": {},
+            "plane": None,
+            "coordinates": []
+        }
+
+        # Parse shape
+        shape_match = re.search(r'"shape":\s*"([^"]+)"', input_string)
+        if shape_match:
+            structured_data['shape'] = shape_match.group(1).strip()
+
+        # Parse parameters
+        param_matches = re.findall(r'"(\w+)":\s*([\d\.]+)', input_string)
+        for param_key, param_value in param_matches:
+            if param_key not in ("shape", "plane", "coordinates"):
+                try:
+                    param_value = int(param_value)
+                except ValueError:
+                    param_value = float(param_value)
+                structured_data["parameters"][param_key] = param_value
+
+        # Parse plane
+        plane_match = re.search(r'"plane":\s*"([^"]+)"', input_string)
+        if plane_match:
+            structured_data['plane'] = plane_match.group(1).strip()
+
+        # Parse coordinates
+        coordinates_match = re.search(r'"coordinates":\s*(\[[^\]]+\])', input_string)
+        if coordinates_match:
+            try:
+                coordinates = json.loads(coordinates_match.group(1).strip())
+                structured_data["coordinates"] = coordinates
+            except json.JSONDecodeError:
+                logger.warning("Failed to parse coordinates JSON")
+
+        return structured_data
+    except Exception as e:
+        logger.error(f"Parsing error: {str(e)}")
+        return None
+
+class QueueFullError(Exception):
+    """Raised when the batching queue can't take another request."""
+    pass
+
+class MicroBatcher:
+    """
+    Collects generate requests from concurrent HTTP handlers and runs them
+    through the model together.  A worker thread waits for a request, then
+    keeps collecting for up to max_wait_ms or until max_batch_size requests
+    are waiting, and runs one batched generate for all of them.  With more
+    than one worker, that many batches can run at once.
+    """
+
+    def __init__(self, generate_batch, max_batch_size=8, max_wait_ms=10, max_queue_size=256, workers=1):
+        self.generate_batch = generate_batch
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._lock = threading.Lock()
+        self._stats = {
+            "requests_total": 0,
+            "rejected_total": 0,
+            "errors_total": 0,
+            "batches_total": 0,
+            "batch_size_max": 0,
+            "queue_wait_seconds_total": 0.0,
+            "generate_seconds_total": 0.0,
+        }
+        self._workers = []
+        for i in range(max(1, workers)):
+            worker = threading.Thread(target=self._run, name=f"micro-batcher-{i}", daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+    def submit(self, command):
+        """Queue a command, and return a Future for its generated text."""
+        future = Future()
+        try:
+            self._queue.put_nowait((command, future, time.perf_counter()))
+        except queue.Full:
+            with self._lock:
+                self._stats["rejected_total"] += 1
+            raise QueueFullError("Too many requests waiting for the model")
+        return future
+
+    def generate(self, command, timeout=None):
+        """Queue a command and wait for its generated text."""
+        return self.submit(command).result(timeout)
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            start = time.perf_counter()
+            commands = [command for command, _, _ in batch]
+            try:
+                texts = self.generate_batch(commands)
+                error = None
+            except Exception as e:
+                logger.error(f"Batch generation error: {str(e)}")
+                error = e
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                stats = self._stats
+                stats["requests_total"] += len(batch)
+                stats["batches_total"] += 1
+                stats["batch_size_max"] = max(stats["batch_size_max"], len(batch))
+                stats["queue_wait_seconds_total"] += sum(start - queued for _, _, queued in batch)
+                stats["generate_seconds_total"] += elapsed
+                if error is not None:
+                    stats["errors_total"] += len(batch)
+            for i, (_, future, _) in enumerate(batch):
+                if error is not None:
+                    future.set_exception(error)
+                else:
+                    future.set_result(texts[i])
+
+    def metrics(self):
+        """Return the batching counters, averages and configuration."""
+        with self._lock:
+            stats = dict(self._stats)
+        requests = stats["requests_total"]
+        batches = stats["batches_total"]
+        stats.update({
+            "queue_depth": self._queue.qsize(),
+            "batch_size_avg": requests / batches if batches else 0.0,
+            "queue_wait_ms_avg": 1000.0 * stats["queue_wait_seconds_total"] / requests if requests else 0.0,
+            "generate_ms_avg": 1000.0 * stats["generate_seconds_total"] / batches if batches else 0.0,
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000.0,
+            "max_queue_size": self._queue.maxsize,
+            "workers": len(self._workers),
+        })
+        return stats
+
+def normalize_prompt(command):
+    """Normalize a prompt for cache lookups: collapse whitespace and spacing around punctuation."""
+    command = " ".join(command.split())
+    return re.sub(r"\s*([(),\[\]])\s*", r"\1", command)
+
+def model_fingerprint(model_config):
+    """Identify the model checkpoint: its name and backend, and the size and time of a local checkpoint's files."""
+    digest = hashlib.sha1(f"{model_config['model_name']}:{model_config['backend']}".encode("utf-8"))
+    model_dir = model_config["model_name"]
+    if os.path.isdir(model_dir):
+        for root, dirs, files in os.walk(model_dir):
+            dirs.sort()
+            for name in sorted(files):
+                stat = os.stat(os.path.join(root, name))
+                rel = os.path.relpath(os.path.join(root, name), model_dir)
+                digest.update(f"{rel}:{stat.st_size}:{stat.st_mtime_ns}".encode("utf-8"))
+    return digest.hexdigest()
+
+class PromptCache:
+    """
+    Thread-safe LRU cache of parsed model outputs, keyed by normalized
+    prompt.  Greedy decoding is deterministic, so a repeated prompt gets the
+    same output without running the model.  Entries can expire after
+    ttl_seconds.  If a path is given, the cache is loaded from it at start
+    and saved to it at most every save_interval seconds and at exit.  The
+    file records the model fingerprint, and is ignored after the model
+    checkpoint changes.
+    """
+
+    def __init__(self, fingerprint, max_entries=4096, ttl_seconds=0, path=None, save_interval=30):
+        self.fingerprint = fingerprint
+        self.max_entries = max(1, max_entries)
+        self.ttl = ttl_seconds
+        self.path = path
+        self.save_interval = save_interval
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()  # one save at a time
+        self._version = 0  # bumped on every change
+        self._saved_version = 0
+        self._last_save = time.time()
+        self._stats = {"hits_total": 0, "misses_total": 0, "evictions_total": 0, "expired_total": 0}
+        if path:
+            self.load()
+            atexit.register(self.save)
+
+    def _expired(self, stored_at, now):
+        return self.ttl > 0 and now - stored_at > self.ttl
+
+    def get(self, command):
+        """Return a copy of the cached output for a prompt, or None."""
+        key = normalize_prompt(command)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self._expired(entry[1], now):
+                del self._entries[key]
+                self._stats["expired_total"] += 1
+                entry = None
+            if entry is None:
+                self._stats["misses_total"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats["hits_total"] += 1
+            return copy.deepcopy(entry[0])
+
+    def put(self, command, output):
+        """Cache the parsed output for a prompt."""
+        key = normalize_prompt(command)
+        with self._lock:
+            self._entries[key] = (copy.deepcopy(output), time.time())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats["evictions_total"] += 1
+            self._version += 1
+            due = self.path and time.time() - self._last_save >= self.save_interval
+        if due:
+            self.save()
+
+    def clear(self):
+        """Drop all entries."""
+        with self._lock:
+            self._entries.clear()
+            self._version += 1
+
+    def load(self):
+        """Load entries saved for the same model checkpoint."""
+        try:
+            with open(self.path, "r") as file:
+                data = json.load(file)
+        except (OSError, ValueError):
+            return
+        if data.get("model") != self.fingerprint:
+            logger.info("Model changed, ignoring saved prompt cache")
+            return
+        now = time.time()
+        with self._lock:
+            for key, output, stored_at in data.get("entries", [])[-self.max_entries:]:
+                if not self._expired(stored_at, now):
+                    self._entries[key] = (output, stored_at)
+
+    def save(self):
+        """Write the entries to the cache file, if they changed.  A failed save is tried again later."""
+        if not self.path:
+            return
+        with self._save_lock:
+            with self._lock:
+                if self._version == self._saved_version:
+                    return
+                version = self._version
+                data = {
+                    "model": self.fingerprint,
+                    "entries": [[key, output, stored_at] for key, (output, stored_at) in self._entries.items()],
+                }
+                self._last_save = time.time()
+            tmp_path = None
+            try:
+                fd, tmp_path = tempfile.mkstemp(prefix=".prompt_cache_", dir=os.path.dirname(os.path.abspath(self.path)))
+                with os.fdopen(fd, "w") as file:
+                    json.dump(data, file)
+                os.replace(tmp_path, self.path)
+            except OSError as e:
+                logger.warning(f"Failed to save prompt cache: {str(e)}")
+                if tmp_path and os.path.exists(tmp_path):
+                    os.unlink(tmp_path)
+                return
+            with self._lock:
+                self._saved_version = max(self._saved_version, version)
+
+    def metrics(self):
+        """Return the cache counters and size."""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._entries)
+        lookups = stats["hits_total"] + stats["misses_total"]
+        stats["hit_ratio"] = stats["hits_total"] / lookups if lookups else 0.0
+        stats["max_entries"] = self.max_entries
+        stats["ttl_seconds"] = self.ttl
+        return stats
+
+class GrammarParser:
+    """
+    Deterministic parser for the fully specified prompts of the simple and
+    expanded prompt sets, such as "circle radius 5 on XYConstructionPlane
+    at (0,0,2)".  It renders the output the model was trained to give, and
+    reads it back with parse_generated_text(), so its results have the same
+    structure as the model's.  Each rule has a confidence score, and only
+    matches scoring at least min_confidence are used.  Arcs score below the
+    default, as the coordinates of the arcs in the training set are not all
+    worked out the same way.  Free-form and object prompts don't match, and
+    are left to the model.
+    """
+
+    NUM = r"(-?\d+(?:\.\d+)?)"
+    POINT = r"\((-?[\d.]+,-?[\d.]+,-?[\d.]+)\)"
+    PLANE = r"(?P<plane>XY|YZ|ZX)ConstructionPlane"
+    # Axis of the base point that a cone's coordinates are raised along
+    CONE_AXIS = {"XY": 2, "YZ": 2, "ZX": 1}
+
+    def __init__(self, enabled=True, min_confidence=0.9):
+        self.enabled = enabled
+        self.min_confidence = min_confidence
+        num, point, plane = self.NUM, self.POINT, self.PLANE
+        self.rules = [
+            (rf"circle radius {num} on {plane} at{point}", self.circle, 1.0),
+            (rf"rectangle {num} {num} on {plane} at{point}", self.rectangle, 1.0),
+            (rf"ellipse major {num} minor {num} on {plane} at{point}", self.ellipse, 1.0),
+            (rf"triangle {num} {num} {num} on {plane} at{point}", self.triangle, 1.0),
+            (rf"polygon radius {num} sides (\d+) on {plane} at{point}", self.polygon, 1.0),
+            (rf"line points{point}{point} ?on {plane}", self.line, 1.0),
+            (rf"cone base_point{point} ?radius {num} height {num} on {plane}", self.cone, 1.0),
+            (rf"arc points{point}{point}{point} ?on {plane}", self.arc, 0.85),
+        ]
+        self.rules = [(re.compile(rf"^{pattern}\.?$", re.IGNORECASE), build, confidence)
+                      for pattern, build, confidence in self.rules]
+        self._lock = threading.Lock()
+        self._stats = {"hits_total": 0, "misses_total": 0, "low_confidence_total": 0}
+        self._shapes = {}
+
+    @staticmethod
+    def number(value):
+        """Convert prompt text or a derived value to a number, printed as an int when whole."""
+        if isinstance(value, str):
+            value = float(value) if "." in value else int(value)
+        return int(value) if float(value).is_integer() else value
+
+    def point(self, text):
+        return [self.number(value) for value in text.split(",")]
+
+    def circle(self, radius, plane, at):
+        return "circle", {"radius": self.number(radius)}, plane, self.point(at)
+
+    def rectangle(self, width, height, plane, at):
+        return "rectangle", {"width": self.number(width), "height": self.number(height)}, plane, self.point(at)
+
+    def ellipse(self, major, minor, plane, at):
+        parameters = {"major_radius": self.number(major), "minor_radius": self.number(minor)}
+        return "ellipse", parameters, plane, self.point(at)
+
+    def triangle(self, side1, side2, side3, plane, at):
+        parameters = {"side1": self.number(side1), "side2": self.number(side2), "side3": self.number(side3)}
+        return "triangle", parameters, plane, self.point(at)
+
+    def polygon(self, radius, sides, plane, at):
+        return "polygon", {"radius": self.number(radius), "sides": int(sides)}, plane, self.point(at)
+
+    def line(self, point1, point2, plane):
+        p1, p2 = self.point(point1), self.point(point2)
+        middle = [self.number((a + b) / 2) for a, b in zip(p1, p2)]
+        return "line", {"point1": p1, "point2": p2}, plane, middle
+
+    def cone(self, base, radius, height, plane):
+        base_point, height = self.point(base), self.number(height)
+        coordinates = list(base_point)
+        axis = self.CONE_AXIS[plane]
+        coordinates[axis] = self.number(coordinates[axis] + height / 2)
+        parameters = {"base_point": base_point, "radius": self.number(radius), "height": height}
+        return "cone", parameters, plane, coordinates
+
+    def arc(self, point1, point2, point3, plane):
+        # Weighted toward the middle point, and rounded down, as in most training examples
+        p1, p2, p3 = self.point(point1), self.point(point2), self.point(point3)
+        coordinates = [self.number((a + 2 * b + c) // 4) for a, b, c in zip(p1, p2, p3)]
+        return "arc", {"point1": p1, "point2": p2, "point3": p3}, plane, coordinates
+
+    def parse(self, command):
+        """Return (parsed_output, confidence) for a command, or (None, 0.0) if no rule matches."""
+        text = normalize_prompt(command)
+        for pattern, build, confidence in self.rules:
+            match = pattern.match(text)
+            if match:
+                groups = list(match.groups())
+                groups[pattern.groupindex["plane"] - 1] = match.group("plane").upper()
+                shape, parameters, plane, coordinates = build(*groups)
+                output = json.dumps({
+                    "shape": shape,
+                    "parameters": parameters,
+                    "plane": f"{plane}ConstructionPlane",
+                    "coordinates": coordinates
+                })
+                return parse_generated_text(output), confidence
+        return None, 0.0
+
+    def resolve(self, command):
+        """Return the parsed output for a command if the grammar is confident enough, else None."""
+        if not self.enabled:
+            return None
+        parsed_output, confidence = self.parse(command)
+        with self._lock:
+            if parsed_output is None:
+                self._stats["misses_total"] += 1
+            elif confidence < self.min_confidence:
+                self._stats["low_confidence_total"] += 1
+            else:
+                self._stats["hits_total"] += 1
+                shape = parsed_output["shape"]
+                self._shapes[shape] = self._shapes.get(shape, 0) + 1
+        if parsed_output is None or confidence < self.min_confidence:
+            return None
+        logger.info(f"Parsed by grammar with confidence {confidence:.2f}: {parsed_output}")
+        return parsed_output
+
+    def metrics(self):
+        """Return the grammar counters."""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["hits_by_shape"] = dict(self._shapes)
+        stats["enabled"] = self.enabled
+        stats["min_confidence"] = self.min_confidence
+        return stats
+
+async def send_json(send, status, payload, headers=()):
+    """Send a JSON response over ASGI."""
+    body = json.dumps(payload).encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode("ascii")),
+            (b"access-control-allow-origin", b"*"),
+        ] + [(k.lower().encode("latin-1"), v.encode("latin-1")) for k, v in headers],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+async def read_body(receive):
+    """Read the whole request body from ASGI receive events."""
+    chunks = []
+    while True:
+        message = await receive()
+        chunks.append(message.get("body", b""))
+        if not message.get("more_body", False):
+            return b"".join(chunks)
+
+class CommandService:
+    """
+    Turns commands into parsed shape outputs for one loaded model, and keeps
+    the results in commands_dir.  Commands go through the grammar fast path,
+    then the prompt cache, and then the model, batched with any concurrent
+    requests.  The async methods run generation on the batcher's worker
+    threads and file access on a small thread pool, so an event loop only
+    routes requests, and the other endpoints answer while the model runs.
+    """
+
+    def __init__(self, generator, model_config, commands_dir, batch_config=None, cache_config=None, grammar_config=None):
+        self.generator = generator
+        self.model_config = model_config
+        self.commands_dir = commands_dir
+        self.batcher = MicroBatcher(self.generate_batch, **(batch_config or BATCH_CONFIG)) if generator else None
+        self.prompt_cache = PromptCache(model_fingerprint(model_config), **(cache_config or CACHE_CONFIG))
+        self.grammar_parser = GrammarParser(**(grammar_config or GRAMMAR_CONFIG))
+        self.io_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="command-io")
+
+    def generate_batch(self, commands):
+        """Run the model on a list of commands at once, returning their generated texts."""
+        responses = self.generator(commands, max_length=100, batch_size=len(commands))
+        # The pipeline returns one dict per input, or a list of one dict each.
+        return [
+            (response[0] if isinstance(response, list) else response)["generated_text"]
+            for response in responses
+        ]
+
+    def process_and_save_command(self, command):
+        """Process a command and save the result."""
+        parsed_output = self.grammar_parser.resolve(command)
+        if parsed_output is not None:
+            return self.save_parsed_output(parsed_output)
+        if not self.generator:
+            raise RuntimeError("Model not initialized properly")
+
+        try:
+            parsed_output = self.prompt_cache.get(command)
+            if parsed_output is None:
+                # Generate text from command, batched with any concurrent requests
+                generated_text = self.batcher.generate(command)
+                parsed_output = self.parse_and_cache(command, generated_text)
+            return self.save_parsed_output(parsed_output)
+
+        except Exception as e:
+            logger.error(f"Command processing error: {str(e)}")
+            raise
+
+    async def process_and_save_command_async(self, command):
+        """Process a command and save the result, without blocking the event loop."""
+        loop = asyncio.get_running_loop()
+        parsed_output = self.grammar_parser.resolve(command)
+        if parsed_output is not None:
+            return await loop.run_in_executor(self.io_pool, self.save_parsed_output, parsed_output)
+        if not self.generator:
+            raise RuntimeError("Model not initialized properly")
+
+        try:
+            parsed_output = self.prompt_cache.get(command)
+            if parsed_output is None:
+                generated_text = await asyncio.wrap_future(self.batcher.submit(command))
+                # Caching can save the cache file, so it runs on the I/O pool
+                parsed_output = await loop.run_in_executor(self.io_pool, self.parse_and_cache, command, generated_text)
+            return await loop.run_in_executor(self.io_pool, self.save_parsed_output, parsed_output)
+
+        except QueueFullError:
+            raise
+        except Exception as e:
+            logger.error(f"Command processing error: {str(e)}")
+            raise
+
+    def parse_and_cache(self, command, generated_text):
+        """Parse generated text, and cache the result for the command."""
+        logger.info(f"Generated text: {generated_text}")
+
+        # Parse the generated text
+        parsed_output = parse_generated_text(generated_text)
+        if not parsed_output:
+            raise ValueError("Failed to parse generated text")
+        self.prompt_cache.put(command, parsed_output)
+        return parsed_output
+
+    def save_parsed_output(self, parsed_output):
+        """Save a parsed output to the commands directory."""
+        # Save to file.  Batched and cached requests finish within the same
+        # second, so the name is made unique with microseconds and a random suffix.
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+        output_file = os.path.join(self.commands_dir, f"command_{timestamp}_{uuid.uuid4().hex[:8]}.json")
+
+        with open(output_file, "w") as file:
+            json.dump(parsed_output, file, indent=4)
+
+        return parsed_output
+
+    def read_command_file(self, filename):
+        """Load a stored command result, or return None if there is no such file."""
+        file_path = os.path.join(self.commands_dir, filename)
+        if not os.path.exists(file_path):
+            return None
+        with open(file_path, "r") as file:
+            return json.load(file)
+
+    def list_command_files(self):
+        """List the stored command result files."""
+        return [file for file in os.listdir(self.commands_dir) if file.endswith(".json")]
+
+    def metrics(self):
+        """Request batching, prompt cache and grammar fast path metrics."""
+        return {
+            "batching": self.batcher.metrics() if self.batcher else None,
+            "prompt_cache": self.prompt_cache.metrics(),
+            "grammar": self.grammar_parser.metrics()
+        }
+
+    def routes(self):
+        """
+        The endpoints, as (method, Flask rule, handler, async handler).  Each
+        handler returns (status, payload, headers), so the Flask app and the
+        ASGI app only differ in how they receive requests and send responses.
+        POST handlers also take the raw request body.
+        """
+        return [
+            ("GET", "/health", self.health, None),
+            ("GET", "/metrics", self.metrics_response, None),
+            ("GET", "/commands", self.list_commands, None),
+            ("GET", "/command/<filename>", self.get_command, None),
+            ("POST", "/process", self.process, self.process_async),
+        ]
+
+    def health(self):
+        """Health check endpoint."""
+        return 200, {
+            "status": "ok",
+            "timestamp": datetime.now().isoformat(),
+            "model_loaded": self.generator is not None,
+            "backend": self.model_config["backend"]
+        }, ()
+
+    def metrics_response(self):
+        """Request batching, prompt cache and grammar fast path metrics."""
+        return 200, self.metrics(), ()
+
+    def list_commands(self):
+        """List all stored commands."""
+        commands_list = self.list_command_files()
+        return 200, {"commands": commands_list, "count": len(commands_list)}, ()
+
+    def get_command(self, filename):
+        """Retrieve a specific command result."""
+        content = None
+        if filename and os.path.basename(filename) == filename:
+            content = self.read_command_file(filename)
+        if content is None:
+            return 404, {"error": "File not found", "filename": filename}, ()
+        return 200, content, ()
+
+    def read_process_request(self, body):
+        """Read the command from a /process body.  Returns (command, None), or (None, error response)."""
+        try:
+            data = json.loads(body.decode("utf-8"))
+        except ValueError:
+            data = None
+        if not isinstance(data, dict):
+            return None, (400, {
+                "error": "Invalid request format. JSON expected.",
+                "received": str(body)
+            }, ())
+
+        command = data.get("command")
+        if not command:
+            return None, (400, {"error": "Command is required.", "received_data": data}, ())
+
+        logger.info(f"Processing command: {command}")
+        return command, None
+
+    def process(self, body):
+        """Process a shape generation command."""
+        command, error = self.read_process_request(body)
+        if error:
+            return error
+        try:
+            output = self.process_and_save_command(command)
+        except QueueFullError as e:
+            return queue_full_response(e)
+        logger.info(f"Generated output: {output}")
+        return 200, output, ()
+
+    async def process_async(self, body):
+        """Process a shape generation command, without blocking the event loop."""
+        command, error = self.read_process_request(body)
+        if error:
+            return error
+        try:
+            output = await self.process_and_save_command_async(command)
+        except QueueFullError as e:
+            return queue_full_response(e)
+        logger.info(f"Generated output: {output}")
+        return 200, output, ()
+
+    async def handle_async_request(self, method, path, body):
+        """Route one request.  Returns (status, payload, headers)."""
+        for route_method, rule, handler, async_handler in self.routes():
+            params = match_route(rule, path)
+            if route_method != method or params is None:
+                continue
+            if method == "POST":
+                params["body"] = body
+            if async_handler:
+                return await async_handler(**params)
+            # The other handlers read files, so they run on the I/O pool
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.io_pool, partial(handler, **params))
+        return 404, {"error": "Not found", "path": path}, ()
+
+    async def asgi_app(self, scope, receive, send):
+        """ASGI application serving the same endpoints as the Flask app."""
+        if scope["type"] == "lifespan":
+            while True:
+                message = await receive()
+                if message["type"] == "lifespan.startup":
+                    await send({"type": "lifespan.startup.complete"})
+                elif message["type"] == "lifespan.shutdown":
+                    self.io_pool.shutdown(wait=False)
+                    await send({"type": "lifespan.shutdown.complete"})
+                    return
+        if scope["type"] != "http":
+            return
+
+        method = scope["method"]
+        path = scope["path"]
+        logger.info(f"Request: {method} {path}")
+        if method == "OPTIONS":
+            # CORS preflight, as flask_cors allows all origins.
+            await send({
+                "type": "http.response.start",
+                "status": 204,
+                "headers": [
+                    (b"access-control-allow-origin", b"*"),
+                    (b"access-control-allow-methods", b"GET, POST, OPTIONS"),
+                    (b"access-control-allow-headers", b"*"),
+                ],
+            })
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        body = await read_body(receive)
+        try:
+            status, payload, headers = await self.handle_async_request(method, path, body)
+        except Exception as e:
+            logger.error(f"Error in {method} {path}: {str(e)}")
+            status, payload, headers = error_response(e)
+        await send_json(send, status, payload, headers)
+
+def queue_full_response(error):
+    """Response for a request turned away by a full batching queue."""
+    return 429, {"error": str(error)}, (("Retry-After", "1"),)
+
+def error_response(error):
+    """Response for an unexpected error in a handler."""
+    return 500, {"error": str(error), "type": type(error).__name__}, ()
+
+def match_route(rule, path):
+    """Match a path against a Flask style rule, returning its <parameters>, or None."""
+    rule_parts = rule.split("/")
+    path_parts = path.split("/")
+    if len(rule_parts) != len(path_parts):
+        return None
+    params = {}
+    for rule_part, path_part in zip(rule_parts, path_parts):
+        if rule_part.startswith("<") and rule_part.endswith(">"):
+            if not path_part:
+                return None
+            params[rule_part[1:-1]] = unquote(path_part)
+        elif rule_part != path_part:
+            return None
+    return params
+
+def error_handler(f):
+    """Decorator for consistent error handling across routes."""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        try:
+            return f(*args, **kwargs)
+        except Exception as e:
+            logger.error(f"Error in {f.__name__}: {str(e)}")
+            status, payload, _ = error_response(e)
+            return jsonify(payload), status
+    return decorated_function
+
+def flask_view(handler, takes_body=False):
+    """Wrap a CommandService handler as a Flask view."""
+    @wraps(handler)
+    def view(**params):
+        if takes_body:
+            params["body"] = request.get_data()
+        status, payload, headers = handler(**params)
+        response = jsonify(payload)
+        for name, value in headers:
+            response.headers[name] = value
+        return response, status
+    return view
+
+def register_routes(app, service):
+    """Add the endpoints for a CommandService to a Flask app."""
+    for method, rule, handler, _ in service.routes():
+        view = error_handler(flask_view(handler, takes_body=method == "POST"))
+        app.add_url_rule(rule, endpoint=handler.__name__, view_func=view, methods=[method])
+
+    @app.before_request
+    def log_request_info():
+        """Log details about each request."""
+        logger.info(f"Request: {request.method} {request.url}")
+        if request.is_json:
+            logger.info(f"Request data: {request.get_json(silent=True)}")
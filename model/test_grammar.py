@@ -0,0 +1,41 @@
+"""
+Checks the grammar fast path against the training prompt sets: every
+prompt it answers must get the output of its training label.  Run from
+the model directory with pytest.
+"""
+import os
+import json
+
+import pytest
+
+pytest.importorskip("flask")
+
+import serving
+
+PROMPTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "train", "prompts")
+
+def load_rows(name):
+    with open(os.path.join(PROMPTS_DIR, name), "r") as file:
+        return [json.loads(line) for line in file if line.strip()]
+
+@pytest.mark.parametrize("name", ["simple_prompts.jsonl", "expanded_prompts.jsonl"])
+def test_grammar_matches_labels(name):
+    parser = serving.GrammarParser()
+    answered = 0
+    for row in load_rows(name):
+        parsed_output = parser.resolve(row["input"])
+        if parsed_output is not None:
+            answered += 1
+            assert parsed_output == serving.parse_generated_text(row["output"]), row["input"]
+    assert answered > 0
+
+def test_arcs_fall_back_by_default():
+    parser = serving.GrammarParser()
+    arcs = [row for row in load_rows("expanded_prompts.jsonl") if row["input"].startswith("arc ")]
+    assert arcs
+    assert all(parser.resolve(row["input"]) is None for row in arcs)
+    assert parser.metrics()["low_confidence_total"] == len(arcs)
+
+def test_object_prompts_fall_back():
+    parser = serving.GrammarParser()
+    assert all(parser.parse(row["input"])[0] is None for row in load_rows("object_prompts.jsonl"))
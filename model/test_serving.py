@@ -0,0 +1,78 @@
+"""
+Checks that the ASGI app and the Flask app answer requests the same way,
+with a fake model.  Run from the model directory with pytest.
+"""
+import json
+import asyncio
+
+import pytest
+
+pytest.importorskip("flask")
+
+import serving
+
+def fake_generator(commands, **kwargs):
+    text = '{"shape": "circle", "parameters": {"radius": 5}, "plane": "XYConstructionPlane", "coordinates": [0, 0, 2]}'
+    return [{"generated_text": text} for _ in commands]
+
+@pytest.fixture
+def service(tmp_path):
+    service = serving.CommandService(
+        fake_generator,
+        {"model_name": "fake_model", "backend": "pytorch"},
+        str(tmp_path),
+        grammar_config={"enabled": False}
+    )
+    yield service
+    service.io_pool.shutdown()
+
+def call_asgi(service, method, path, body=b""):
+    """Drive the ASGI app with one request, returning (status, headers, payload)."""
+    scope = {"type": "http", "method": method, "path": path}
+    messages = []
+
+    async def receive():
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    async def send(message):
+        messages.append(message)
+
+    asyncio.run(service.asgi_app(scope, receive, send))
+    start, response = messages
+    headers = {name.decode("latin-1"): value.decode("latin-1") for name, value in start["headers"]}
+    return start["status"], headers, json.loads(response["body"])
+
+def call_flask(service, method, path, body=b""):
+    """Send one request to a Flask app with the service's routes, returning (status, headers, payload)."""
+    from flask import Flask
+    app = Flask(__name__)
+    serving.register_routes(app, service)
+    response = app.test_client().open(path, method=method, data=body, content_type="application/json")
+    return response.status_code, {name.lower(): value for name, value in response.headers}, response.get_json()
+
+@pytest.mark.parametrize("call", [call_asgi, call_flask])
+def test_queue_full_returns_429(service, monkeypatch, call):
+    def submit(command):
+        raise serving.QueueFullError("Request queue is full, try again shortly")
+    monkeypatch.setattr(service.batcher, "submit", submit)
+
+    status, headers, payload = call(service, "POST", "/process", json.dumps({"command": "circle radius 5"}).encode("utf-8"))
+    assert status == 429
+    assert headers["retry-after"] == "1"
+    assert payload == {"error": "Request queue is full, try again shortly"}
+
+@pytest.mark.parametrize("call", [call_asgi, call_flask])
+@pytest.mark.parametrize("body", [b"not json", b"[1, 2]", b'{"command": ""}'])
+def test_bad_body_returns_400(service, call, body):
+    status, headers, payload = call(service, "POST", "/process", body)
+    assert status == 400
+    assert "error" in payload
+
+def test_apps_match(service):
+    body = json.dumps({"command": "circle radius 5"}).encode("utf-8")
+    for method, path, body in [("POST", "/process", body), ("GET", "/commands", b""),
+                               ("GET", "/command/missing.json", b""), ("POST", "/process", b"not json")]:
+        asgi_status, _, asgi_payload = call_asgi(service, method, path, body)
+        flask_status, _, flask_payload = call_flask(service, method, path, body)
+        assert asgi_status == flask_status, path
+        assert asgi_payload == flask_payload, path